@@ -0,0 +1,80 @@
+"""
+Throughput comparison of the LZMA, bzip2 and gzip compression services, with one and with several workers.
+Run it from the root of the repository with: python -m benchmarks.bench_compression [size in MiB]
+"""
+import os
+import random
+import sys
+import time
+from typing import Generator
+
+from services.compression.compression_base import CompressionBase
+from services.compression.compression_service_bzip2 import CompressionServiceBzip2
+from services.compression.compression_service_gzip import CompressionServiceGzip
+from services.compression.compression_service_lzma import CompressionServiceLzma
+from utils.report_utils import Reporting, StageProgress
+
+CHUNK_SIZE = 1024 * 1024
+
+class NoReports:
+    def add_report(self, report: Reporting) -> None:
+        pass
+
+    def get_progress(self, worker_type: str, worker_id: object) -> StageProgress: # pylint: disable=unused-argument
+        return StageProgress()
+
+def build_corpus(size: int) -> bytes:
+    """
+    Mixes source code of the repository, generated text and incompressible data, like a typical backup.
+    """
+    sources = b""
+    for root, _, files in os.walk("."):
+        for file in files:
+            if file.endswith(".py"):
+                with open(os.path.join(root, file), "rb") as source:
+                    sources += source.read()
+    random.seed(0)
+    words = [bytes(random.choices(b"abcdefghijklmnopqrstuvwxyz", k=random.randint(2, 10))) for _ in range(5000)]
+    parts: list[bytes] = []
+    total = 0
+    while total < size:
+        part = random.choice([
+            sources,
+            b" ".join(random.choices(words, k=100_000)),
+            random.randbytes(256 * 1024)
+        ])
+        parts.append(part)
+        total += len(part)
+    return b"".join(parts)[:size]
+
+def chunks(data: bytes) -> Generator[bytes, None, None]:
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield data[start:start + CHUNK_SIZE]
+
+def measure(name: str, service: CompressionBase, data: bytes) -> None:
+    start = time.perf_counter()
+    compressed = b"".join(service.compress(chunks(data), NoReports())) # type: ignore
+    compress_duration = time.perf_counter() - start
+    start = time.perf_counter()
+    decompressed = b"".join(service.decompress(chunks(compressed), NoReports())) # type: ignore
+    decompress_duration = time.perf_counter() - start
+    assert decompressed == data
+    mib = len(data) / 1024 / 1024
+    print(f"{name:<28} {mib / compress_duration:8.1f} MiB/s {mib / decompress_duration:8.1f} MiB/s "
+          f"{len(compressed) / len(data) * 100:8.1f} %")
+
+def main() -> None:
+    size_in_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workers = max(2, os.cpu_count() or 1)
+    data = build_corpus(size_in_mib * 1024 * 1024)
+    print(f"Compressing {size_in_mib} MiB with up to {workers} workers")
+    print(f"{'':<28} {'compress':>14} {'decompress':>14} {'size':>10}")
+    measure("lzma level 6, 1 worker", CompressionServiceLzma(6), data)
+    measure(f"lzma level 6, {workers} workers", CompressionServiceLzma(6, workers, 8), data)
+    measure("bzip2 level 9, 1 worker", CompressionServiceBzip2(9), data)
+    measure(f"bzip2 level 9, {workers} workers", CompressionServiceBzip2(9, workers, 8), data)
+    measure("gzip level 6, 1 worker", CompressionServiceGzip(6), data)
+    measure(f"gzip level 6, {workers} workers", CompressionServiceGzip(6, workers), data)
+
+if __name__ == "__main__":
+    main()
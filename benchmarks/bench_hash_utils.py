@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of the streaming TreeHasher against the list based compute_sha256_tree_hash_for_aws.
+Run it from the root of the repository with: python -m benchmarks.bench_hash_utils
+"""
+import hashlib
+import os
+import time
+import tracemalloc
+from typing import Callable
+
+from utils.hash_utils import TreeHashCombiner, TreeHasher, compute_sha256_tree_hash_for_aws
+
+LEAF_SIZE = 1024 * 1024
+
+def list_based_tree_hash(data: bytes, chunk_size: int) -> str:
+    leaf_hashes: list[bytes] = []
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        for leaf_start in range(0, len(chunk), LEAF_SIZE):
+            leaf_hashes.append(hashlib.sha256(chunk[leaf_start:leaf_start + LEAF_SIZE]).digest())
+    return compute_sha256_tree_hash_for_aws(leaf_hashes)
+
+def streaming_tree_hash(data: bytes, chunk_size: int) -> str:
+    tree_hasher = TreeHasher()
+    view = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        tree_hasher.update(view[start:start + chunk_size])
+    return tree_hasher.hexdigest()
+
+def list_based_combine(leaf_hashes: list[bytes]) -> str:
+    return compute_sha256_tree_hash_for_aws(leaf_hashes)
+
+def streaming_combine(leaf_hashes: list[bytes]) -> str:
+    combiner = TreeHashCombiner()
+    for leaf_hash in leaf_hashes:
+        combiner.add(leaf_hash)
+    return combiner.hexdigest()
+
+def measure(name: str, function: Callable[[], str]) -> str:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<40} {duration * 1000:10.1f} ms {peak / 1024:12.1f} KiB peak")
+    return result
+
+def main() -> None:
+    # chunk size of 1 MiB, so the list based version does not need to copy the chunks to split them into leaves
+    data = os.urandom(256 * LEAF_SIZE)
+    print("Hashing 256 MiB of data in 1 MiB chunks:")
+    expected = measure("list based", lambda: list_based_tree_hash(data, LEAF_SIZE))
+    assert measure("TreeHasher", lambda: streaming_tree_hash(data, LEAF_SIZE)) == expected
+
+    leaf_hashes = [hashlib.sha256(i.to_bytes(8, "big")).digest() for i in range(1_000_000)]
+    print("Combining 1,000,000 leaf hashes (~1 TiB archive):")
+    expected = measure("compute_sha256_tree_hash_for_aws", lambda: list_based_combine(leaf_hashes))
+    assert measure("TreeHashCombiner", lambda: streaming_combine(leaf_hashes)) == expected
+
+if __name__ == "__main__":
+    main()
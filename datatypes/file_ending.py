@@ -1,6 +1,7 @@
 from enum import Enum
 class FileEndingCompression(Enum):
     BZIP2 = '.bz2'
+    GZIP = '.gz'
     LZMA = '.xz'
     NONE = ''
 
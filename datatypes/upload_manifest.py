@@ -0,0 +1,55 @@
+from typing import Any
+
+class UploadManifest:
+    """
+    Everything needed to resume an interrupted multipart upload.
+    The parts map the index of a part to its offset, size and tree hash (hex).
+    """
+    fingerprint: str
+    upload_id: str
+    vault: str
+    region: str
+    file_name: str
+    location: str
+    part_size: int
+    pipeline_state: dict[str, Any]
+    parts: dict[int, tuple[int, int, str]]
+    def __init__(self, fingerprint: str, upload_id: str, vault: str, region: str, file_name: str, location: str, # pylint: disable=too-many-arguments
+                 part_size: int, pipeline_state: dict[str, Any], parts: dict[int, tuple[int, int, str]] | None = None) -> None:
+        self.fingerprint = fingerprint
+        self.upload_id = upload_id
+        self.vault = vault
+        self.region = region
+        self.file_name = file_name
+        self.location = location
+        self.part_size = part_size
+        self.pipeline_state = pipeline_state
+        self.parts = parts if parts is not None else {}
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "upload_id": self.upload_id,
+            "vault": self.vault,
+            "region": self.region,
+            "file_name": self.file_name,
+            "location": self.location,
+            "part_size": self.part_size,
+            "pipeline_state": self.pipeline_state,
+            # json only allows strings as keys
+            "parts": {str(index): list(part) for index, part in self.parts.items()}
+        }
+
+    @staticmethod
+    def from_dict(d: dict[str, Any]) -> "UploadManifest":
+        return UploadManifest(
+            fingerprint=d["fingerprint"],
+            upload_id=d["upload_id"],
+            vault=d["vault"],
+            region=d["region"],
+            file_name=d["file_name"],
+            location=d["location"],
+            part_size=d["part_size"],
+            pipeline_state=d["pipeline_state"],
+            parts={int(index): (part[0], part[1], part[2]) for index, part in d["parts"].items()}
+        )
@@ -1,6 +1,8 @@
+import os
 from dependency_injection.service import Service
 from services.compression.compression_service_none import CompressionServiceNone
 from services.compression.compression_service_bzip2 import CompressionServiceBzip2
+from services.compression.compression_service_gzip import CompressionServiceGzip
 from services.compression.compression_service_lzma import CompressionServiceLzma
 from services.db_service import DbService
 from services.encryption.encryption_service_none import EncryptionServiceNone
@@ -25,19 +27,36 @@ def setup_factory_from_parameters( # pylint: disable=too-many-arguments
     dryrun: bool = False,
     compression_level: int = 6,
     password: str = "",
-    password_file: str = ""
+    password_file: str = "",
+    upload_memory_limit: int = 0,
+    upload_workers: int = 4,
+    min_upload_workers: int = 1,
+    max_upload_workers: int = 8,
+    upload_attempts: int = 5,
+    compression_workers: int | None = None,
+    compression_block_size: int = 32,
+    gzip_block_size: int = 128,
+    encryption_workers: int = 4,
+    prefetch_files: int = 8,
+    prefetch_memory_in_mb: int = 64
     ) -> None:
     if compression == "none":
         service.set_service(CompressionServiceNone(), "compression_service")
+    # lzma and bzip2 compress worse in independent blocks, so they use them only if workers are given.
+    # The blocks of gzip are joined into a single stream, so it uses every CPU by default
+    block_workers = compression_workers if compression_workers is not None else 1
+    gzip_workers = compression_workers if compression_workers is not None else os.cpu_count() or 1
     if compression == "bzip2":
-        service.set_service(CompressionServiceBzip2(), "compression_service")
+        service.set_service(CompressionServiceBzip2(compression_level, block_workers, compression_block_size), "compression_service")
+    if compression == "gzip":
+        service.set_service(CompressionServiceGzip(compression_level, gzip_workers, gzip_block_size), "compression_service")
     if compression == "lzma":
-        service.set_service(CompressionServiceLzma(compression_level=compression_level), "compression_service")
+        service.set_service(CompressionServiceLzma(compression_level, block_workers, compression_block_size), "compression_service")
 
     if encryption == "none":
         service.set_service(EncryptionServiceNone(), "encryption_service")
     if encryption == "aes":
-        service.set_service(EncryptionServiceAes(password, password_file), "encryption_service")
+        service.set_service(EncryptionServiceAes(password, password_file, encryption_workers), "encryption_service")
     if encryption == "rsa":
         service.set_service(EncryptionServiceRsa(), "encryption_service")
 
@@ -46,13 +65,23 @@ def setup_factory_from_parameters( # pylint: disable=too-many-arguments
     if filetype == "tar":
         service.set_service(FiletypeServiceTar(), "filetype_service")
     if filetype == "zip":
-        service.set_service(FiletypeServiceZip(compression_level=0, chunk_size=10*1024*1024), "filetype_service")
+        service.set_service(FiletypeServiceZip(compression_level=0, chunk_size=10*1024*1024,
+                                               prefetch_files=prefetch_files, prefetch_memory=prefetch_memory_in_mb*1024*1024), "filetype_service")
 
     if transfer_method == "save":
         current_date = date.today().strftime("%d-%m-%Y")
         service.set_service(TransferServiceSave(service, "", current_date), "transfer_service")
     if transfer_method == "glacier":
-        service.set_service(TransferServiceGlacier(service, dryrun, transfer_chunk_size), "transfer_service")
+        service.set_service(TransferServiceGlacier(
+            service,
+            dryrun,
+            transfer_chunk_size,
+            upload_memory_limit,
+            upload_workers,
+            min_upload_workers,
+            max_upload_workers,
+            upload_attempts
+        ), "transfer_service")
 
     service.set_service(CancelService(), "cancel_service")
     service.set_service(DbService("uploads.json"), "db_uploads_service")
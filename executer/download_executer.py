@@ -1,4 +1,9 @@
-from typing import Any
+import functools
+import os
+import shlex
+import shutil
+import sys
+from typing import Any, Callable
 from tinydb import Query
 from tinydb.table import Document
 
@@ -8,6 +13,8 @@ from dependency_injection.service import Service
 from services.compression.compression_base import CompressionBase
 from services.compression.compression_service_bzip2 import \
     CompressionServiceBzip2
+from services.compression.compression_service_gzip import \
+    CompressionServiceGzip
 from services.compression.compression_service_lzma import \
     CompressionServiceLzma
 from services.compression.compression_service_none import \
@@ -25,7 +32,9 @@ from services.service_base import ServiceBase
 from services.transfer.transfer_base import TransferBase
 from services.transfer.transfer_service_glacier import GlacierInformation, TransferServiceGlacier
 from services.transfer.transfer_service_save import SaveInformation, TransferServiceSave
-from utils.console_utils import print_error, print_success
+from utils.console_utils import console, print_error, print_success, print_warning
+from utils.dedup_utils import DeduplicatedArchives, get_referenced_uploads, restore_files
+from utils.pipeline_utils import Pipeline
 from utils.report_utils import ReportManager
 
 
@@ -54,20 +63,62 @@ def _get_archive_informations(service: Service, download_id: str) -> Document |
         return docs[0]
     return docs
 
-def _file_ending_service_mapping(service: Service, encryption_ending: str, compression_ending: str, filetype_ending: str, upload_info: dict[str, Any], password: str, password_file: str, location: str, file_name: str) -> tuple[list[tuple[str, ServiceBase]], TransferInformation]:
+def _get_upload_chain(service: Service, upload: Document) -> list[Document]:
+    """
+    Returns the uploads a full restore combines, from the first full upload to the given one.
+    """
+    db_uploads_service: DbService = service.get_service("db_uploads_service")
+    db = db_uploads_service.get_context()
+    chain = [upload]
+    parent = upload.get("incremental", {}).get("parent")
+    while parent is not None and parent not in [chain_upload.doc_id for chain_upload in chain]:
+        parent_upload = db.get(doc_id=parent)
+        if not isinstance(parent_upload, Document):
+            print_warning(f"Upload {parent}, which upload {chain[-1].doc_id} is based on, does not exist anymore. The restore below is incomplete")
+            break
+        chain.append(parent_upload)
+        parent = parent_upload.get("incremental", {}).get("parent")
+    chain.reverse()
+    return chain
+
+def _print_incremental_restore(service: Service, upload: Document, profile: str, location: str, password_file: str) -> None:
+    """
+    Prints the downloads that restore the files as of an incremental upload, in order, with the files each of them deleted.
+    The downloads only save the archives, extracting them and deleting the files is left to the user.
+    """
+    chain = _get_upload_chain(service, upload)
+    options = ["--profile", profile, "--location", location]
+    if password_file:
+        options += ["--password-file", password_file]
+    console.print(f"Upload {upload.doc_id} only contains the changes since upload {upload['incremental']['parent']}. "
+                  "To restore the files as of this upload, run these downloads in this order. Extract each archive over the files "
+                  "of the ones before it, then delete the files listed below it:", markup=False, highlight=False)
+    for step, chain_upload in enumerate(chain, start=1):
+        command = shlex.join([sys.executable, sys.argv[0], "download", "--id", str(chain_upload.doc_id)] + options)
+        console.print(f"  {step}. {command}", markup=False, highlight=False, soft_wrap=True)
+        for path in chain_upload.get("incremental", {}).get("deleted", []):
+            console.print(f"       delete {path}", markup=False, highlight=False, soft_wrap=True)
+    if not password_file and any(chain_upload.get("encryption") for chain_upload in chain):
+        console.print("The uploads are encrypted, add --password or --password-file to each download.", markup=False, highlight=False)
+
+def _file_ending_service_mapping(service: Service, encryption_ending: str, compression_ending: str, filetype_ending: str, upload_info: dict[str, Any], password: str, password_file: str, location: str, file_name: str, # pylint: disable=too-many-arguments
+                                 download_workers: int = 4, download_range_size_in_mb: int = 32, decompression_workers: int = 1,
+                                 decryption_workers: int = 1) -> tuple[list[tuple[str, ServiceBase]], TransferInformation]:
     mapped_services: list[tuple[str, ServiceBase]] =  []
     match compression_ending:
         case FileEndingCompression.BZIP2.value:
-            mapped_services.append(("compression_service", CompressionServiceBzip2()))
+            mapped_services.append(("compression_service", CompressionServiceBzip2(workers=decompression_workers)))
+        case FileEndingCompression.GZIP.value:
+            mapped_services.append(("compression_service", CompressionServiceGzip()))
         case FileEndingCompression.LZMA.value:
-            mapped_services.append(("compression_service", CompressionServiceLzma()))
+            mapped_services.append(("compression_service", CompressionServiceLzma(workers=decompression_workers)))
         case FileEndingCompression.NONE.value:
             mapped_services.append(("", CompressionServiceNone()))
         case _:
             raise ValueError("Compression not found.")
     match encryption_ending:
         case FileEndingEncryption.AES.value:
-            mapped_services.append(("encryption_service", EncryptionServiceAes(password, password_file)))
+            mapped_services.append(("encryption_service", EncryptionServiceAes(password, password_file, decryption_workers)))
         case FileEndingEncryption.RSA.value:
             mapped_services.append(("encryption_service", EncryptionServiceRsa()))
         case FileEndingEncryption.NONE.value:
@@ -98,7 +149,11 @@ def _file_ending_service_mapping(service: Service, encryption_ending: str, compr
 
             return mapped_services, SaveInformation(file_name, size, location)
         case TransferServiceType.GLACIER.value:
-            mapped_services.append(("transfer_service", TransferServiceGlacier(service)))
+            mapped_services.append(("transfer_service", TransferServiceGlacier(
+                service,
+                download_workers=download_workers,
+                download_range_size_in_mb=download_range_size_in_mb
+            )))
             dryrun = upload_info["dryrun"]
             assert isinstance(dryrun, bool)
             region = upload_info["region"]
@@ -125,11 +180,13 @@ def _file_ending_service_mapping(service: Service, encryption_ending: str, compr
             raise ValueError("Transfer type not found.")
     assert False
 
-def download(service: Service, profile: str, location:str, download_id:str, password:str, password_file:str) -> int:
-    upload_information = _get_archive_informations(service, download_id)
-    if upload_information is None:
-        print_error("Download ID not found.")
-        return 1
+def _download_archive(service: Service, upload_information: Document, location: str, password: str, password_file: str, # pylint: disable=too-many-arguments
+                      download_workers: int, download_range_size_in_mb: int, decompression_workers: int, decryption_workers: int,
+                      pipeline_queue_size: int, pipeline_chunk_size_in_kb: int) -> str:
+    """
+    Downloads, decrypts and decompresses an upload into the location.
+    :return: The path of the written archive
+    """
     info_dict = dict(upload_information)
     information = info_dict["information"]
     encryption = info_dict["encryption"]
@@ -148,7 +205,11 @@ def download(service: Service, profile: str, location:str, download_id:str, pass
         password,
         password_file,
         "",
-        ""
+        "",
+        download_workers,
+        download_range_size_in_mb,
+        decompression_workers,
+        decryption_workers
         )
     for service_name, service_class in services:
         service.set_service(service_class, service_name)
@@ -159,12 +220,66 @@ def download(service: Service, profile: str, location:str, download_id:str, pass
 
     status_report_manager= ReportManager(service)
 
-    transfer_generator = transfer_service.download(transfer_information, status_report_manager)
-    encrypted_generator = encryption_service.decrypt(transfer_generator, status_report_manager)
-    compressed_generator = compression_service.decompress(encrypted_generator, status_report_manager)
-    filetype_service.unpack(compressed_generator, location, transfer_information.file_name, status_report_manager)
+    # every stage runs in its own thread, the unpacking reads the last one
+    with Pipeline(service.get_service("cancel_service"), pipeline_queue_size) as pipeline:
+        # the decryption and decompression without a key or codec pass the chunks on unchanged, the rechunking copies them
+        transfer_service.set_chunk_hold(pipeline.get_chunk_hold(stages=2))
+        transfer_generator = pipeline.run_stage("transferer", transfer_service.download(transfer_information, status_report_manager))
+        encrypted_generator = pipeline.run_stage("crypter", encryption_service.decrypt(transfer_generator, status_report_manager))
+        compressed_generator = pipeline.run_stage("compressor", pipeline.rechunk(compression_service.decompress(encrypted_generator, status_report_manager),
+                                                                                 pipeline_chunk_size_in_kb * 1024))
+        archive = filetype_service.unpack(compressed_generator, location, transfer_information.file_name, status_report_manager)
 
     status_report_manager.stop_reporting()
+    for stage, histogram in pipeline.histograms.items():
+        console.print(f"Chunk sizes of the {stage}: {histogram}")
 
     print_success(f"[bold green]Download completed. {transfer_information.file_name} written to '{location}'.")
+    return archive
+
+def _restore_deduplicated(service: Service, upload: Document, archive: str, location: str,
+                          download_archive: Callable[[Document, str], str]) -> list[str]:
+    """
+    Rebuilds the files of a deduplicated upload with its recipe. The earlier uploads storing chunks the recipe refers to
+    are downloaded as well, below the location, and removed again once the files are written.
+    :return: The paths of the written files
+    """
+    db_uploads_service: DbService = service.get_service("db_uploads_service")
+    db = db_uploads_service.get_context()
+    chunks_location = os.path.join(location, f"chunks_of_upload_{upload.doc_id}")
+    archives = DeduplicatedArchives()
+    try:
+        archives.add(upload.doc_id, archive)
+        recipe = archives.read_recipe(upload.doc_id)
+        for upload_id in sorted(get_referenced_uploads(recipe)):
+            referenced_upload = db.get(doc_id=upload_id)
+            if not isinstance(referenced_upload, Document):
+                raise ValueError(f"Upload {upload_id}, which stores chunks of the files, does not exist anymore")
+            console.print(f"Downloading the chunks of upload {upload_id} the files refer to")
+            upload_location = os.path.join(chunks_location, str(upload_id))
+            os.makedirs(upload_location, exist_ok=True)
+            archives.add(upload_id, download_archive(referenced_upload, upload_location))
+        return restore_files(recipe, upload.doc_id, archives.read_chunk_data, location)
+    finally:
+        archives.close()
+        shutil.rmtree(chunks_location, ignore_errors=True)
+
+def download(service: Service, profile: str, location:str, download_id:str, password:str, password_file:str, # pylint: disable=too-many-arguments
+             download_workers: int = 4, download_range_size_in_mb: int = 32, decompression_workers: int = 1, decryption_workers: int = 1,
+             pipeline_queue_size: int = 4, pipeline_chunk_size_in_kb: int = 1024) -> int:
+    upload_information = _get_archive_informations(service, download_id)
+    if upload_information is None:
+        print_error("Download ID not found.")
+        return 1
+    download_archive = functools.partial(_download_archive, service, password=password, password_file=password_file,
+                                         download_workers=download_workers, download_range_size_in_mb=download_range_size_in_mb,
+                                         decompression_workers=decompression_workers, decryption_workers=decryption_workers,
+                                         pipeline_queue_size=pipeline_queue_size, pipeline_chunk_size_in_kb=pipeline_chunk_size_in_kb)
+    archive = download_archive(upload_information, location)
+
+    if upload_information.get("deduplicated"):
+        restored = _restore_deduplicated(service, upload_information, archive, location, download_archive)
+        print_success(f"Restored {len(restored)} files of the deduplicated upload to '{location}'.")
+    if "incremental" in upload_information and upload_information["incremental"]["parent"] is not None:
+        _print_incremental_restore(service, upload_information, profile, location, password_file)
     return 0
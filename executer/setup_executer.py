@@ -57,8 +57,9 @@ def create_vault(region: str) -> str:
     return vault_name
 
 def choose_compression() -> str:
-    compression_type_list = ["None", "lzma", "bzip2"]
-    compression_type_list_with_description = ["None", "lzma   (default)", "bzip2  (higher compression -> smaller Filesize, slower)"]
+    compression_type_list = ["None", "lzma", "bzip2", "gzip"]
+    compression_type_list_with_description = ["None", "lzma   (default)", "bzip2  (higher compression -> smaller Filesize, slower)",
+                                              "gzip   (fast, lower compression)"]
     result = force_user_input_from_list("Choose your Compression:", compression_type_list_with_description)
     return compression_type_list[result - 1]
 
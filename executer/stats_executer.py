@@ -0,0 +1,52 @@
+from typing import Any
+
+from rich.table import Table
+
+from dependency_injection.service import Service
+from services.db_service import DbService
+from utils.console_utils import console, print_error
+from utils.data_utils import bytes_to_human_readable_size
+
+STAGES = ["packer", "compressor", "crypter", "transferer"]
+
+def _format_throughput(stages: list[dict[str, Any]], name: str, bottleneck: str) -> str:
+    for stage in stages:
+        if stage["name"] == name:
+            throughput = f"{bytes_to_human_readable_size(stage['throughput'])}/s"
+            return f"[bold red]{throughput}[/bold red]" if name == bottleneck else throughput
+    return "-"
+
+def stats(service: Service, limit: int = 20) -> int:
+    """
+    Shows the statistics of the most recent uploads: the duration, the compression ratio
+    and the throughput of every stage, with the bottleneck highlighted.
+    """
+    db_uploads_service: DbService = service.get_service("db_uploads_service")
+    uploads = [upload for upload in db_uploads_service.get_context().all() if "statistics" in upload]
+    if len(uploads) == 0:
+        print_error("No uploads with statistics found.")
+        return 1
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("ID", justify="right")
+    table.add_column("Date", justify="center")
+    table.add_column("Size", justify="right")
+    table.add_column("Duration", justify="right")
+    table.add_column("Ratio", justify="right")
+    for stage in STAGES:
+        table.add_column(stage.capitalize(), justify="right")
+    table.add_column("Bottleneck", justify="center")
+    for upload in uploads[-limit:]:
+        statistics = upload["statistics"]
+        stages = statistics["stages"]
+        ratio = statistics.get("compression_ratio")
+        table.add_row(
+            str(upload.doc_id),
+            upload["upload_datetime_utc"][:19],
+            bytes_to_human_readable_size(stages[0]["bytes_in"]),
+            f"{statistics['duration_seconds']:.1f} s",
+            f"{ratio:.2f}" if ratio is not None else "-",
+            *[_format_throughput(stages, stage, statistics["bottleneck"]) for stage in STAGES],
+            statistics["bottleneck"]
+        )
+    console.print(table)
+    return 0
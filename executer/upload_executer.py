@@ -1,16 +1,26 @@
 import datetime
-from typing import Any
+import itertools
+import uuid
+from typing import Any, Iterator
 from datatypes.transfer_services import TransferInformation
 from dependency_injection.service import Service
 from services.compression.compression_base import CompressionBase
+from services.compression.compression_service_none import CompressionServiceNone
+from services.chunk_index_service import ChunkIndexService
 from services.db_service import DbService
 from services.encryption.encryption_base import EncryptionBase
+from services.file_index_service import FileChanges, FileIndexService
 from services.filetype.filetype_base import FiletypeBase
 from services.setting_service import SettingService
 from services.transfer.transfer_base import TransferBase
-from utils.report_utils import ReportManager
-from utils.storage_utils import get_all_files_from_directories_and_files
+from utils.compressibility_utils import PROBE_SAMPLE_FILES, get_incompressible_percentage, probe_files
+from utils.dedup_utils import CdcChunker
+from utils.metrics_utils import MetricsFileWriter
+from utils.pipeline_utils import Pipeline
+from utils.report_utils import ReportManager, Reporting
+from utils.storage_utils import FilesFingerprint, ScannedFile, get_files_fingerprint, scan_files
 from utils.console_utils import console, print_error
+from utils.data_utils import bytes_to_human_readable_size
 
 
 class UploadDbEntry:
@@ -19,25 +29,80 @@ class UploadDbEntry:
     compression: str
     filetype: str
     information: TransferInformation
-    def __init__(self, upload_datetime_utc:str, encryption:str, compression:str, filetype:str, information:TransferInformation):
+    statistics: dict[str, Any] | None
+    parent: int | None
+    deleted: list[str] | None
+    deduplicated: bool
+    def __init__(self, upload_datetime_utc:str, encryption:str, compression:str, filetype:str, information:TransferInformation, # pylint: disable=too-many-arguments
+                 statistics: dict[str, Any] | None = None, parent: int | None = None, deleted: list[str] | None = None,
+                 deduplicated: bool = False):
+        """
+        :param parent: Id of the upload an incremental upload is based on, None for the first upload of a chain
+        :param deleted: Files deleted since the parent upload. Only set for incremental uploads
+        :param deduplicated: If the upload only contains new chunks and a recipe, which may refer to chunks of earlier uploads
+        """
         self.upload_datetime_utc = upload_datetime_utc
         self.encryption = encryption
         self.compression = compression
         self.filetype = filetype
         self.information = information
+        self.statistics = statistics
+        self.parent = parent
+        self.deleted = deleted
+        self.deduplicated = deduplicated
         super().__init__()
 
     def as_dict(self) -> dict[str, Any]:
-        d = {
+        d: dict[str, Any] = {
             "upload_datetime_utc":  self.upload_datetime_utc,
             "encryption": self.encryption,
             "compression": self.compression,
             "filetype": self.filetype,
             "information": self.information.as_dict()
         }
+        if self.statistics is not None:
+            d["statistics"] = self.statistics
+        if self.deleted is not None:
+            d["incremental"] = {"parent": self.parent, "deleted": self.deleted}
+        if self.deduplicated:
+            d["deduplicated"] = True
         return d
 
-def upload(service: Service, profile: str, paths: list[str]) -> int:
+def _get_changed_options(recorded: dict[str, Any], current: dict[str, Any], prefix: str = "") -> list[str]:
+    """
+    Compares the options a resumed upload was started with to the current ones.
+    :return: The options which differ, as "name: recorded -> current"
+    """
+    changed: list[str] = []
+    for name in sorted(recorded.keys() | current.keys()):
+        recorded_value, current_value = recorded.get(name), current.get(name)
+        if isinstance(recorded_value, dict) and isinstance(current_value, dict):
+            changed.extend(_get_changed_options(recorded_value, current_value, f"{prefix}{name}."))
+        elif recorded_value != current_value:
+            changed.append(f"{prefix}{name}: {recorded_value} -> {current_value}")
+    return changed
+
+def _resume(transfer_service: TransferBase, encryption_service: EncryptionBase, fingerprint: str, output_options: dict[str, Any]) -> bool:
+    """
+    Makes the upload continue the interrupted upload of the files, if it was started with the same options.
+    :return: False if there is no such upload
+    """
+    pipeline_state = transfer_service.resume(fingerprint)
+    if pipeline_state is None:
+        print_error("There is no interrupted upload of these files with these options to resume")
+        return False
+    # uploads interrupted before the options were recorded are only checked part by part
+    changed_options = _get_changed_options(pipeline_state.get("options", output_options), output_options)
+    if changed_options:
+        print_error("The upload was started with other options, resume it with the same options: " + ", ".join(changed_options))
+        return False
+    encryption_service.restore_state(pipeline_state["encryption"])
+    return True
+
+def upload(service: Service, profile: str, paths: list[str], resume: bool = False, skip_compression_threshold: float = 90.0, # pylint: disable=too-many-arguments
+           pipeline_queue_size: int = 4, pipeline_chunk_size_in_kb: int = 1024,
+           metrics_file: str | None = None, scan_workers: int = 8, incremental: bool = False,
+           deduplicate: bool = False, dedup_chunk_size_in_kb: int = 256) -> int:
     setting_service: SettingService = service.get_service("setting_service")
     assert setting_service is not None
     vault = setting_service.read_settings(profile, "vault")
@@ -47,35 +112,156 @@ def upload(service: Service, profile: str, paths: list[str]) -> int:
     filetype_service: FiletypeBase = service.get_service("filetype_service")
     db_uploads_service: DbService = service.get_service("db_uploads_service")
 
-    # Get all files from the given paths
-    with console.status("[bold green]Gathering information about the files..."):
-        files = get_all_files_from_directories_and_files(paths)
-    if len(files) == 0:
-        print_error(f"No files found in {paths}")
+    # The files of the given paths are packed while they are scanned. They are ordered, so the fingerprint of the same files stays the same.
+    # A resume needs the fingerprint up front and an incremental upload compares the files with the last upload, so both scan all files first
+    scanned_files: list[ScannedFile] | None = None
+    if resume or incremental:
+        with console.status("[bold green]Gathering information about the files..."):
+            scanned_files = list(scan_files(paths, scan_workers, ordered=True))
+        if len(scanned_files) == 0:
+            print_error(f"No files found in {paths}")
+            return 1
+
+    # the indexes of the profile are only changed by uploads that really took place
+    dryrun = transfer_service.is_dryrun()
+    file_index_service: FileIndexService | None = None
+    chunk_index_service: ChunkIndexService | None = None
+    try:
+        # an incremental upload only packs the files which changed since the last upload of the profile
+        changes: FileChanges | None = None
+        parent: int | None = None
+        if incremental:
+            assert scanned_files is not None
+            file_index_service = FileIndexService(profile)
+            parent = file_index_service.get_last_upload_id()
+            with console.status("[bold green]Comparing the files with the last upload..."):
+                changes = file_index_service.find_changes(scanned_files, paths)
+            if parent is None:
+                console.print("There is no previous upload of this profile, all files are uploaded")
+            elif changes.is_empty():
+                console.print(f"Nothing changed since upload {parent}")
+                if not dryrun:
+                    file_index_service.update(changes, {}, parent)
+                return 0
+            else:
+                console.print(f"{len(changes.changed)} new or changed and {len(changes.deleted)} deleted files since upload {parent}")
+            scanned_files = changes.changed
+            filetype_service.set_content_hashing(True)
+
+        # files that are compressed already are only stored, and if most of the data is, the compression is skipped.
+        # That is decided by a sample of the first files probed in parallel, the packer probes the other files with their first chunk
+        files: Iterator[ScannedFile] = iter(scanned_files) if scanned_files is not None else scan_files(paths, scan_workers, ordered=True)
+        with console.status("[bold green]Probing the compressibility of the files..."):
+            sample = list(itertools.islice(files, PROBE_SAMPLE_FILES))
+            probes = probe_files(sample, scan_workers)
+        if scanned_files is None and len(sample) == 0:
+            print_error(f"No files found in {paths}")
+            return 1
+        files = itertools.chain(sample, files)
+
+        if scanned_files is not None:
+            files_text = f"{len(scanned_files)} " + ("file" if len(scanned_files) == 1 else "files")
+        else:
+            files_text = f"the files in {', '.join(paths)}"
+        console.print(f"Trying to upload {files_text} to [bold purple]{vault}[/bold purple]"
+                            f" using profile: [bold purple]{profile}[/bold purple]")
+        incompressible_percentage = get_incompressible_percentage(probes)
+        skip_compression = compression_service.get_extension() != "" and incompressible_percentage >= skip_compression_threshold
+        if skip_compression:
+            console.print(f"Skipping the compression, {incompressible_percentage:.0f}% of the data is compressed already")
+            compression_service = CompressionServiceNone()
+            service.set_service(compression_service, "compression_service")
+        filetype_service.set_compressibility(probes, compress_members=compression_service.get_extension() == "")
+
+        # chunks already uploaded are only referenced by the recipe of the upload
+        if deduplicate:
+            chunk_index_service = ChunkIndexService(profile)
+            filetype_service.set_deduplication(chunk_index_service, CdcChunker.from_average_size(dedup_chunk_size_in_kb * 1024))
+
+        # a resumed upload has to produce the same data, so everything that changes it is recorded with the upload
+        output_options: dict[str, Any] = {
+            "filetype": filetype_service.get_output_options(),
+            "compression": compression_service.get_output_options(),
+            "encryption": encryption_service.get_output_options(),
+            "pipeline_chunk_size": pipeline_chunk_size_in_kb * 1024
+        }
+        fingerprint = FilesFingerprint(TransferBase.get_file_extension(service), *(["deduplicated"] if deduplicate else []))
+        if scanned_files is None:
+            # the fingerprint is complete when the scan is done, the upload can be resumed from then on
+            transfer_service.set_resumable(None, {"encryption": encryption_service.get_state(), "options": output_options})
+            files = fingerprint.track(files, transfer_service.set_fingerprint)
+        else:
+            files_fingerprint = get_files_fingerprint(scanned_files, *fingerprint.options)
+            if resume:
+                if not _resume(transfer_service, encryption_service, files_fingerprint, output_options):
+                    return 1
+            else:
+                transfer_service.set_resumable(files_fingerprint, {"encryption": encryption_service.get_state(), "options": output_options})
+            files = fingerprint.track(files)
+
+        status_report_manager= ReportManager(service)
+        metrics_writer = MetricsFileWriter(metrics_file, status_report_manager, {"profile": profile}) if metrics_file else None
+        if metrics_writer is not None:
+            metrics_writer.start()
+        if skip_compression:
+            status_report_manager.add_report(Reporting("compressor", uuid.uuid4(), "finished", "skipped",
+                                                       f"Compression skipped, {incompressible_percentage:.0f}% of the data is incompressible"))
+
+        # every stage runs in its own thread, the upload reads the last one.
+        # Reporting and the metrics stop as well if a stage fails, the metrics then record a failed upload
+        upload_status = False
+        try:
+            with Pipeline(service.get_service("cancel_service"), pipeline_queue_size) as pipeline:
+                packed_generator = pipeline.run_stage("packer", filetype_service.pack(files, status_report_manager))
+                # without encryption the crypter passes the chunks on unchanged, so they are held until the upload is done with them
+                compressed_generator = pipeline.run_stage("compressor", pipeline.rechunk(compression_service.compress(packed_generator, status_report_manager),
+                                                                                         pipeline_chunk_size_in_kb * 1024, stages=2))
+                encrypted_generator = pipeline.run_stage("crypter", encryption_service.encrypt(compressed_generator, status_report_manager))
+                upload_status, upload_information = transfer_service.upload(encrypted_generator,status_report_manager)
+        finally:
+            status_report_manager.stop_reporting()
+            if metrics_writer is not None:
+                metrics_writer.stop(upload_status)
+
+        # the size of the files is known once they were packed
+        pipeline.input_size = fingerprint.total_size
+        console.print(f"Packed {fingerprint.file_count} {'file' if fingerprint.file_count == 1 else 'files'} "
+                      f"({bytes_to_human_readable_size(fingerprint.total_size)})")
+        for stage, histogram in pipeline.histograms.items():
+            console.print(f"Chunk sizes of the {stage}: {histogram}")
+        statistics = pipeline.get_summary("transferer")
+        throughputs = ", ".join(f"{stage['name']} {bytes_to_human_readable_size(stage['throughput'])}/s" for stage in statistics["stages"])
+        console.print(f"Bottleneck: {statistics['bottleneck']} ({throughputs})")
+
+        if upload_status:
+            assert upload_information is not None
+            db_information = UploadDbEntry(
+                upload_datetime_utc = str(datetime.datetime.now(datetime.UTC)),
+                encryption = encryption_service.get_extension(),
+                compression = compression_service.get_extension(),
+                filetype = filetype_service.get_extension(),
+                information = upload_information,
+                statistics = statistics,
+                parent = parent,
+                deleted = changes.deleted if changes is not None else None,
+                deduplicated = deduplicate
+            )
+            upload_id = db_uploads_service.get_context().insert(db_information.as_dict())
+            if dryrun:
+                # the files and chunks of a dry run were not uploaded, later uploads must not refer to them
+                if chunk_index_service is not None:
+                    chunk_index_service.discard()
+            else:
+                if file_index_service is not None and changes is not None:
+                    file_index_service.update(changes, filetype_service.get_content_hashes(), upload_id)
+                if chunk_index_service is not None:
+                    chunk_index_service.commit(upload_id)
+            return 0
+        if chunk_index_service is not None:
+            chunk_index_service.discard()
         return 1
-    files_text = "files" if len(files) > 1 else "file"
-    console.print(f"Trying to upload {len(files)} {files_text} to [bold purple]{vault}[/bold purple]"
-                        f" using profile: [bold purple]{profile}[/bold purple]")
-
-    status_report_manager= ReportManager(service)
-
-    packed_generator = filetype_service.pack(files, status_report_manager)
-    compressed_generator = compression_service.compress(packed_generator, status_report_manager)
-    encrypted_generator = encryption_service.encrypt(compressed_generator, status_report_manager)
-    upload_status, upload_information = transfer_service.upload(encrypted_generator,status_report_manager)
-
-    status_report_manager.stop_reporting()
-
-
-    if upload_status:
-        assert upload_information is not None
-        db_information = UploadDbEntry(
-            upload_datetime_utc = str(datetime.datetime.now(datetime.UTC)),
-            encryption = encryption_service.get_extension(),
-            compression = compression_service.get_extension(),
-            filetype = filetype_service.get_extension(),
-            information = upload_information
-        )
-        db_uploads_service.get_context().insert(db_information.as_dict())
-        return 0
-    return 1
+    finally:
+        if file_index_service is not None:
+            file_index_service.close()
+        if chunk_index_service is not None:
+            chunk_index_service.close()
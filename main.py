@@ -5,6 +5,7 @@ from dependency_injection.main_factory import setup_factory_from_parameters
 from dependency_injection.service import Service
 from executer.download_executer import download
 from executer.setup_executer import guided_execution, setup
+from executer.stats_executer import stats
 from executer.upload_executer import upload
 from services.cancel_service import CancelService
 from services.db_service import DbService
@@ -31,9 +32,22 @@ def main() -> None:
             args.dryrun,
             args.compression_level,
             args.password,
-            args.password_file
+            args.password_file,
+            args.upload_memory_limit,
+            args.upload_workers,
+            args.min_upload_workers,
+            args.max_upload_workers,
+            args.upload_attempts,
+            args.compression_workers,
+            args.compression_block_size,
+            args.gzip_block_size,
+            args.encryption_workers,
+            args.prefetch_files,
+            args.prefetch_memory
         )
-        upload(service, args.profile, args.paths)
+        upload(service, args.profile, args.paths, args.resume, args.skip_compression_threshold, args.pipeline_queue_size,
+               args.pipeline_chunk_size, args.metrics_file, args.scan_workers, args.incremental,
+               args.deduplicate, args.dedup_chunk_size)
     elif args.command == 'download':
         setup_factory_from_parameters(
             service,
@@ -45,7 +59,12 @@ def main() -> None:
             password=args.password,
             password_file=args.password_file
         )
-        download(service,  args.profile, args.location, args.id, args.password, args.password_file)
+        download(service,  args.profile, args.location, args.id, args.password, args.password_file, args.download_workers, args.download_range_size,
+                 args.decompression_workers, args.decryption_workers, args.pipeline_queue_size,
+                 args.pipeline_chunk_size)
+    elif args.command == 'stats':
+        service.set_service(DbService("uploads.json"), "db_uploads_service")
+        stats(service, args.limit)
     elif args.command == 'setup':
         setup(service)
     elif args.command == 'guided' or args.command is None:
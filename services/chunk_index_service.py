@@ -0,0 +1,59 @@
+import sqlite3
+
+from services.service_base import ServiceBase
+from utils.storage_utils import get_profile_database_path
+
+class ChunkIndexService(ServiceBase):
+    """
+    Index of the chunks of the deduplicated uploads of a profile: the key of a chunk, the upload storing it
+    and its offset and size in the chunk data of that upload.
+    The keys are the first 16 bytes of the SHA-256 of the chunks and the table is clustered by them (WITHOUT ROWID),
+    so an entry takes about 40 bytes and a lookup is one search in a B-tree, even with hundreds of millions of chunks.
+    Chunks of the running upload are pending until the upload is committed, they are dropped if it fails.
+    """
+    db: sqlite3.Connection
+
+    def __init__(self, profile: str, db_directory: str | None = None) -> None:
+        """
+        :param profile: Profile the index belongs to, every profile has its own index
+        :param db_directory: Directory of the database. Defaults to ~/.ecsu
+        """
+        # the chunks are looked up by the packer, which runs in a thread of the pipeline
+        self.db = sqlite3.connect(get_profile_database_path("chunk_index", profile, db_directory), check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS chunks (key BLOB PRIMARY KEY, upload_id INTEGER, "
+                            "offset INTEGER NOT NULL, size INTEGER NOT NULL) WITHOUT ROWID")
+            # pending chunks of an upload that was interrupted
+            self.db.execute("DELETE FROM chunks WHERE upload_id IS NULL")
+        super().__init__()
+
+    def lookup(self, key: bytes) -> tuple[int | None, int, int] | None:
+        """
+        Returns the upload storing the chunk (None for the running upload), its offset and its size, or None for a new chunk.
+        """
+        row = self.db.execute("SELECT upload_id, offset, size FROM chunks WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1], row[2]) if row is not None else None
+
+    def add(self, key: bytes, offset: int, size: int) -> None:
+        """
+        Adds a chunk stored by the running upload.
+        """
+        self.db.execute("INSERT OR IGNORE INTO chunks VALUES (?, NULL, ?, ?)", (key, offset, size))
+
+    def commit(self, upload_id: int) -> None:
+        """
+        Assigns the pending chunks to the finished upload.
+        """
+        with self.db:
+            self.db.execute("UPDATE chunks SET upload_id = ? WHERE upload_id IS NULL", (upload_id,))
+
+    def discard(self) -> None:
+        """
+        Drops the pending chunks of a failed upload.
+        """
+        self.db.rollback()
+        with self.db:
+            self.db.execute("DELETE FROM chunks WHERE upload_id IS NULL")
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,192 @@
+import functools
+import itertools
+import multiprocessing
+from abc import abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Generator, Iterable, Iterator, Protocol
+import uuid
+from services.compression.compression_base import CompressionBase
+from services.service_base import ServiceBase
+from utils.concurrency_utils import ordered_parallel_map
+from utils.data_utils import StreamSplitter, split_into_blocks
+from utils.report_utils import ReportManager, Reporting
+
+def _get_process_context() -> Any:
+    # the worker processes are started from a clean server process instead of forking the uploader with its threads and locks
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def _decompress_stream_or_error(decompress_stream: Callable[[bytes], bytes], stream: bytes) -> bytes | Exception:
+    # the error is returned instead of raised, so the streams after it are not lost and can be decompressed sequentially
+    try:
+        return decompress_stream(stream)
+    except Exception as exception: # pylint: disable=broad-exception-caught
+        return exception
+
+def compress_blocks_in_parallel(data: Iterable[bytes], compress_block: Callable[[bytes], bytes], block_size: int, workers: int, # pylint: disable=too-many-arguments
+                                upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+    """
+    Splits the data into blocks which are compressed into independent streams in a pool of processes.
+    The streams are yielded in order, at most one block per worker is in flight.
+
+    :param compress_block: Compresses one block into a complete stream. It has to be picklable
+    """
+    report_uuid = uuid.uuid4()
+    upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting", f"{workers} workers"))
+    progress = upload_reporting.get_progress("compressor", report_uuid)
+    blockcount = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_get_process_context()) as executor:
+        for compressed_block in ordered_parallel_map(compress_block, split_into_blocks(data, block_size), workers, executor=executor):
+            blockcount += 1
+            yield compressed_block
+            progress.add(len(compressed_block))
+    if blockcount == 0:
+        # an empty input is still a valid (empty) compressed file
+        yield compress_block(b"")
+    upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "blocks: " + str(blockcount)))
+
+def decompress_streams_in_parallel(data: Iterable[bytes], splitter: StreamSplitter, decompress_stream: Callable[[bytes], bytes], # pylint: disable=too-many-arguments
+                                   decompress_sequential: Callable[[Iterable[bytes]], Iterable[bytes]], workers: int,
+                                   upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+    """
+    Decompresses data made of concatenated streams in a pool of processes, once at least two streams were found.
+    A single stream, or a stream too large for the splitter, is decompressed sequentially instead.
+    If a stream cannot be decompressed on its own, e.g. because the splitter matched a stream header inside a stream,
+    the rest of the data from that stream on is decompressed sequentially.
+
+    :param decompress_stream: Decompresses one complete stream. It has to be picklable
+    :param decompress_sequential: Decompresses any number of concatenated streams in the current process
+    """
+    report_uuid = uuid.uuid4()
+    upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting"))
+    progress = upload_reporting.get_progress("compressor", report_uuid)
+    chunks: Iterator[bytes] = iter(data)
+    streams = splitter.split(chunks)
+    def unsplit_data() -> Generator[bytes, None, None]:
+        # the streams of the splitter, its pending data and the unread chunks are the rest of the data, wherever it split
+        yield from streams
+        yield bytes(splitter.pending)
+        yield from chunks
+    first_streams = list(itertools.islice(streams, 2))
+    if len(first_streams) == 2:
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "working", f"{workers} workers"))
+        in_flight: deque[bytes] = deque()
+        def submitted_streams() -> Generator[bytes, None, None]:
+            for stream in itertools.chain(first_streams, streams):
+                in_flight.append(stream)
+                yield stream
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_get_process_context()) as executor:
+            results = ordered_parallel_map(functools.partial(_decompress_stream_or_error, decompress_stream), submitted_streams(), workers,
+                                           executor=executor)
+            for decompressed in results:
+                if isinstance(decompressed, Exception):
+                    upload_reporting.add_report(Reporting("compressor", report_uuid, "working", "single process",
+                                                          f"A stream could not be decompressed on its own ({decompressed}), "
+                                                          "the rest is decompressed in a single process"))
+                    results.close()
+                    break
+                in_flight.popleft()
+                yield decompressed
+                progress.add(len(decompressed))
+        first_streams = list(in_flight)
+    if len(first_streams) > 0 or splitter.fallback:
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "working", "single process"))
+        yield from decompress_sequential(itertools.chain(first_streams, unsplit_data()))
+    upload_reporting.add_report(Reporting("compressor", report_uuid, "finished"))
+
+class StreamCompressor(Protocol):
+    def compress(self, data: bytes, /) -> bytes: ...
+    def flush(self) -> bytes: ...
+
+class BlockCompressionService(CompressionBase, ServiceBase):
+    """
+    Base of the compression services whose format allows concatenated streams (bzip2, xz).
+    With more than one worker the data is compressed in blocks, each into an independent stream, in a pool of processes,
+    and the streams are decompressed in parallel again. With one worker it is compressed as a single stream.
+    The services only provide the codec.
+    """
+    compression_level: int
+    workers: int
+    block_size: int
+    def __init__(self, compression_level: int, workers: int, block_size_in_mb: int) -> None:
+        if compression_level not in range(1, 10):
+            raise ValueError("Compression level must be between 1 and 9")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if block_size_in_mb < 1:
+            raise ValueError("block_size_in_mb must be at least 1")
+        self.compression_level = compression_level
+        self.workers = workers
+        self.block_size = block_size_in_mb * 1024 * 1024
+        super().__init__()
+
+    @abstractmethod
+    def get_stream_compressor(self) -> StreamCompressor:
+        """
+        Returns a compressor writing a single stream.
+        """
+
+    @abstractmethod
+    def get_block_compressor(self) -> Callable[[bytes], bytes]:
+        """
+        Returns a function compressing one block into a complete stream. It has to be picklable.
+        """
+
+    @abstractmethod
+    def get_stream_splitter(self) -> StreamSplitter:
+        """
+        Returns a splitter finding the ends of the streams, for streams of up to four times the block size.
+        """
+
+    @abstractmethod
+    def get_stream_decompressor(self) -> Callable[[bytes], bytes]:
+        """
+        Returns a function decompressing one complete stream. It has to be picklable.
+        """
+
+    @abstractmethod
+    def decompress_sequential(self, data: Iterable[bytes]) -> Generator[bytes,None,None]:
+        """
+        Decompresses any number of concatenated streams in the current process.
+        """
+
+    def get_output_options(self) -> dict[str, Any]:
+        # with more than one worker the data is compressed in blocks, but the number of workers does not change them
+        return {"compression_level": self.compression_level, "block_size": self.block_size if self.workers > 1 else None}
+
+    def compress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        if self.workers > 1:
+            return compress_blocks_in_parallel(data, self.get_block_compressor(), self.block_size, self.workers, upload_reporting)
+        return self.__compress_single_stream(data, upload_reporting)
+
+    def __compress_single_stream(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        compressor = self.get_stream_compressor()
+        report_uuid = uuid.uuid4()
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting"))
+        progress = upload_reporting.get_progress("compressor", report_uuid)
+        chunkcount = 0
+        for chunk in data:
+            chunkcount += 1
+            yield compressor.compress(chunk)
+            progress.add(len(chunk))
+        yield compressor.flush()
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "chunks: " + str(chunkcount)))
+
+    def decompress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        if self.workers > 1:
+            return decompress_streams_in_parallel(data, self.get_stream_splitter(), self.get_stream_decompressor(),
+                                                  self.decompress_sequential, self.workers, upload_reporting)
+        return self.__decompress_reported(data, upload_reporting)
+
+    def __decompress_reported(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        report_uuid = uuid.uuid4()
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting"))
+        progress = upload_reporting.get_progress("compressor", report_uuid)
+        chunkcount = 0
+        for chunk in self.decompress_sequential(data):
+            chunkcount += 1
+            yield chunk
+            progress.add(len(chunk))
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "chunks: " + str(chunkcount)))
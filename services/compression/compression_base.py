@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import Generator
+from typing import Any, Generator
 
 from services.service_base import ServiceBase
 from utils.report_utils import ReportManager
@@ -17,3 +17,10 @@ class CompressionBase(ServiceBase):
     @abstractmethod
     def get_extension(self) -> str:
         pass
+
+    def get_output_options(self) -> dict[str, Any]:
+        """
+        Returns the options which change the data the service produces.
+        A resumed upload has to be produced with the same options, so they are recorded with it.
+        """
+        return {}
@@ -1,14 +1,58 @@
-from typing import Generator
-from services.compression.compression_base import CompressionBase
-from services.service_base import ServiceBase
-from utils.report_utils import ReportManager
+import bz2
+import functools
+from typing import Callable, Generator, Iterable
+from services.compression.block_compression import BlockCompressionService, StreamCompressor
+from utils.bzip2_utils import Bzip2StreamSplitter
+from utils.data_utils import StreamSplitter
 
-class CompressionServiceBzip2(CompressionBase, ServiceBase):
-    def compress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
-        raise NotImplementedError("Bzip2 compression is not implemented")
+# bzip2 compresses in blocks of up to 900 kB at level 9
+BZIP2_BLOCK_SIZE = 900 * 1000
 
-    def decompress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
-        raise NotImplementedError("Bzip2 decompression is not implemented")
+def _compress_block(block: bytes, compresslevel: int) -> bytes:
+    # every block becomes a complete bzip2 stream, concatenated streams are read by bunzip2 like a single file
+    return bz2.compress(block, compresslevel=compresslevel)
+
+def _decompress_stream(stream: bytes) -> bytes:
+    decompressor = bz2.BZ2Decompressor()
+    decompressed = decompressor.decompress(stream)
+    if not decompressor.eof or decompressor.unused_data:
+        raise OSError("Data is not a single complete bzip2 stream")
+    return decompressed
+
+class CompressionServiceBzip2(BlockCompressionService):
+    def __init__(self, compression_level: int = 9, workers: int = 1, block_size_in_mb: int = 9) -> None:
+        """
+        :param compression_level: The bzip2 compression level from 1 to 9
+        :param workers: Number of processes compressing blocks (or decompressing streams) in parallel.
+                        With 1 the data is compressed as a single stream
+        :param block_size_in_mb: Size of the blocks that are compressed independently, rounded up to a multiple of 900 kB.
+                                 Decompression falls back to a single process if a stream is larger than four times this size
+        """
+        super().__init__(compression_level, workers, block_size_in_mb)
+        # a multiple of the largest bzip2 block, so no stream ends with a small block
+        self.block_size = -(-self.block_size // BZIP2_BLOCK_SIZE) * BZIP2_BLOCK_SIZE
+
+    def get_stream_compressor(self) -> StreamCompressor:
+        return bz2.BZ2Compressor(self.compression_level)
+
+    def get_block_compressor(self) -> Callable[[bytes], bytes]:
+        return functools.partial(_compress_block, compresslevel=self.compression_level)
+
+    def get_stream_splitter(self) -> StreamSplitter:
+        return Bzip2StreamSplitter(max_stream_size=4 * self.block_size)
+
+    def get_stream_decompressor(self) -> Callable[[bytes], bytes]:
+        return _decompress_stream
+
+    def decompress_sequential(self, data: Iterable[bytes]) -> Generator[bytes,None,None]:
+        decompressor = bz2.BZ2Decompressor()
+        for chunk in data:
+            # the file may consist of several concatenated streams, e.g. if it was compressed in parallel
+            while chunk:
+                if decompressor.eof:
+                    decompressor = bz2.BZ2Decompressor()
+                yield decompressor.decompress(chunk)
+                chunk = decompressor.unused_data if decompressor.eof else b""
 
     def get_extension(self) -> str:
         return ".bz2"
@@ -0,0 +1,107 @@
+import struct
+import uuid
+import zlib
+from typing import Any, Generator, Iterable
+from services.compression.compression_base import CompressionBase
+from services.service_base import ServiceBase
+from utils.concurrency_utils import ordered_parallel_map
+from utils.data_utils import split_into_blocks
+from utils.hash_utils import crc32_combine
+from utils.report_utils import ReportManager, Reporting
+
+# deflate can refer back up to 32 KiB, so this much of the previous block primes the next one
+DICTIONARY_SIZE = 32 * 1024
+
+def _with_dictionaries(blocks: Iterable[bytes]) -> Generator[tuple[bytes, bytes, bool], None, None]:
+    # yields every block with the end of the previous block and if it is the last block
+    previous = b""
+    current: bytes | None = None
+    for block in blocks:
+        if current is not None:
+            yield current, previous[-DICTIONARY_SIZE:], False
+            previous = current
+        current = block
+    yield (current if current is not None else b""), previous[-DICTIONARY_SIZE:], True
+
+class CompressionServiceGzip(CompressionBase, ServiceBase):
+    compression_level: int
+    workers: int
+    block_size: int
+    def __init__(self, compression_level: int = 6, workers: int = 1, block_size_in_kb: int = 128) -> None:
+        """
+        :param compression_level: The deflate compression level from 1 to 9
+        :param workers: Number of threads compressing blocks in parallel. zlib releases the GIL while it compresses
+        :param block_size_in_kb: Size of the blocks that are compressed independently
+        """
+        if compression_level not in range(1, 10):
+            raise ValueError("Compression level must be between 1 and 9")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if block_size_in_kb < 32:
+            raise ValueError("block_size_in_kb must be at least 32")
+        self.compression_level = compression_level
+        self.workers = workers
+        self.block_size = block_size_in_kb * 1024
+        super().__init__()
+
+    def __compress_block(self, block_with_dictionary: tuple[bytes, bytes, bool]) -> tuple[bytes, int, int]:
+        block, dictionary, last = block_with_dictionary
+        compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary) if dictionary \
+            else zlib.compressobj(self.compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        # a sync flush ends the block on a byte boundary without marking it as the last one, so the blocks can be concatenated
+        compressed = compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        return compressed, zlib.crc32(block), len(block)
+
+    def __gzip_header(self) -> bytes:
+        extra_flags = 2 if self.compression_level == 9 else 4 if self.compression_level == 1 else 0
+        # no file name and no modification time, so the same input always gives the same output. OS 255 is unknown
+        return struct.pack("<BBBBIBB", 0x1f, 0x8b, zlib.DEFLATED, 0, 0, extra_flags, 255)
+
+    def get_output_options(self) -> dict[str, Any]:
+        # the blocks are the same with any number of workers
+        return {"compression_level": self.compression_level, "block_size": self.block_size}
+
+    def compress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        report_uuid = uuid.uuid4()
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting", f"{self.workers} workers"))
+        progress = upload_reporting.get_progress("compressor", report_uuid)
+        yield self.__gzip_header()
+        crc = 0
+        size = 0
+        blockcount = 0
+        for compressed, block_crc, block_size in ordered_parallel_map(
+            self.__compress_block,
+            _with_dictionaries(split_into_blocks(data, self.block_size)),
+            self.workers,
+            window=2 * self.workers,
+            thread_name_prefix="gzip-compressor"
+        ):
+            blockcount += 1
+            crc = crc32_combine(crc, block_crc, block_size)
+            size += block_size
+            yield compressed
+            progress.add(block_size)
+        yield struct.pack("<II", crc, size & 0xFFFFFFFF)
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "blocks: " + str(blockcount)))
+
+    def decompress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        # deflate cannot be split without decoding it, so gzip is always decompressed in one thread
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        report_uuid = uuid.uuid4()
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting"))
+        progress = upload_reporting.get_progress("compressor", report_uuid)
+        chunkcount = 0
+        for chunk in data:
+            chunkcount += 1
+            chunk_size = len(chunk)
+            # a gzip file may consist of several members
+            while chunk:
+                if decompressor.eof:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                yield decompressor.decompress(chunk)
+                chunk = decompressor.unused_data if decompressor.eof else b""
+            progress.add(chunk_size)
+        upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "chunks: " + str(chunkcount)))
+
+    def get_extension(self) -> str:
+        return ".gz"
@@ -1,41 +1,58 @@
+import functools
 import lzma
-from typing import Generator
-import uuid
-from services.compression.compression_base import CompressionBase
-from services.service_base import ServiceBase
-from utils.report_utils import ReportManager, Reporting
-
-class CompressionServiceLzma(CompressionBase, ServiceBase):
-    compression_level: int
-    def __init__(self, compression_level: int = 6) -> None:
-        if compression_level not in range(1, 10):
-            raise ValueError("Compression level must be between 1 and 9")
-        self.compression_level = compression_level
-        super().__init__()
-
-    def compress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
-        compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=self.compression_level)
-        report_uuid = uuid.uuid4()
-        upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting"))
-        chunkcount = 0
-        for chunk in data:
-            chunkcount += 1
-            yield compressor.compress(chunk)
-            upload_reporting.add_report(Reporting("compressor", report_uuid, "working", "chunk: " + str(chunkcount)))
-        yield compressor.flush()
-        upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "chunks: " + str(chunkcount)))
+from typing import Callable, Generator, Iterable
+from services.compression.block_compression import BlockCompressionService, StreamCompressor
+from utils.data_utils import StreamSplitter
+from utils.xz_utils import XzStreamSplitter
+
+def _compress_block(block: bytes, preset: int) -> bytes:
+    # every block becomes a complete xz stream, concatenated streams are a valid .xz file
+    return lzma.compress(block, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=preset)
+
+def _decompress_stream(stream: bytes) -> bytes:
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    decompressed = decompressor.decompress(stream)
+    # only stream padding may follow the stream
+    if not decompressor.eof or decompressor.unused_data.strip(b"\0"):
+        raise lzma.LZMAError("Data is not a single complete xz stream")
+    return decompressed
+
+class CompressionServiceLzma(BlockCompressionService):
+    def __init__(self, compression_level: int = 6, workers: int = 1, block_size_in_mb: int = 32) -> None:
+        """
+        :param compression_level: The xz preset from 1 to 9
+        :param workers: Number of processes compressing blocks (or decompressing streams) in parallel.
+                        With 1 the data is compressed as a single stream
+        :param block_size_in_mb: Size of the blocks that are compressed independently, if more than one worker is used.
+                                 Decompression falls back to a single process if a stream is larger than four times this size
+        """
+        super().__init__(compression_level, workers, block_size_in_mb)
+
+    def get_stream_compressor(self) -> StreamCompressor:
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=self.compression_level)
+
+    def get_block_compressor(self) -> Callable[[bytes], bytes]:
+        return functools.partial(_compress_block, preset=self.compression_level)
+
+    def get_stream_splitter(self) -> StreamSplitter:
+        return XzStreamSplitter(max_stream_size=4 * self.block_size)
 
+    def get_stream_decompressor(self) -> Callable[[bytes], bytes]:
+        return _decompress_stream
 
-    def decompress(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+    def decompress_sequential(self, data: Iterable[bytes]) -> Generator[bytes,None,None]:
         decompressor = lzma.LZMADecompressor()
-        report_uuid = uuid.uuid4()
-        upload_reporting.add_report(Reporting("compressor", report_uuid, "waiting"))
-        chunkcount = 0
         for chunk in data:
-            chunkcount += 1
-            yield decompressor.decompress(chunk)
-            upload_reporting.add_report(Reporting("compressor", report_uuid, "working", "chunk: " + str(chunkcount)))
-        upload_reporting.add_report(Reporting("compressor", report_uuid, "finished", "chunks: " + str(chunkcount)))
+            # the file may consist of several concatenated streams, e.g. if it was compressed in parallel
+            while chunk:
+                if decompressor.eof:
+                    # streams may be separated by null bytes of stream padding, the chunks may be memoryviews without lstrip
+                    chunk = bytes(chunk).lstrip(b"\0")
+                    if not chunk:
+                        break
+                    decompressor = lzma.LZMADecompressor()
+                yield decompressor.decompress(chunk)
+                chunk = decompressor.unused_data if decompressor.eof else b""
 
     def get_extension(self) -> str:
         return ".xz"
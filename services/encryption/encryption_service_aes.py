@@ -1,18 +1,37 @@
 import os
-from typing import Generator
+from itertools import chain
+from typing import Any, Generator, Iterable
 import uuid
-from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
 from Crypto.Protocol.KDF import PBKDF2
+from Crypto.Random import get_random_bytes
 from services.encryption.encryption_base import EncryptionBase
 from services.service_base import ServiceBase
+from utils.concurrency_utils import ordered_parallel_map
 from utils.console_utils import print_error
+from utils.data_utils import split_into_blocks
+from utils.encryption_utils import (FRAME_HEADER_SIZE, NONCE_PREFIX_SIZE, SALT_SIZE, ChunkAuthenticationError, FramedAesHeader,
+                                    mark_last)
 from utils.report_utils import ReportManager, Reporting
 
 class EncryptionServiceAes(EncryptionBase, ServiceBase):
-    def __init__(self, password: str, password_file: str) -> None:
-        #TO-DO Implement password file
-        #TO-DO remove hardcoded salt
-        salt = b'\xa4nTc\x1f\xab\x94\xa1\xefEH\tv\x97G\xe0'
+    """
+    Encrypts the data with AES-256-GCM in the framed format of FramedAesHeader.
+    The chunks are independent, so they are encrypted and decrypted in a pool of threads and a part of the data
+    can be decrypted without the chunks before it.
+    """
+    kdf_iterations: int = 600000
+    password: str
+    workers: int
+    chunk_size: int
+    salt: bytes
+    nonce_prefix: bytes
+
+    def __init__(self, password: str, password_file: str, workers: int = 4, chunk_size_in_kb: int = 1024) -> None:
+        """
+        :param workers: Number of threads encrypting or decrypting chunks
+        :param chunk_size_in_kb: Size of the independently encrypted chunks. Decryption uses the size stored in the header
+        """
         if password == "" and password_file == "":
             raise ValueError("Password or passwordfile is required for AES encryption")
         if password_file != "" and password_file is not None:
@@ -27,29 +46,104 @@ class EncryptionServiceAes(EncryptionBase, ServiceBase):
                 if " " in password:
                     print_error("Password file contains spaces")
                     raise ValueError("Password file contains spaces")
-        key = PBKDF2(password, salt, dkLen=32)
-        self.cipher_encrypt = AES.new(key, AES.MODE_CFB)
+        if workers < 1 or chunk_size_in_kb < 1:
+            raise ValueError("workers and chunk_size_in_kb must be at least 1")
+        self.password = password
+        self.workers = workers
+        self.chunk_size = chunk_size_in_kb * 1024
+        self.salt = get_random_bytes(SALT_SIZE)
+        self.nonce_prefix = get_random_bytes(NONCE_PREFIX_SIZE)
+        self.__keys: dict[tuple[bytes, int], bytes] = {}
         super().__init__()
 
+    def __get_key(self, header: FramedAesHeader) -> bytes:
+        # deriving the key takes a while on purpose, so it is done once for every salt
+        cache_key = (header.salt, header.kdf_iterations)
+        if cache_key not in self.__keys:
+            self.__keys[cache_key] = PBKDF2(self.password, header.salt, dkLen=32, count=header.kdf_iterations, hmac_hash_module=SHA256)
+        return self.__keys[cache_key]
+
     def encrypt(self, data: Generator[bytes,None,None], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
         report_uuid = uuid.uuid4()
         upload_reporting.add_report(Reporting("crypter", report_uuid, "waiting"))
+        progress = upload_reporting.get_progress("crypter", report_uuid)
+        header = FramedAesHeader(self.chunk_size, self.kdf_iterations, self.salt, self.nonce_prefix)
+        key = self.__get_key(header)
+        yield header.pack()
         chunkcount = 0
-        for unencrypted in data:
+
+        def encrypt_chunk(item: tuple[int, tuple[bytes, bool]]) -> bytes:
+            index, (chunk, last) = item
+            return header.encrypt_chunk(key, index, chunk, last)
+
+        for encrypted in ordered_parallel_map(encrypt_chunk, enumerate(mark_last(split_into_blocks(data, self.chunk_size))),
+                                              self.workers, window=self.workers * 2, thread_name_prefix="crypter"):
             chunkcount += 1
-            yield self.cipher_encrypt.encrypt(unencrypted)
-            upload_reporting.add_report(Reporting("crypter", report_uuid, "working", "chunk: " + str(chunkcount)))
+            yield encrypted
+            progress.add(len(encrypted))
         upload_reporting.add_report(Reporting("crypter", report_uuid, "finished", "chunks: " + str(chunkcount)))
 
     def decrypt(self, data: Generator[bytes,None,None], upload_reporting: ReportManager)-> Generator[bytes,None,None]:
+        chunks = iter(data)
+        header_data = bytearray()
+        for chunk in chunks:
+            header_data += chunk
+            if len(header_data) >= FRAME_HEADER_SIZE:
+                break
+        header = FramedAesHeader.unpack(header_data)
+        remaining = bytes(header_data[FRAME_HEADER_SIZE:])
+        yield from self.__decrypt_chunks(header, chain([remaining], chunks), 0, True, upload_reporting)
+
+    def decrypt_range(self, header_data: bytes, data: Iterable[bytes], first_index: int,
+                      upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        """
+        Decrypts a part of the encrypted data, which was located with FramedAesHeader.get_chunk_range.
+
+        :param header_data: The first FRAME_HEADER_SIZE bytes of the encrypted data
+        :param data: The encrypted chunks, starting at the chunk first_index
+        :param first_index: Index of the first chunk of the data
+        """
+        return self.__decrypt_chunks(FramedAesHeader.unpack(header_data), data, first_index, False, upload_reporting)
+
+    def __decrypt_chunks(self, header: FramedAesHeader, data: Iterable[bytes], first_index: int, complete: bool, # pylint: disable=too-many-arguments
+                         upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+        """
+        :param complete: If the data reaches the end of the encrypted data, so its last chunk has to be the last chunk
+        """
         report_uuid = uuid.uuid4()
         upload_reporting.add_report(Reporting("crypter", report_uuid, "waiting"))
+        progress = upload_reporting.get_progress("crypter", report_uuid)
+        key = self.__get_key(header)
         chunkcount = 0
-        for encrypted in data:
+
+        def decrypt_chunk(item: tuple[int, tuple[bytes, bool]]) -> bytes:
+            index, (chunk, last) = item
+            if complete or not last:
+                return header.decrypt_chunk(key, first_index + index, chunk, last)
+            # the end of a range is either a chunk in the middle or the last chunk of the data
+            try:
+                return header.decrypt_chunk(key, first_index + index, chunk, False)
+            except ChunkAuthenticationError:
+                return header.decrypt_chunk(key, first_index + index, chunk, True)
+
+        for decrypted in ordered_parallel_map(decrypt_chunk, enumerate(mark_last(split_into_blocks(data, header.get_encrypted_chunk_size()))),
+                                              self.workers, window=self.workers * 2, thread_name_prefix="crypter"):
             chunkcount += 1
-            yield self.cipher_encrypt.decrypt(encrypted)
-            upload_reporting.add_report(Reporting("crypter", report_uuid, "working", "chunk: " + str(chunkcount)))
+            yield decrypted
+            progress.add(len(decrypted))
         upload_reporting.add_report(Reporting("crypter", report_uuid, "finished", "chunks: " + str(chunkcount)))
 
     def get_extension(self) -> str:
         return ".aes"
+
+    def get_output_options(self) -> dict[str, Any]:
+        return {"chunk_size": self.chunk_size}
+
+    def get_state(self) -> dict[str, Any]:
+        return {"salt": self.salt.hex(), "nonce_prefix": self.nonce_prefix.hex()}
+
+    def restore_state(self, state: dict[str, Any]) -> None:
+        if "salt" not in state or "nonce_prefix" not in state:
+            raise ValueError("The upload was encrypted in an older format and can not be resumed")
+        self.salt = bytes.fromhex(state["salt"])
+        self.nonce_prefix = bytes.fromhex(state["nonce_prefix"])
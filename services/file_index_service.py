@@ -0,0 +1,116 @@
+import hashlib
+import os
+import sqlite3
+
+from services.service_base import ServiceBase
+from utils.storage_utils import ScannedFile, get_profile_database_path
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> bytes:
+    """
+    Returns the SHA-256 of the content of the file.
+    """
+    content_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            content_hash.update(chunk)
+    return content_hash.digest()
+
+class FileChanges:
+    """
+    The difference between the scanned files and the files of the last upload.
+    changed are new or modified files, touched ones only have a new modification time or inode, but the same content.
+    """
+    changed: list[ScannedFile]
+    touched: list[ScannedFile]
+    deleted: list[str]
+    def __init__(self, changed: list[ScannedFile], touched: list[ScannedFile], deleted: list[str]) -> None:
+        self.changed = changed
+        self.touched = touched
+        self.deleted = deleted
+
+    def is_empty(self) -> bool:
+        return len(self.changed) == 0 and len(self.deleted) == 0
+
+class FileIndexService(ServiceBase):
+    """
+    Index of the uploaded files of a profile, with their size, modification time, inode and content hash.
+    Incremental uploads compare the scanned files with it and only pack what changed.
+    It is stored in a SQLite database next to the other databases, because it holds an entry for every file.
+    """
+    db: sqlite3.Connection
+
+    def __init__(self, profile: str, db_directory: str | None = None) -> None:
+        """
+        :param profile: Profile the index belongs to, every profile has its own index
+        :param db_directory: Directory of the database. Defaults to ~/.ecsu
+        """
+        self.db = sqlite3.connect(get_profile_database_path("file_index", profile, db_directory))
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                            "mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, content_hash BLOB, upload_id INTEGER NOT NULL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        super().__init__()
+
+    def get_last_upload_id(self) -> int | None:
+        """
+        Returns the id of the upload which last updated the index, the parent of the next incremental upload.
+        """
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_upload_id'").fetchone()
+        return int(row[0]) if row is not None else None
+
+    def find_changes(self, files: list[ScannedFile], paths: list[str]) -> FileChanges:
+        """
+        Compares the scanned files with the index. A file with the same size, modification time and inode is unchanged.
+        If only the modification time or the inode differ, the content hash decides.
+
+        :param files: Files found by the scan
+        :param paths: Scanned paths. Indexed files below them which were not found are deleted
+        """
+        changed: list[ScannedFile] = []
+        touched: list[ScannedFile] = []
+        for path, stat in files:
+            row = self.db.execute("SELECT size, mtime_ns, inode, content_hash FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+            if row is None or row[0] != stat.st_size:
+                changed.append((path, stat))
+                continue
+            if (row[1], row[2]) == (stat.st_mtime_ns, stat.st_ino):
+                continue
+            try:
+                same_content = row[3] is not None and hash_file(path) == row[3]
+            except OSError:
+                same_content = False
+            (touched if same_content else changed).append((path, stat))
+        return FileChanges(changed, touched, self.__find_deleted(files, paths))
+
+    def __find_deleted(self, files: list[ScannedFile], paths: list[str]) -> list[str]:
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS scanned (path TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM scanned")
+        self.db.executemany("INSERT OR IGNORE INTO scanned VALUES (?)", ((os.path.abspath(path),) for path, _ in files))
+        deleted: list[str] = []
+        for root in dict.fromkeys(os.path.abspath(path) for path in paths):
+            prefix = root.rstrip(os.sep) + os.sep
+            deleted.extend(row[0] for row in self.db.execute(
+                "SELECT path FROM files WHERE (path = ? OR substr(path, 1, ?) = ?) AND path NOT IN (SELECT path FROM scanned) ORDER BY path",
+                (root, len(prefix), prefix)))
+        self.db.execute("DELETE FROM scanned")
+        self.db.commit()
+        return list(dict.fromkeys(deleted))
+
+    def update(self, changes: FileChanges, content_hashes: dict[str, bytes], upload_id: int) -> None:
+        """
+        Records a successful upload of the changes in one transaction.
+
+        :param content_hashes: SHA-256 of the packed files by path, as computed by the packer
+        :param upload_id: Id of the upload in the uploads database
+        """
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", (
+                (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino, content_hashes.get(path), upload_id)
+                for path, stat in changes.changed))
+            self.db.executemany("UPDATE files SET mtime_ns = ?, inode = ? WHERE path = ?",
+                                ((stat.st_mtime_ns, stat.st_ino, os.path.abspath(path)) for path, stat in changes.touched))
+            self.db.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in changes.deleted))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_upload_id', ?)", (str(upload_id),))
+
+    def close(self) -> None:
+        self.db.close()
@@ -1,19 +1,56 @@
 from abc import abstractmethod
-from typing import Generator
+from typing import Any, Generator, Iterable
 
+from services.chunk_index_service import ChunkIndexService
 from services.service_base import ServiceBase
+from utils.compressibility_utils import CompressibilityProbe
+from utils.dedup_utils import CdcChunker
 from utils.report_utils import ReportManager
+from utils.storage_utils import ScannedFile
 
 class FiletypeBase(ServiceBase):
 
     @abstractmethod
-    def pack(self, files: list[str], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+    def pack(self, files: Iterable[ScannedFile], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
         pass
 
     @abstractmethod
-    def unpack(self, data:Generator[bytes,None,None], save_location:str, filename:str, upload_reporting: ReportManager)-> None:
-        pass
+    def unpack(self, data:Generator[bytes,None,None], save_location:str, filename:str, upload_reporting: ReportManager)-> str:
+        """
+        Writes the downloaded data to the save_location.
+        :return: The path that was written
+        """
 
     @abstractmethod
     def get_extension(self) -> str:
         pass
+
+    def get_output_options(self) -> dict[str, Any]:
+        """
+        Returns the options which change the data the service produces.
+        A resumed upload has to be produced with the same options, so they are recorded with it.
+        """
+        return {}
+
+    def set_compressibility(self, probes: dict[str, CompressibilityProbe], compress_members: bool) -> None:
+        """
+        Passes the probed compressibility of the files to pack.
+        :param compress_members: If compressible files should be compressed by the packer, because no compression follows
+        """
+
+    def set_content_hashing(self, enabled: bool) -> None:
+        """
+        Enables computing the SHA-256 of every packed file, e.g. for the index of incremental uploads.
+        """
+
+    def get_content_hashes(self) -> dict[str, bytes]:
+        """
+        Returns the SHA-256 of the files packed with content hashing enabled, by path.
+        """
+        return {}
+
+    def set_deduplication(self, chunk_index: ChunkIndexService, chunker: CdcChunker) -> None:
+        """
+        Packs only the chunks of the files that are not in the chunk index, together with a recipe to rebuild the files.
+        """
+        raise NotImplementedError("Deduplication is not supported by this file type")
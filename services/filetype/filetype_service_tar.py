@@ -1,13 +1,14 @@
-from typing import Generator
+from typing import Generator, Iterable
 from services.filetype.filetype_base import FiletypeBase
 from services.service_base import ServiceBase
 from utils.report_utils import ReportManager
+from utils.storage_utils import ScannedFile
 
 class FiletypeServiceTar(FiletypeBase, ServiceBase):
-    def pack(self, files: list[str], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
+    def pack(self, files: Iterable[ScannedFile], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
         raise NotImplementedError("Packing into a tar files isnt currently supported.")
 
-    def unpack(self, data: Generator[bytes,None,None], save_location:str, filename:str, upload_reporting: ReportManager) -> None:
+    def unpack(self, data: Generator[bytes,None,None], save_location:str, filename:str, upload_reporting: ReportManager) -> str:
         raise NotImplementedError("Unpacking tar files isnt currently supported.")
 
     def get_extension(self) -> str:
@@ -1,73 +1,186 @@
+import hashlib
+import itertools
+import logging
 import os
-from typing import Generator
+from typing import Any, Callable, Generator, Iterable
 from stat import S_IFREG
 from datetime import datetime
 import uuid
-from stream_zip import stream_zip, ZIP_64, zlib # type: ignore
+from stream_zip import stream_zip, ZIP_64, ZIP_AUTO, zlib # type: ignore
+from services.chunk_index_service import ChunkIndexService
 from services.filetype.filetype_base import FiletypeBase
 from services.service_base import ServiceBase
+from utils.compressibility_utils import PROBE_SAMPLE_SIZE, CompressibilityProbe, MemberDecisions, probe_sample
 from utils.console_utils import print_warning
+from utils.data_utils import bytes_to_human_readable_size
+from utils.dedup_utils import CHUNKS_MEMBER_NAME, RECIPE_MEMBER_NAME, CdcChunker, DedupRecipe, get_chunk_key
+from utils.prefetch_utils import FilePrefetcher
 from utils.report_utils import ReportManager, Reporting
+from utils.storage_utils import ScannedFile
 
 
+logger = logging.getLogger(__name__)
+
+# deflate level of compressible files if no compression follows the packer
+MEMBER_COMPRESSION_LEVEL = 6
+# modification time of the members of a deduplicated upload, fixed so packing the same files gives the same bytes for a resume.
+# It is the earliest time of the zip format
+DEDUP_MEMBER_TIME = datetime(1980, 1, 1)
+
+def _deflate_member(level: int, uncompressed_size: int) -> Any:
+    # a member with its own compression level, ZIP_64 only if it is needed for its size or offset.
+    # Level 0 writes stored deflate blocks, which costs almost no time
+    return ZIP_AUTO(uncompressed_size, level=level)
+
 class FiletypeServiceZip(FiletypeBase, ServiceBase):
 
     compression_level:int
     chunk_size:int
+    probes: dict[str, CompressibilityProbe]
+    compress_members: bool
+    content_hashes: dict[str, bytes] | None
+    chunk_index: ChunkIndexService | None
+    chunker: CdcChunker | None
+    prefetcher: FilePrefetcher
 
-    def __init__(self, compression_level:int, chunk_size:int ) -> None:
+    def __init__(self, compression_level:int, chunk_size:int, prefetch_files: int = 8, prefetch_memory: int = 64 * 1024 * 1024) -> None:
+        """
+        :param prefetch_files: Number of files which are opened and read ahead in the background
+        :param prefetch_memory: Number of bytes of all files which are read ahead
+        """
         if not 0 <= compression_level <= 9:
             raise ValueError("encryptionLevel must be between 0 and 10")
         self.compression_level = compression_level
         if chunk_size < 512:
             raise ValueError("chunkSize must be at least 512")
         self.chunk_size = chunk_size
+        self.probes = {}
+        self.compress_members = False
+        self.content_hashes = None
+        self.chunk_index = None
+        self.chunker = None
+        self.prefetcher = FilePrefetcher(chunk_size, prefetch_files, prefetch_memory)
         super().__init__()
 
-    def pack(self, files: list[str], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
-        member_files = []
+    def get_output_options(self) -> dict[str, Any]:
+        return {
+            "compression_level": self.compression_level,
+            "chunk_size": self.chunk_size,
+            "compress_members": self.compress_members,
+            "dedup_chunk_sizes": [self.chunker.min_size, self.chunker.average_size, self.chunker.max_size] if self.chunker is not None else None
+        }
+
+    def set_compressibility(self, probes: dict[str, CompressibilityProbe], compress_members: bool) -> None:
+        self.probes = probes
+        self.compress_members = compress_members
+
+    def set_content_hashing(self, enabled: bool) -> None:
+        self.content_hashes = {} if enabled else None
+
+    def get_content_hashes(self) -> dict[str, bytes]:
+        return self.content_hashes if self.content_hashes is not None else {}
+
+    def set_deduplication(self, chunk_index: ChunkIndexService, chunker: CdcChunker) -> None:
+        self.chunk_index = chunk_index
+        self.chunker = chunker
+
+    def __deduplicate(self, files: Iterable[ScannedFile], recipe: DedupRecipe,
+                      read_file: Callable[[str, Iterable[bytes]], Generator[bytes, None, None]]) -> Generator[bytes, None, None]:
+        # yields the chunks which are not in the index yet, their offset is the position in the chunks member
+        assert self.chunk_index is not None and self.chunker is not None
+        offset = 0
+        for (file, stat), data in self.prefetcher.prefetch(files):
+            recipe.add_file(file, stat)
+            for chunk in self.chunker.split(read_file(file, data)):
+                key = get_chunk_key(chunk)
+                stored = self.chunk_index.lookup(key)
+                if stored is not None:
+                    recipe.add_chunk(*stored)
+                    continue
+                self.chunk_index.add(key, offset, len(chunk))
+                recipe.add_chunk(None, offset, len(chunk))
+                offset += len(chunk)
+                yield chunk
+
+    def __probe(self, file: str, stat: os.stat_result, data: Iterable[bytes]) -> tuple[CompressibilityProbe, Iterable[bytes]]:
+        # files which were not probed before the upload are probed with their first chunk, which the prefetcher has read already
+        probe = self.probes.get(file)
+        if probe is not None:
+            return probe, data
+        iterator = iter(data)
+        first_chunk = next(iterator, None)
+        if first_chunk is None:
+            return probe_sample(file, b"", stat.st_size), iterator
+        return probe_sample(file, bytes(first_chunk[:PROBE_SAMPLE_SIZE]), stat.st_size), itertools.chain([first_chunk], iterator)
+
+    def __get_member_level(self, file: str, size: int, probe: CompressibilityProbe, decisions: MemberDecisions) -> int:
+        level = self.compression_level
+        if not probe.compressible:
+            level = 0
+        elif self.compress_members:
+            level = max(self.compression_level, MEMBER_COMPRESSION_LEVEL)
+        decision = "deflated" if level > 0 else "left to the compression" if probe.compressible else "stored"
+        decisions.add(decision, size)
+        logger.debug("%s: %s (level %d), %s", file, decision, level, probe.reason)
+        return level
+
+    def pack(self, files: Iterable[ScannedFile], upload_reporting: ReportManager) -> Generator[bytes,None,None]:
         report_uuid = uuid.uuid4()
         upload_reporting.add_report(Reporting("packer", report_uuid, "waiting"))
-        def read_file(fi: str) -> Generator[bytes, None, None]:
-            with open(fi, 'rb') as f:
-                while True:
-                    upload_reporting.add_report(Reporting("packer", report_uuid, "working", "file: " + os.path.basename(fi)))
-                    data = f.read(self.chunk_size)
-                    if not data:
-                        upload_reporting.add_report(Reporting("packer", report_uuid, "waiting"))
-                        return
-                    upload_reporting.add_report(Reporting("packer", report_uuid, "waiting"))
-                    yield data
-        for file in files:
-            modified_at:datetime
-            seconds_since_modified:float
-            try:
-                seconds_since_modified = os.path.getmtime(file)
-                modified_at = datetime.fromtimestamp(seconds_since_modified)
-            except OSError:
-                modified_at = datetime.now()
-
-            mode = S_IFREG | 0o600
-            member_files.append(
-                (file, modified_at, mode, ZIP_64, read_file(file)) # pylint: disable=consider-using-with
-            )
+        progress = upload_reporting.get_progress("packer", report_uuid)
+        def read_file(fi: str, chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+            # the files are opened and read ahead by the prefetcher
+            upload_reporting.add_report(Reporting("packer", report_uuid, "working", "file: " + os.path.basename(fi)))
+            content_hash = hashlib.sha256() if self.content_hashes is not None else None
+            for data in chunks:
+                progress.add(len(data))
+                if content_hash is not None:
+                    content_hash.update(data)
+                yield data
+            if self.content_hashes is not None and content_hash is not None:
+                self.content_hashes[fi] = content_hash.digest()
+        decisions = MemberDecisions()
+        def member_files() -> Generator[tuple[str, datetime, int, Any, Generator[bytes, None, None]], None, None]:
+            # the members are created while the files are scanned, the modification time comes from the scan
+            for (file, stat), data in self.prefetcher.prefetch(files):
+                modified_at = datetime.fromtimestamp(stat.st_mtime)
+                mode = S_IFREG | 0o600
+                probe, member_data = self.__probe(file, stat, data)
+                level = self.__get_member_level(file, stat.st_size, probe, decisions)
+                yield (file, modified_at, mode, _deflate_member(level, stat.st_size), read_file(file, member_data))
+        def deduplicated_members() -> Generator[tuple[str, datetime, int, Any, Iterable[bytes]], None, None]:
+            # stream_zip reads the chunks member completely before it asks for the recipe, so the recipe is complete.
+            # The size of the chunks member is not known ahead, it is a ZIP_64 member with the default level of the packing
+            recipe = DedupRecipe()
+            yield (CHUNKS_MEMBER_NAME, DEDUP_MEMBER_TIME, S_IFREG | 0o600, ZIP_64, self.__deduplicate(files, recipe, read_file))
+            upload_reporting.add_report(Reporting("packer", report_uuid, "working", None,
+                                                  f"Deduplicated {bytes_to_human_readable_size(recipe.total_size - recipe.new_size)} "
+                                                  f"of {bytes_to_human_readable_size(recipe.total_size)}"))
+            recipe_json = recipe.as_json()
+            yield (RECIPE_MEMBER_NAME, DEDUP_MEMBER_TIME, S_IFREG | 0o600, _deflate_member(MEMBER_COMPRESSION_LEVEL, len(recipe_json)), [recipe_json])
         def yield_packing() -> Generator[bytes, None, None]:
+            level = self.compression_level
+            if self.chunk_index is not None and self.compress_members:
+                level = max(self.compression_level, MEMBER_COMPRESSION_LEVEL)
             zipped_chunks:Generator[bytes, None, None] = stream_zip(
-                files=member_files, chunk_size=self.chunk_size,
-                get_compressobj=lambda: zlib.compressobj(wbits=-zlib.MAX_WBITS, level=self.compression_level)
+                files=deduplicated_members() if self.chunk_index is not None else member_files(), chunk_size=self.chunk_size,
+                get_compressobj=lambda: zlib.compressobj(wbits=-zlib.MAX_WBITS, level=level)
             )
             return zipped_chunks
         for chunk in yield_packing():
             yield chunk
-        upload_reporting.add_report(Reporting("packer", report_uuid, "finished"))
+        upload_reporting.add_report(Reporting("packer", report_uuid, "finished", None,
+                                              f"Members: {decisions.get_summary()}" if decisions.counts else None))
 
 
 
-    def unpack(self, data: Generator[bytes,None,None], save_location:str, filename:str, upload_reporting: ReportManager) -> None:
+    def unpack(self, data: Generator[bytes,None,None], save_location:str, filename:str, upload_reporting: ReportManager) -> str:
         print_warning("Unziping is currently unsupported. It will save the zip file instead")
-        with open(os.path.join(save_location, "2" + filename), 'wb') as f:
+        path = os.path.join(save_location, "2" + filename)
+        with open(path, 'wb') as f:
             for chunk in data:
                 f.write(chunk)
+        return path
 
     def get_extension(self) -> str:
         return ".zip"
@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import Generator
+from typing import Any, Generator
 
 from datatypes.transfer_services import TransferInformation
 from dependency_injection.service import Service
@@ -31,3 +31,36 @@ class TransferBase(ServiceBase):
     @abstractmethod
     def download(self, data_information: TransferInformation, report_manager: ReportManager) -> Generator[bytes,None,None]:
         pass
+
+    def set_chunk_hold(self, hold: int) -> None:
+        '''
+        Allows download to reuse the buffer of a chunk after it yielded hold more chunks,
+        because the stage reading the chunks is done with them by then. Transfer services that allocate every chunk ignore it.
+        '''
+
+    def set_resumable(self, fingerprint: str | None, pipeline_state: dict[str, Any]) -> None:
+        '''
+        Records the next upload under the fingerprint of its input, so it can be resumed after an interruption.
+        The fingerprint is None if the input is still read while it is uploaded, it is passed to set_fingerprint once it is known.
+        The pipeline_state is returned by resume, so the pipeline can be rebuilt to produce the same data again.
+        Transfer services that cannot resume uploads ignore it.
+        '''
+
+    def is_dryrun(self) -> bool:
+        '''
+        Returns True if uploads are only simulated, so nothing that refers to the uploaded data may be recorded.
+        '''
+        return False
+
+    def set_fingerprint(self, fingerprint: str) -> None:
+        '''
+        Sets the fingerprint of a resumable upload whose input was read while it was uploaded, it can be resumed from then on.
+        May be called from another thread while the upload is running.
+        '''
+
+    def resume(self, fingerprint: str) -> dict[str, Any] | None: # pylint: disable=unused-argument
+        '''
+        Makes the next upload continue the interrupted upload with the given fingerprint.
+        Returns the pipeline_state of the interrupted upload or None if there is no upload to resume.
+        '''
+        return None
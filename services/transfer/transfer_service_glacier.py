@@ -1,26 +1,32 @@
 import datetime
-import hashlib
-import multiprocessing as mp
 import tempfile
+import threading
 import time
 import uuid
-from io import BufferedRandom
-from typing import Any, Generator, Tuple, Union
+from typing import Any, Generator, MutableMapping, Tuple
 import boto3
 import botocore.client
+import botocore.config
 import botocore.response
 import botocore.exceptions
+from tinydb import Query
+from tinydb.table import Table
 from datatypes.transfer_services import TransferInformation, TransferServiceType
+from datatypes.upload_manifest import UploadManifest
 from dependency_injection.service import Service
 from services.cancel_service import CancelService
+from services.db_service import DbService
 from services.service_base import ServiceBase
 from services.setting_service import SettingService
 from services.transfer.transfer_base import TransferBase
+from utils.concurrency_utils import ordered_parallel_map
+from utils.aws_utils import is_retryable_error, is_throttling_error
 from utils.console_utils import console, print_error, print_success, print_warning
-from utils.data_utils import (CreateSplittedFilesFromGenerator,
-                              bytes_to_human_readable_size, get_file_size)
-from utils.hash_utils import compute_sha256_tree_hash_for_aws
+from utils.data_utils import UploadPart, UploadPartAssembler, bytes_to_human_readable_size, find_missing_ranges
+from utils.hash_utils import TreeHashCombiner, TreeHasher
 from utils.report_utils import Reporting, ReportManager
+from utils.retry_utils import RetryPolicy
+from utils.upload_utils import AdaptiveConcurrencyController, PartUploader
 
 class GlacierInformation(TransferInformation):
     def __init__(self, dryrun: bool, region: str, vault: str, file_name: str, archive_id: str, checksum: str, size_in_bytes: int, human_readable_size: str, upload_id: str, location: str) -> None:
@@ -47,14 +53,49 @@ class GlacierInformation(TransferInformation):
         d["location"] = self.location
         return d
 
+class ResumeMismatchError(Exception):
+    """
+    The data of a resumed upload differs from the parts that were uploaded before the interruption.
+    """
+
+class RangeChecksumError(Exception):
+    """
+    The tree hash of a downloaded range differs from the checksum Glacier returned for it.
+    """
+
 class TransferServiceGlacier(TransferBase, ServiceBase):
+    # ranges are read and yielded in blocks of this size. Up to download_spool_size of a range is kept in memory, the rest on disk
+    download_block_size: int = 1024 * 1024
+    download_spool_size: int = 4 * 1024 * 1024
+
     service: Service
     upload_size: int
+    max_memory_bytes: int | None
+    archive_tree_hash: TreeHashCombiner
     dryrun: bool
-    hashes: list[bytes] = []
-    upload_consumer_processes: list[mp.Process] = []
+    upload_workers: int
+    min_upload_workers: int
+    max_upload_workers: int
+    part_uploader: PartUploader | None
+    concurrency_controller: AdaptiveConcurrencyController | None
+    report_ids: dict[int, uuid.UUID]
+    report_ids_lock: threading.Lock
+    retry_policy: RetryPolicy
+    retry_count: int
+    confirmed_parts: dict[int, tuple[int, int]]
+    resumable: bool
+    upload_fingerprint: str | None
+    manifest_upload_id: str | None
+    pipeline_state: dict[str, Any]
+    resume_manifest: UploadManifest | None
+    uploaded_parts: dict[int, tuple[int, int, str]]
+    manifest_lock: threading.Lock
+    download_workers: int
+    download_range_size: int
 
-    def __init__(self,  service: Service, dryrun: bool = False, upload_size_in_mb: int = 16) -> None:
+    def __init__(self,  service: Service, dryrun: bool = False, upload_size_in_mb: int = 16, max_memory_in_mb: int = 0, # pylint: disable=too-many-arguments
+                 upload_workers: int = 4, min_upload_workers: int = 1, max_upload_workers: int = 8, upload_attempts: int = 5,
+                 download_workers: int = 4, download_range_size_in_mb: int = 32) -> None:
         self.service = service
         self.dryrun = dryrun
         if (upload_size_in_mb & (upload_size_in_mb - 1)) != 0:
@@ -62,47 +103,116 @@ class TransferServiceGlacier(TransferBase, ServiceBase):
         if upload_size_in_mb < 1 or upload_size_in_mb > 4096:
             raise ValueError("uploadSize must be between 1 MB and 4096 MB. This is a limitation of AWS Glacier.")
         self.upload_size = upload_size_in_mb * 1024 * 1024
+        if max_memory_in_mb < 0:
+            raise ValueError("max_memory_in_mb must not be negative")
+        self.max_memory_bytes = max_memory_in_mb * 1024 * 1024 if max_memory_in_mb > 0 else None
+        self.archive_tree_hash = TreeHashCombiner()
+        if not 1 <= min_upload_workers <= max_upload_workers:
+            raise ValueError("min_upload_workers must be at least 1 and not greater than max_upload_workers")
+        self.min_upload_workers = min_upload_workers
+        self.max_upload_workers = max_upload_workers
+        self.upload_workers = min(max(upload_workers, min_upload_workers), max_upload_workers)
+        self.part_uploader = None
+        self.concurrency_controller = None
+        self.report_ids = {}
+        self.report_ids_lock = threading.Lock()
+        self.retry_policy = RetryPolicy(max_attempts=upload_attempts, is_retryable=is_retryable_error)
+        self.retry_count = 0
+        self.confirmed_parts = {}
+        self.resumable = False
+        self.upload_fingerprint = None
+        self.manifest_upload_id = None
+        self.pipeline_state = {}
+        self.resume_manifest = None
+        self.uploaded_parts = {}
+        self.manifest_lock = threading.Lock()
+        if download_workers < 1:
+            raise ValueError("download_workers must be at least 1")
+        self.download_workers = download_workers
+        if download_range_size_in_mb < 1 or (download_range_size_in_mb & (download_range_size_in_mb - 1)) != 0:
+            raise ValueError("download_range_size_in_mb must be a power of 2, so the ranges are aligned to the tree hash of Glacier")
+        self.download_range_size = download_range_size_in_mb * 1024 * 1024
         super().__init__()
 
-    def add_to_hash_list(self, file: BufferedRandom) -> None:
-        file.seek(0)
-        for data in iter(lambda: file.read(1024*1024), b""):
-            self.hashes.append(hashlib.sha256(data).digest())
-        file.seek(0)
+    def is_dryrun(self) -> bool:
+        return self.dryrun
+
+    def set_resumable(self, fingerprint: str | None, pipeline_state: dict[str, Any]) -> None:
+        self.resumable = True
+        self.upload_fingerprint = fingerprint
+        self.pipeline_state = pipeline_state
+        self.resume_manifest = None
+
+    def set_fingerprint(self, fingerprint: str) -> None:
+        # the scan ends in the thread of the packer, while the upload may be inserting its manifest
+        with self.manifest_lock:
+            self.upload_fingerprint = fingerprint
+            if self.manifest_upload_id is None:
+                return
+            if self.__get_manifest_table().contains(Query().fingerprint == fingerprint):
+                print_warning("An interrupted upload of the same files is kept on remote. Use --resume to continue it instead of starting over")
+            self.__get_manifest_table().update({"fingerprint": fingerprint}, Query().upload_id == self.manifest_upload_id)
+
+    def resume(self, fingerprint: str) -> dict[str, Any] | None:
+        documents = self.__get_manifest_table().search(Query().fingerprint == fingerprint)
+        if len(documents) == 0:
+            return None
+        # documents are returned in the order they were inserted, so this is the latest upload of the files
+        manifest = UploadManifest.from_dict(documents[-1])
+        self.resumable = True
+        self.upload_fingerprint = fingerprint
+        self.pipeline_state = manifest.pipeline_state
+        self.resume_manifest = manifest
+        return manifest.pipeline_state
 
     def upload(self, data: Generator[bytes,None,None], report_manager: ReportManager) -> tuple[bool, TransferInformation | None]:
         setting_service: SettingService = self.service.get_service("setting_service")
         region:str | None = setting_service.read_settings("default", "region")
         vault:str | None = setting_service.read_settings("default", "vault")
+        if self.resume_manifest is not None:
+            # the parts of the interrupted upload are where it was started
+            region = self.resume_manifest.region
+            vault = self.resume_manifest.vault
         if None in [region, vault]:
             raise Exception("Region or Vault is not set")
-        glacier_client: botocore.client.BaseClient = boto3.client("glacier", region_name=region)
+        # boto3 clients are thread safe, so all upload workers share one client with a connection per worker
+        glacier_client: botocore.client.BaseClient = boto3.client(
+            "glacier",
+            region_name=region,
+            config=botocore.config.Config(max_pool_connections=self.max_upload_workers)
+        )
         cancel_service: CancelService = self.service.get_service("cancel_service")
-        file_name:str = datetime.datetime.now().strftime("%Y-%m-%d") + self.get_file_extension(self.service)
         assert region is not None
         assert vault is not None
-        upload_id, location, cancel_uuid = self.__init_upload(
-            file_name=file_name,
-            vault=vault,
-            region=region,
-            cancel_service=cancel_service,
-            glacier_client=glacier_client
-        )
+        if self.resume_manifest is not None:
+            file_name = self.resume_manifest.file_name
+            upload_id, location, cancel_uuid = self.__resume_upload(self.resume_manifest, cancel_service, glacier_client)
+        else:
+            file_name = datetime.datetime.now().strftime("%Y-%m-%d") + self.get_file_extension(self.service)
+            upload_id, location, cancel_uuid = self.__init_upload(
+                file_name=file_name,
+                vault=vault,
+                region=region,
+                cancel_service=cancel_service,
+                glacier_client=glacier_client
+            )
 
         # Upload the parts
         try:
             upload_total_size_in_bytes: int = self.__upload_parts(data, upload_id, vault, report_manager, glacier_client)
         except KeyboardInterrupt as e:
             raise e
+        except ResumeMismatchError as exception:
+            # the uploaded parts are kept, the upload can still be resumed with the files and options it was started with
+            print_error(str(exception))
+            self.cancel_upload("Resumed data differs from the uploaded parts", glacier_client, vault, upload_id)
+            cancel_service.unsubscribe_from_cancel_event(cancel_uuid)
+            return False, None
         except Exception:
             print_error("Error during upload")
             self.cancel_upload("Error during upload", glacier_client, vault, upload_id)
             cancel_service.unsubscribe_from_cancel_event(cancel_uuid)
             return False, None
-        if upload_total_size_in_bytes == -1:
-            self.cancel_upload("User Interrupt", glacier_client, vault, upload_id)
-            cancel_service.unsubscribe_from_cancel_event(cancel_uuid)
-            return False, None
         # Finish the upload
         try:
             archive_id, checksum = self.__finish_upload(upload_id, vault, upload_total_size_in_bytes, report_manager, cancel_service, cancel_uuid, glacier_client)
@@ -110,6 +220,7 @@ class TransferServiceGlacier(TransferBase, ServiceBase):
             self.cancel_upload("Couldnt finish the upload", glacier_client, vault, upload_id)
             cancel_service.unsubscribe_from_cancel_event(cancel_uuid)
             return False, None
+        self.__remove_manifest(upload_id)
         info = GlacierInformation(
             dryrun=self.dryrun,
             region=region,
@@ -126,8 +237,7 @@ class TransferServiceGlacier(TransferBase, ServiceBase):
 
     def __finish_upload(self, upload_id: str, vault: str, upload_total_size_in_bytes: int, report_manager: ReportManager, cancel_service: CancelService, cancel_uuid: uuid.UUID, glacier_client: botocore.client.BaseClient) -> tuple[str, str]:
         assert glacier_client is not None
-        checksum = compute_sha256_tree_hash_for_aws(self.hashes)
-        self.hashes = []
+        checksum = self.archive_tree_hash.hexdigest()
         if checksum == "" or checksum is None:
             raise Exception("Error calculating checksum. Upload cannot be completed")
         if self.dryrun:
@@ -140,12 +250,12 @@ class TransferServiceGlacier(TransferBase, ServiceBase):
             uuid_finish_up = uuid.uuid4()
             report_manager.add_report(Reporting("transferer", uuid_finish_up, "working", "Finishing up..."))
             assert hasattr(glacier_client, 'complete_multipart_upload')
-            complete_status = glacier_client.complete_multipart_upload( # type: ignore
+            complete_status = self.retry_policy.call(lambda: glacier_client.complete_multipart_upload( # type: ignore
                 vaultName=vault,
                 uploadId=upload_id,
                 archiveSize=str(upload_total_size_in_bytes),
                 checksum=checksum
-            )
+            ))
             report_manager.add_report(Reporting("transferer", uuid_finish_up, "finished", "Finishing up..."))
         archive_id = complete_status['archiveId']
         assert archive_id is not None and isinstance(archive_id, str)
@@ -167,98 +277,207 @@ class TransferServiceGlacier(TransferBase, ServiceBase):
                 partSize=str(self.upload_size)
             )
         cancel_uuid = cancel_service.subscribe_to_cancel_event(self.cancel_upload, glacier_client=glacier_client, vault=vault, upload_id=str(creation_response['uploadId']))
+        if not self.dryrun and self.resumable:
+            with self.manifest_lock:
+                # an upload of files that are still scanned gets its fingerprint with set_fingerprint, it can not be resumed before
+                if self.upload_fingerprint is not None and self.__get_manifest_table().contains(Query().fingerprint == self.upload_fingerprint):
+                    print_warning("An interrupted upload of the same files is kept on remote. Use --resume to continue it instead of starting over")
+                self.__get_manifest_table().insert(UploadManifest(
+                    fingerprint=self.upload_fingerprint if self.upload_fingerprint is not None else "",
+                    upload_id=creation_response['uploadId'],
+                    vault=vault,
+                    region=region,
+                    file_name=file_name,
+                    location=creation_response['location'],
+                    part_size=self.upload_size,
+                    pipeline_state=self.pipeline_state
+                ).as_dict())
+                self.manifest_upload_id = creation_response['uploadId']
+        self.uploaded_parts = {}
         return creation_response['uploadId'] , creation_response['location'], cancel_uuid
 
-    def __upload_consumer(self, queue: "mp.Queue[dict[str, Union[str, int, bytes]]]", upload_id: str, vault: str, upload_reporting: ReportManager, glacier_client: botocore.client.BaseClient) -> None:
-        report_uuid = uuid.uuid4()
-        upload_reporting.add_report(Reporting("transferer", report_uuid, "waiting"))
+    def __resume_upload(self, manifest: UploadManifest, cancel_service: CancelService, glacier_client: botocore.client.BaseClient) -> Tuple[str, str, uuid.UUID]:
+        self.upload_size = manifest.part_size
+        if self.dryrun:
+            console.print(f"DRY RUN: Resuming the upload of {manifest.file_name} to Glacier vault {manifest.vault} in {manifest.region} region")
+            self.uploaded_parts = {}
+        else:
+            self.uploaded_parts = self.__list_uploaded_parts(manifest, glacier_client)
+            with self.manifest_lock:
+                # the remote parts are authoritative, a part may have been confirmed without being recorded
+                manifest.parts = dict(self.uploaded_parts)
+                self.__get_manifest_table().update({"parts": manifest.as_dict()["parts"]}, Query().upload_id == manifest.upload_id)
+            console.print(f"Resuming the upload of {manifest.file_name}: {len(self.uploaded_parts)} parts are already uploaded")
+        cancel_uuid = cancel_service.subscribe_to_cancel_event(self.cancel_upload, glacier_client=glacier_client, vault=manifest.vault, upload_id=manifest.upload_id)
+        return manifest.upload_id, manifest.location, cancel_uuid
+
+    def __list_uploaded_parts(self, manifest: UploadManifest, glacier_client: botocore.client.BaseClient) -> dict[int, tuple[int, int, str]]:
+        """
+        Lists the parts of the multipart upload that Glacier confirmed, by part index.
+        """
+        assert hasattr(glacier_client, 'list_parts')
+        uploaded_parts: dict[int, tuple[int, int, str]] = {}
+        marker: str | None = None
         while True:
-            if queue.empty():
-                upload_reporting.add_report(Reporting("transferer", report_uuid, "waiting"))
-                try:
-                    time.sleep(0.5)
-                except KeyboardInterrupt:
-                    break
-                continue
-            try:
-                data = queue.get(timeout=1)
-            except Exception:
-                continue
-            if data["range"] == "finish":
-                queue.put({"range": "finish", "part": 0, "data": b""}) # add it again to the queue to notify the other consumers
-                upload_reporting.add_report(Reporting("transferer", report_uuid, "finished"))
-                break
-            if not isinstance(data, dict) or not isinstance(data["data"], bytes) or not isinstance(data["range"], str) or not isinstance(data["part"], int):
-                continue
-            upload_reporting.add_report(Reporting("transferer", report_uuid, "working", f"uploading Part {str(data["part"] + 1)}"))
+            parameters = {"vaultName": manifest.vault, "uploadId": manifest.upload_id}
+            if marker is not None:
+                parameters["marker"] = marker
             try:
-                assert hasattr(glacier_client, 'upload_multipart_part')
-                glacier_client.upload_multipart_part( # type: ignore
-                    vaultName=vault,
-                    uploadId=upload_id,
-                    body=data["data"],
-                    range=data["range"]
-                )
+                response = self.retry_policy.call(lambda: glacier_client.list_parts(**parameters)) # pylint: disable=cell-var-from-loop
+            except botocore.exceptions.ClientError as error:
+                if error.response.get("Error", {}).get("Code") == "ResourceNotFoundException":
+                    self.__remove_manifest(manifest.upload_id)
+                    raise Exception("The interrupted upload does not exist on remote anymore. Start a new upload") from error
+                raise
+            if int(response["PartSizeInBytes"]) != manifest.part_size:
+                raise Exception(f"The part size on remote ({response['PartSizeInBytes']}) differs from the recorded part size ({manifest.part_size})")
+            for remote_part in response.get("Parts", []):
+                start, end = (int(position) for position in remote_part["RangeInBytes"].split("-"))
+                uploaded_parts[start // manifest.part_size] = (start, end - start + 1, remote_part["SHA256TreeHash"])
+            marker = response.get("Marker")
+            if not marker:
+                return uploaded_parts
+
+    def __get_manifest_table(self) -> Table:
+        db_uploads_service: DbService = self.service.get_service("db_uploads_service")
+        return db_uploads_service.get_context().table("pending_uploads")
+
+    def __record_part(self, upload_id: str, part: UploadPart) -> None:
+        if not self.resumable or part.tree_hash is None:
+            return
+        tree_hash = part.tree_hash.hex()
+        def add_part(document: MutableMapping[str, Any]) -> None:
+            document["parts"][str(part.index)] = [part.offset, part.size, tree_hash]
+        # tinydb is not thread safe and every worker records its parts
+        with self.manifest_lock:
+            self.__get_manifest_table().update(add_part, Query().upload_id == upload_id)
+
+    def __remove_manifest(self, upload_id: str) -> None:
+        with self.manifest_lock:
+            self.__get_manifest_table().remove(Query().upload_id == upload_id)
+
+    def __skip_uploaded_part(self, part: UploadPart, uploaded_part: tuple[int, int, str]) -> None:
+        """
+        Verifies that the regenerated part is the one uploaded before the interruption, instead of sending it again.
+        """
+        try:
+            offset, size, tree_hash = uploaded_part
+            if (offset, size) != (part.offset, part.size) or part.tree_hash is None or part.tree_hash.hex() != tree_hash:
+                raise ResumeMismatchError(f"Part {part.index + 1} differs from the part uploaded before the interruption. "
+                                          "The files or the options must not change to resume an upload")
+            with self.report_ids_lock:
+                self.confirmed_parts[part.index] = (part.offset, part.size)
+        finally:
+            part.release()
 
-            except KeyboardInterrupt:
-                break
-            except Exception:
-                print_error("Error while uploading a part")
+    def __upload_part(self, part: UploadPart, upload_id: str, vault: str, upload_reporting: ReportManager, glacier_client: botocore.client.BaseClient) -> None:
+        with self.report_ids_lock:
+            report_uuid = self.report_ids.setdefault(threading.get_ident(), uuid.uuid4())
+        upload_reporting.add_report(Reporting("transferer", report_uuid, "working", f"uploading Part {str(part.index + 1)}"))
+        assert hasattr(glacier_client, 'upload_multipart_part')
+        def send_part() -> None:
+            # a new reader for every attempt, as a failed attempt may have read the body partially
+            glacier_client.upload_multipart_part( # type: ignore
+                vaultName=vault,
+                uploadId=upload_id,
+                body=part.get_reader(),
+                range=f"bytes {part.offset}-{part.offset + part.size - 1}/*",
+                checksum=part.tree_hash.hex() if part.tree_hash else None
+            )
+        def report_retry(attempt: int, exception: BaseException, delay: float) -> None:
+            with self.report_ids_lock:
+                self.retry_count += 1
+            if self.part_uploader is not None and is_throttling_error(exception):
+                # recorded once by the part uploader when the part finished, not for every retry
+                self.part_uploader.report_throttling(part)
+            upload_reporting.get_progress("transferer", report_uuid).add_retry()
+            upload_reporting.add_report(Reporting("transferer", report_uuid, "working", f"retrying Part {str(part.index + 1)}",
+                                                  f"Part {part.index + 1} failed ({exception}), retry {attempt} in {delay:.1f}s"))
+        self.retry_policy.call(send_part, on_retry=report_retry)
+        with self.report_ids_lock:
+            self.confirmed_parts[part.index] = (part.offset, part.size)
+        self.__record_part(upload_id, part)
+        upload_reporting.get_progress("transferer", report_uuid).add(part.size)
+        upload_reporting.add_report(Reporting("transferer", report_uuid, "waiting"))
 
     def __upload_parts(self, data: Generator[bytes,None,None], upload_id: str, vault: str, upload_reporting: ReportManager, glacier_client: botocore.client.BaseClient) -> int:
         upload_total_size_in_bytes = 0
-        creater = CreateSplittedFilesFromGenerator()
-        uploaded_parts = 0
-        queue: mp.Queue[dict[str, Union[str, int, bytes]]] = mp.Queue()
-        amount_of_consumer_processes = 2
-        for _ in range(amount_of_consumer_processes):
-            process = mp.Process(target=self.__upload_consumer, args=(queue, upload_id, vault, upload_reporting, glacier_client))
-            process.daemon = True
-            process.start()
-            self.upload_consumer_processes.append(process)
-        while True:
-            with tempfile.TemporaryFile(mode="b+w") as temp_file:
-                try:
-                    while queue.qsize() > 1:
-                        try:
-                            time.sleep(0.5)
-                        except KeyboardInterrupt:
-                            break
-                except KeyboardInterrupt:
-                    break
-                try:
-                    creater.create_next_upload_size_part(data, self.upload_size, temp_file)
-                    self.add_to_hash_list(temp_file)
-                except StopIteration:
-                    temp_file.close()
+        # one buffer more than parts in flight, so the next part can be assembled while the others are uploading
+        assembler = UploadPartAssembler(self.upload_size, buffer_count=self.max_upload_workers + 1, max_memory_bytes=self.max_memory_bytes, compute_tree_hash=True)
+        self.archive_tree_hash = assembler.archive_tree_hash
+        self.confirmed_parts = {}
+        self.retry_count = 0
+        controller_uuid = uuid.uuid4()
+        def report_decision(message: str) -> None:
+            upload_reporting.add_report(Reporting("transferer", controller_uuid, "working", f"{controller.get_limit()} upload workers", message))
+        controller = AdaptiveConcurrencyController(
+            initial=self.upload_workers,
+            minimum=self.min_upload_workers,
+            maximum=self.max_upload_workers,
+            on_decision=report_decision
+        )
+        self.concurrency_controller = controller
+        # kept in a local variable, a cancel from another thread only shuts it down
+        part_uploader = PartUploader(
+            lambda part: self.__upload_part(part, upload_id, vault, upload_reporting, glacier_client),
+            workers=self.max_upload_workers,
+            concurrency_controller=controller,
+            is_throttling_error=is_throttling_error
+        )
+        self.part_uploader = part_uploader
+        try:
+            for part in assembler.parts(data):
+                upload_total_size_in_bytes += part.size
+                if self.dryrun:
+                    part.release()
+                    continue
+                uploaded_part = self.uploaded_parts.get(part.index)
+                if uploaded_part is not None:
+                    self.__skip_uploaded_part(part, uploaded_part)
+                    continue
+                part_uploader.submit(part)
+                if part_uploader.has_failed():
                     break
-                temp_file_size = get_file_size(temp_file)
-                if not self.dryrun:
-                    queue.put({
-                        "range": f"bytes {uploaded_parts * self.upload_size}-{(uploaded_parts * self.upload_size) + temp_file_size - 1}/*",
-                        "part": uploaded_parts,
-                        "data": temp_file.read()})
-                upload_total_size_in_bytes += temp_file_size
-            uploaded_parts += 1
-        queue.put({"range": "finish", "part": 0, "data": b""})
-        for process in self.upload_consumer_processes:
-            process.join()
+            failed_parts = part_uploader.wait()
+        finally:
+            part_uploader.shutdown(cancel_pending=True)
+        for index, exception in failed_parts.items():
+            print_error(f"Error while uploading Part {index + 1}: {exception}")
+        if failed_parts:
+            raise Exception(f"{len(failed_parts)} parts could not be uploaded")
+        if any(offset + size > upload_total_size_in_bytes for offset, size, _ in self.uploaded_parts.values()):
+            raise ResumeMismatchError("The resumed data is shorter than the parts uploaded before the interruption")
+        missing_ranges = find_missing_ranges(self.confirmed_parts.values(), upload_total_size_in_bytes)
+        if missing_ranges and not self.dryrun:
+            raise Exception(f"Upload incomplete, {len(missing_ranges)} ranges were not confirmed: {missing_ranges}")
+        for report_uuid in self.report_ids.values():
+            upload_reporting.add_report(Reporting("transferer", report_uuid, "finished"))
+        upload_reporting.add_report(Reporting("transferer", controller_uuid, "finished", f"{controller.get_limit()} upload workers"))
         return upload_total_size_in_bytes
 
-    def cancel_upload(self, reason: str, glacier_client: botocore.client.BaseClient, vault: str = "", upload_id: str = "") -> None:
+    def cancel_upload(self, reason: str, glacier_client: botocore.client.BaseClient, vault: str = "", upload_id: str = "", abort: bool = False) -> None: # pylint: disable=too-many-arguments
+        """
+        Stops the upload. The uploaded parts of a resumable upload are kept unless abort is set.
+        """
         if not self.dryrun:
-            for process in self.upload_consumer_processes:
-                process.terminate()
-            self.upload_consumer_processes = []
-            if vault == "" or upload_id == "":
-                print("Aborting all uploads")
+            if self.part_uploader is not None:
+                self.part_uploader.shutdown(cancel_pending=True)
+            if self.resumable and not abort:
+                print_warning(f"Upload stopped because of {reason}. The uploaded parts are kept, run the same upload with --resume to continue it")
+            elif vault != "" and upload_id != "":
+                print_warning("Aborting all uploads")
                 assert hasattr(glacier_client, 'abort_multipart_upload')
                 glacier_client.abort_multipart_upload(vaultName=vault, uploadId=upload_id) # type: ignore
+                self.__remove_manifest(upload_id)
                 print_warning(f"Uploaded Parts removed on remote because of {reason}")
 
     def download(self, data_information: TransferInformation, report_manager: ReportManager) -> Generator[bytes,None,None]:
         assert isinstance(data_information, GlacierInformation)
-        glacier_client = boto3.client("glacier", region_name=data_information.region)
+        glacier_client = boto3.client(
+            "glacier",
+            region_name=data_information.region,
+            config=botocore.config.Config(max_pool_connections=self.download_workers)
+        )
 
         job_id = self.check_existing_download_job(glacier_client, data_information)
         if job_id == "":
@@ -324,34 +543,76 @@ class TransferServiceGlacier(TransferBase, ServiceBase):
     def __download_file(self, data_information: GlacierInformation, report_manager: ReportManager, job_id:str, glacier_client: botocore.client.BaseClient) -> Generator[bytes, Any, Any]:
         download_uuid = uuid.uuid4()
         report_manager.add_report(Reporting("transferer", download_uuid, "working", "Downloading"))
+        downloaded_bytes = 0
+        downloaded_bytes_lock = threading.Lock()
         def download_reporter(number_of_bytes: int) -> None:
+            nonlocal downloaded_bytes
+            with downloaded_bytes_lock:
+                downloaded_bytes += number_of_bytes
+                total = downloaded_bytes
             report_manager.add_report(
                 Reporting(
                     "transferer",
                     download_uuid,
                     "working",
-                    f"Downloading {bytes_to_human_readable_size(number_of_bytes)} of {data_information.human_readable_size}."
-                    f"{number_of_bytes / data_information.size_in_bytes * 100:.2f}% done."
+                    f"Downloading {bytes_to_human_readable_size(total)} of {data_information.human_readable_size}."
+                    f"{total / data_information.size_in_bytes * 100:.2f}% done."
                 )
             )
-        hashes: list[bytes] = []
+        # a range with a wrong checksum is fetched again on its own
+        range_retry_policy = RetryPolicy(
+            max_attempts=self.retry_policy.max_attempts,
+            base_delay=self.retry_policy.base_delay,
+            max_delay=self.retry_policy.max_delay,
+            is_retryable=lambda exception: isinstance(exception, RangeChecksumError) or is_retryable_error(exception)
+        )
 
-        def download_part(start:int, end:int) -> botocore.response.StreamingBody:
-            byte_range = f"bytes={start}-{end}"
-            response = glacier_client.get_job_output( # type: ignore
-                vaultName=data_information.vault,
-                jobId=job_id,
-                range=byte_range
-            )
-            download_reporter(end)
-            hashes.append(str.encode(response['checksum']))
-            return response['body']
+        def download_part(byte_range: tuple[int, int]) -> tuple[tempfile.SpooledTemporaryFile[bytes], bytes]:
+            start, end = byte_range
+            def fetch() -> tuple[tempfile.SpooledTemporaryFile[bytes], bytes]:
+                response = glacier_client.get_job_output( # type: ignore
+                    vaultName=data_information.vault,
+                    jobId=job_id,
+                    range=f"bytes={start}-{end}"
+                )
+                tree_hasher = TreeHasher()
+                spool: tempfile.SpooledTemporaryFile[bytes] = tempfile.SpooledTemporaryFile(max_size=self.download_spool_size) # pylint: disable=consider-using-with
+                try:
+                    while block := response['body'].read(self.download_block_size):
+                        tree_hasher.update(block)
+                        spool.write(block)
+                    if spool.tell() != end - start + 1:
+                        raise RangeChecksumError(f"Range {start}-{end} is incomplete, got {spool.tell()} bytes")
+                    # Glacier only returns a checksum for ranges that are aligned to the tree hash
+                    expected_checksum = response.get('checksum')
+                    if expected_checksum is not None and expected_checksum != tree_hasher.hexdigest():
+                        raise RangeChecksumError(f"Checksum of range {start}-{end} does not match")
+                except BaseException:
+                    spool.close()
+                    raise
+                spool.seek(0)
+                return spool, tree_hasher.digest()
+            def report_retry(attempt: int, exception: BaseException, delay: float) -> None:
+                report_manager.add_report(Reporting("transferer", download_uuid, "working", "Downloading",
+                                                    f"Range {start}-{end} failed ({exception}), retry {attempt} in {delay:.1f}s"))
+            spool, tree_hash = range_retry_policy.call(fetch, on_retry=report_retry)
+            download_reporter(end - start + 1)
+            return spool, tree_hash
 
-        download_size = 1024*1024*20
-        last_part_end: int = -1
         assert hasattr(glacier_client, 'get_job_output')
-        for end in range(download_size, data_information.size_in_bytes, download_size):
-            yield download_part(last_part_end + 1, end).read()
-        if data_information.size_in_bytes % download_size != 0:
-            yield download_part(last_part_end + 1, data_information.size_in_bytes - 1).read()
-        # TODO: check if the hashes are correct
+        byte_ranges = (
+            (start, min(start + self.download_range_size, data_information.size_in_bytes) - 1)
+            for start in range(0, data_information.size_in_bytes, self.download_range_size)
+        )
+        archive_tree_hash = TreeHashCombiner()
+        # the ranges are downloaded in parallel, but yielded in order. At most one range per worker waits to be yielded
+        for spool, tree_hash in ordered_parallel_map(download_part, byte_ranges, self.download_workers, thread_name_prefix="range-downloader"):
+            # every range except the last one covers a power of two number of leaves, so their tree hashes combine to the one of the archive
+            archive_tree_hash.add(tree_hash)
+            with spool:
+                while block := spool.read(self.download_block_size):
+                    yield block
+        if archive_tree_hash.count > 0 and archive_tree_hash.hexdigest() != data_information.checksum:
+            report_manager.add_report(Reporting("transferer", download_uuid, "failed", "Checksum of the archive does not match"))
+            raise Exception(f"Checksum of the downloaded archive {archive_tree_hash.hexdigest()} does not match the checksum of the upload {data_information.checksum}")
+        report_manager.add_report(Reporting("transferer", download_uuid, "finished", f"Downloaded {data_information.human_readable_size}"))
@@ -1,13 +1,13 @@
 import os
 import uuid
-from typing import Any, Generator
+from typing import Any, Generator, Iterable
 
 from datatypes.transfer_services import TransferInformation, TransferServiceType
 from dependency_injection.service import Service
 from services.service_base import ServiceBase
 from services.transfer.transfer_base import TransferBase
 from utils.console_utils import print_error, print_success
-from utils.data_utils import bytes_to_human_readable_size
+from utils.data_utils import BufferPool, bytes_to_human_readable_size, read_into_pool
 from utils.report_utils import Reporting, ReportManager
 
 class SaveInformation(TransferInformation):
@@ -29,24 +29,30 @@ class TransferServiceSave(TransferBase, ServiceBase):
     service: Service
     file_name: str
     location: str
-    def __init__(self,  service: Service, location: str, file_name_without_extension: str) -> None:
+    read_size: int
+    chunk_hold: int | None
+    def __init__(self,  service: Service, location: str, file_name_without_extension: str, read_size: int = 10 * 1024 * 1024) -> None:
         self.service = service
         self.file_name = file_name_without_extension
         self.location = location
+        self.read_size = read_size
+        self.chunk_hold = None
         super().__init__()
 
+    def set_chunk_hold(self, hold: int) -> None:
+        self.chunk_hold = hold
+
     def upload(self, data: Generator[bytes,None,None], report_manager: ReportManager) -> tuple[bool, TransferInformation | None]:
         self.file_name:str = os.path.join(self.location, self.file_name + self.get_file_extension(self.service))
         size:int = 0
         report_uuid = uuid.uuid4()
         report_manager.add_report(Reporting("transferer", report_uuid, "waiting"))
+        progress = report_manager.get_progress("transferer", report_uuid)
         try:
             with open(self.file_name, 'wb') as file:
-                chunk_count = 0
                 for chunk in data:
                     size += len(chunk)
-                    chunk_count += 1
-                    report_manager.add_report(Reporting("transferer", report_uuid, "working", "chunk: " + str(chunk_count)))
+                    progress.add(len(chunk))
                     file.write(chunk)
         except (FileExistsError, FileNotFoundError) as exception:
             report_manager.add_report(Reporting("packer", report_uuid, "failed"))
@@ -61,6 +67,7 @@ class TransferServiceSave(TransferBase, ServiceBase):
     def download(self, data_information: TransferInformation, report_manager: ReportManager) -> Generator[bytes,None,None]:
         report_uuid = uuid.uuid4()
         report_manager.add_report(Reporting("transferer", report_uuid, "waiting"))
+        progress = report_manager.get_progress("transferer", report_uuid)
         assert isinstance(data_information, SaveInformation)
         file_name = data_information.file_name
         location = data_information.location
@@ -69,16 +76,17 @@ class TransferServiceSave(TransferBase, ServiceBase):
         assert os.path.isdir(location)
         assert os.path.isfile(os.path.join(location,file_name))
         try:
-            with open(os.path.join(location,file_name), 'rb') as file:
-                chunk_count = 0
+            with open(os.path.join(location,file_name), 'rb', buffering=0) as file:
                 size = 0
-                while True:
-                    chunk = file.read(1024*1024*10)
-                    if not chunk:
-                        break
-                    chunk_count += 1
+                chunks: Iterable[bytes]
+                if self.chunk_hold is not None:
+                    chunks = read_into_pool(file, BufferPool(self.read_size), self.chunk_hold)
+                else:
+                    # without a hold every chunk has to be a new buffer, because it is unknown when the next stage is done with it
+                    chunks = iter(lambda: file.read(self.read_size), b"")
+                for chunk in chunks:
                     size += len(chunk)
-                    report_manager.add_report(Reporting("transferer", report_uuid, "working", "chunk: " + str(chunk_count)))
+                    progress.add(len(chunk))
                     yield chunk
                 report_manager.add_report(Reporting("transferer", report_uuid, "finished", "size: " + bytes_to_human_readable_size(size)))
         except (FileExistsError, FileNotFoundError) as exception:
@@ -0,0 +1,33 @@
+import botocore.exceptions
+import pytest
+from utils.aws_utils import is_retryable_error, is_throttling_error
+
+def client_error(code: str, status_code: int, message: str = "") -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": status_code}},
+        "UploadMultipartPart"
+    )
+
+@pytest.mark.parametrize("exception, retryable", [
+    (client_error("ThrottlingException", 400), True),
+    (client_error("RequestTimeoutException", 408), True),
+    (client_error("ServiceUnavailableException", 500), True),
+    (client_error("SomethingNew", 502), True),
+    (client_error("InvalidParameterValueException", 400, "Checksum mismatch: expected abc"), True),
+    (client_error("InvalidParameterValueException", 400, "Invalid range"), False),
+    (client_error("ResourceNotFoundException", 404), False),
+    (client_error("AccessDeniedException", 403), False),
+    (botocore.exceptions.EndpointConnectionError(endpoint_url="https://glacier"), True),
+    (botocore.exceptions.ReadTimeoutError(endpoint_url="https://glacier"), True),
+    (ValueError("not from aws"), False),
+])
+def test_is_retryable_error(exception: Exception, retryable: bool) -> None:
+    # Transient errors should be retried, fatal errors not
+    assert is_retryable_error(exception) == retryable
+
+def test_is_throttling_error() -> None:
+    # Only throttling errors should be detected as throttling
+    assert is_throttling_error(client_error("ThrottlingException", 400))
+    assert is_throttling_error(client_error("SlowDown", 503))
+    assert not is_throttling_error(client_error("ResourceNotFoundException", 404))
+    assert not is_throttling_error(ValueError("not from aws"))
@@ -0,0 +1,48 @@
+import bz2
+from random import randbytes
+
+import pytest
+from dependency_injection.service import Service
+from services.cancel_service import CancelService
+from services.compression.compression_service_bzip2 import CompressionServiceBzip2
+from utils.bzip2_utils import STREAM_HEADER_SIZE, Bzip2StreamSplitter, find_stream_end
+from utils.data_utils import StreamSplitter
+from utils.report_utils import ReportManager
+
+def test_find_stream_end() -> None:
+    # The start of the second stream should be found, also if it is an empty stream
+    first = bz2.compress(randbytes(1000))
+    assert find_stream_end(first + bz2.compress(randbytes(1000))) == len(first)
+    assert find_stream_end(first + bz2.compress(b"")) == len(first)
+    assert find_stream_end(first) == -1
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000, 100000])
+def test_bzip2_stream_splitter(chunk_size: int) -> None:
+    # Concatenated streams should be split into the single streams, regardless of the chunk boundaries
+    streams = [bz2.compress(randbytes(size), compresslevel=level) for size, level in [(10, 9), (0, 1), (5000, 5), (1, 9)]]
+    data = b"".join(streams)
+    splitter = Bzip2StreamSplitter(max_stream_size=1024 * 1024)
+    assert list(splitter.split(iter(data[i:i + chunk_size] for i in range(0, len(data), chunk_size)))) == streams
+    assert not splitter.fallback
+
+def test_bzip2_decompress_after_false_stream_end(monkeypatch: pytest.MonkeyPatch) -> None:
+    # A stream end matched inside a stream should make the rest be decompressed sequentially, damaged data should still fail
+    blocks = [randbytes(20000) for _ in range(4)]
+    streams = [bz2.compress(block, compresslevel=1) for block in blocks]
+    false_ends = [len(streams[0]) // 2]
+    def find_stream_end_with_false_match(buffer: bytearray, start: int) -> int:
+        if false_ends and len(buffer) > false_ends[0]:
+            return false_ends.pop()
+        return find_stream_end(buffer, start)
+    service = Service()
+    service.set_service(CancelService(), "cancel_service")
+    report_manager = ReportManager(service, refresh_interval=0.01)
+    compression = CompressionServiceBzip2(compression_level=1, workers=2, block_size_in_mb=1)
+    monkeypatch.setattr(compression, "get_stream_splitter", lambda: StreamSplitter(find_stream_end_with_false_match, STREAM_HEADER_SIZE, 1024 * 1024))
+    data = b"".join(streams)
+    assert b"".join(compression.decompress(iter([data[:30000], data[30000:]]), report_manager)) == b"".join(blocks)
+    damaged = bytearray(data)
+    damaged[len(streams[0]) + len(streams[1]) // 2] ^= 0xff
+    with pytest.raises(OSError):
+        b"".join(compression.decompress(iter([bytes(damaged)]), report_manager))
+    report_manager.stop_reporting()
@@ -0,0 +1,79 @@
+import gzip
+import os
+from random import randbytes
+from typing import Any, Generator
+
+import pytest
+from utils.compressibility_utils import (CompressibilityProbe, MemberDecisions, find_magic_number, get_incompressible_percentage, probe_compressibility,
+                                         probe_files, probe_sample)
+from utils.storage_utils import scan_files
+
+test_directory = os.path.join(os.path.curdir, "tests", "utils", "testdata_compressibility")
+
+@pytest.fixture(autouse=True)
+def run_around_tests() -> Generator[Any, Any, Any]:
+    os.makedirs(test_directory, exist_ok=True)
+    yield
+    for file in os.listdir(test_directory):
+        os.remove(os.path.join(test_directory, file))
+    os.rmdir(test_directory)
+
+def write_file(name: str, data: bytes) -> str:
+    path = os.path.join(test_directory, name)
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+def test_probe_compressibility_text() -> None:
+    # Text should be compressible
+    probe = probe_compressibility(write_file("text.txt", b"the quick brown fox jumps over the lazy dog\n" * 10000))
+    assert probe.compressible
+    assert probe.size == 440000
+
+def test_probe_compressibility_random() -> None:
+    # Random data should be incompressible by its sample ratio
+    probe = probe_compressibility(write_file("random.bin", randbytes(100000)))
+    assert not probe.compressible
+    assert probe.reason.startswith("sample ratio")
+
+def test_probe_compressibility_extension_and_magic_number() -> None:
+    # Compressed formats should be recognized by their extension or their magic number, even if they would compress well
+    assert probe_compressibility(write_file("photo.JPG", b"a" * 1000)).reason == "extension .jpg"
+    probe = probe_compressibility(write_file("archive.bin", gzip.compress(b"a" * 1000)))
+    assert not probe.compressible
+    assert probe.reason == "gzip data"
+    assert find_magic_number(b"\x00\x00\x00\x18ftypmp42") == "mp4"
+    assert find_magic_number(b"plain text") is None
+
+def test_probe_sample() -> None:
+    # A sample of the start of a file should be probed like the file
+    assert probe_sample("text.txt", b"the quick brown fox jumps over the lazy dog\n" * 100, 10000).compressible
+    assert probe_sample("archive.bin", gzip.compress(b"a" * 1000), 10000).reason == "gzip data"
+    assert probe_sample("empty.txt", b"", 0).reason == "empty"
+
+def test_probe_files() -> None:
+    # All readable files should be probed in parallel, files which vanished are left out
+    write_file("text.txt", b"the quick brown fox jumps over the lazy dog\n" * 10000)
+    write_file("random.bin", randbytes(100000))
+    files = list(scan_files([test_directory], ordered=True))
+    write_file("vanished.txt", b"a")
+    os.remove(os.path.join(test_directory, "vanished.txt"))
+    probes = probe_files(files + [(os.path.join(test_directory, "vanished.txt"), files[0][1])], workers=4)
+    assert sorted(os.path.basename(path) for path in probes) == ["random.bin", "text.txt"]
+    assert probes[os.path.join(test_directory, "text.txt")].compressible
+    assert not probes[os.path.join(test_directory, "random.bin")].compressible
+
+def test_get_incompressible_percentage() -> None:
+    # The percentage should be weighted by the size of the files
+    probes = {"a": CompressibilityProbe(True, 100, ""), "b": CompressibilityProbe(False, 300, "")}
+    assert get_incompressible_percentage(probes) == 75.0
+    assert get_incompressible_percentage({}) == 0.0
+
+def test_member_decisions_summary() -> None:
+    # The decisions should be counted per category, in the order they were first made
+    decisions = MemberDecisions()
+    decisions.add("deflated", 1024)
+    decisions.add("stored", 20 * 1024 * 1024)
+    decisions.add("deflated", 512)
+    assert decisions.counts == {"deflated": (2, 1536), "stored": (1, 20 * 1024 * 1024)}
+    assert decisions.get_summary() == "2 files deflated (1.5 KiB), 1 file stored (20.0 MiB)"
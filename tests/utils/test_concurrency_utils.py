@@ -0,0 +1,46 @@
+import random
+import threading
+import time
+
+import pytest
+from utils.concurrency_utils import ordered_parallel_map
+
+def test_ordered_parallel_map_keeps_order() -> None:
+    # Results should be yielded in the order of the items, even if they finish in a different order
+    def work(item: int) -> int:
+        time.sleep(random.uniform(0, 0.01))
+        return item * 2
+    assert list(ordered_parallel_map(work, range(50), workers=4)) == [item * 2 for item in range(50)]
+
+def test_ordered_parallel_map_bounds_window() -> None:
+    # No more than window items should be submitted ahead of the consumer
+    lock = threading.Lock()
+    started = 0
+    def work(item: int) -> int:
+        nonlocal started
+        with lock:
+            started += 1
+        return item
+    consumed = 0
+    for _ in ordered_parallel_map(work, range(20), workers=2, window=3):
+        consumed += 1
+        time.sleep(0.005)
+        with lock:
+            assert started <= consumed + 3
+
+def test_ordered_parallel_map_raises_exception() -> None:
+    # An exception of the function should be raised when its result is due
+    def work(item: int) -> int:
+        if item == 3:
+            raise ValueError("failed")
+        return item
+    results = []
+    with pytest.raises(ValueError):
+        for result in ordered_parallel_map(work, range(10), workers=3):
+            results.append(result)
+    assert results == [0, 1, 2]
+
+def test_ordered_parallel_map_invalid_workers() -> None:
+    # A pool without workers should be rejected
+    with pytest.raises(ValueError):
+        list(ordered_parallel_map(lambda item: item, range(3), workers=0))
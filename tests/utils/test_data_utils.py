@@ -1,11 +1,12 @@
 
-from io import BufferedRandom
-from random import randbytes, randint
-import tempfile
+from random import randbytes
+import io
 from typing import Any, Generator
 
 import pytest
-from utils.data_utils import CreateSplittedFilesFromGenerator, get_file_size
+from utils.data_utils import (BufferPool, ChunkSizeHistogram, UploadPartAssembler, find_missing_ranges, read_into_pool,
+                              readinto_full, rechunk, split_into_blocks)
+from utils.hash_utils import TreeHasher
 import os
 
 input_file = os.path.join(os.path.curdir, "tests", "utils", "testdata_input")
@@ -23,45 +24,146 @@ def run_around_tests() -> Generator[Any, Any, Any]:
     if os.path.exists(output_file):
         os.remove(output_file)
 
-@pytest.mark.parametrize("input_chunk_size, output_chunk_size, test_file_size_mb, input_chunk_size_random_max",
-                        [(512, 1024, 20, 0), (64, 1024, 20, 0), (64, (1024*1024*50), 50, 0), (1024, 512, 50, 0), (2048, 512, 50, 0),
-                        ((1024*1024*10), 2048, 20, 0), ((1024*1024*10), (1024*1024*10), 100, 0), (1024, 1024, 100, 0), ((1024*1024*300),
-                        (1024*1024*10), 100, 0),((1024*1024*10), (1024*1024*255), 100, 0), (512, 1024, 50, 2048), (5, 2048, 100, 20000)])
-def test_create_splitted_files_from_generator(input_chunk_size:int, output_chunk_size:int, test_file_size_mb:int, input_chunk_size_random_max:int) -> None:
-    # Tests that the Input File and the Output File are the same    
-    with open(input_file, 'wb') as f:
-        for _ in range(test_file_size_mb):
-            f.write(randbytes((1024*1024)))
-    
-    with open(input_file, mode='r+b') as f:
-        def data_generator() -> Generator[bytes, None, None]:
-            while True:
-                chunk_size = input_chunk_size
-                if input_chunk_size_random_max != 0:
-                    chunk_size = randint(input_chunk_size, input_chunk_size_random_max)
-                data = f.read(chunk_size)
-                if len(data) == 0:
-                    return
-                yield data
-
-        creater = CreateSplittedFilesFromGenerator()
-        with open(output_file, mode="b+w") as save_file:
-            last_chunk_free = False # Last Chunk can be smaller in size than the output_chunk_size
-            while True:
-                with tempfile.TemporaryFile(mode="b+w") as temp_file:
-                    try:
-                        creater.create_next_upload_size_part(data_generator(), output_chunk_size, temp_file)
-                    except StopIteration:
-                        break
-                    size = get_file_size(temp_file)
-                    if size != output_chunk_size:
-                        if last_chunk_free:
-                            assert False
-                        else:
-                            last_chunk_free = True
-                    assert size <= output_chunk_size
-                    save_file.write(temp_file.read())
-    
-    with open(input_file, 'rb') as original_file:
-        with open(output_file, 'rb') as new_file:
-            assert original_file.read() == new_file.read()
+@pytest.mark.parametrize("input_chunk_size, part_size, test_data_size, max_memory_bytes",
+                        [(512, 1024, 20*1024, None), (1024, 512, 50*1024, None), (5, 2048, 100*1024, None), (4096, 4096, 64*1024, None),
+                        (3000, 1024, 50*1024 + 17, None), (512, 1024, 20*1024, 512), (3000, 1024, 50*1024 + 17, 100)])
+def test_upload_part_assembler(input_chunk_size:int, part_size:int, test_data_size:int, max_memory_bytes:int | None) -> None:
+    # Tests that the parts put together are the same as the input and only the last part is smaller
+    input_data = randbytes(test_data_size)
+    def data_generator() -> Generator[bytes, None, None]:
+        for start in range(0, len(input_data), input_chunk_size):
+            yield b""
+            yield input_data[start:start + input_chunk_size]
+
+    assembler = UploadPartAssembler(part_size, buffer_count=2, max_memory_bytes=max_memory_bytes)
+    assert assembler.spill_to_disk == (max_memory_bytes is not None and max_memory_bytes < part_size)
+    output_data = bytearray()
+    last_part_smaller = False
+    for index, part in enumerate(assembler.parts(data_generator())):
+        assert not last_part_smaller
+        assert part.index == index
+        assert part.offset == len(output_data)
+        assert part.size <= part_size
+        last_part_smaller = part.size < part_size
+        reader = part.get_reader()
+        output_data += reader.read()
+        reader.seek(0)
+        assert len(reader.read()) == part.size
+        part.release()
+    assert bytes(output_data) == input_data
+    assert assembler.total_read_bytes == test_data_size
+
+def test_upload_part_assembler_reuses_buffers() -> None:
+    # The assembler should only allocate as many buffers as configured and hand out read-only views
+    assembler = UploadPartAssembler(1024, buffer_count=1)
+    views = []
+    for part in assembler.parts(iter([randbytes(4096)])):
+        view = part.get_view()
+        assert view.readonly
+        views.append(view.obj)
+        part.release()
+    assert len(views) == 4
+    assert all(obj is views[0] for obj in views)
+
+def test_upload_part_assembler_empty_generator() -> None:
+    # An empty generator should not create any part
+    assembler = UploadPartAssembler(1024)
+    assert not list(assembler.parts(iter([b"", b""])))
+
+def test_upload_part_assembler_tree_hash() -> None:
+    # The tree hashes computed while assembling should match the tree hashes of the parts and of the whole data
+    input_data = randbytes(5*1024*1024 + 123)
+    assembler = UploadPartAssembler(2*1024*1024, compute_tree_hash=True)
+    for part in assembler.parts(iter([input_data[i:i + 300000] for i in range(0, len(input_data), 300000)])):
+        tree_hasher = TreeHasher()
+        tree_hasher.update(part.get_view())
+        assert part.tree_hash == tree_hasher.digest()
+        part.release()
+    tree_hasher = TreeHasher()
+    tree_hasher.update(input_data)
+    assert assembler.archive_tree_hash.hexdigest() == tree_hasher.hexdigest()
+
+def test_upload_part_assembler_tree_hash_invalid_part_size() -> None:
+    # Tree hashes of parts can only be combined if the part size is 1 MiB multiplied by a power of two
+    with pytest.raises(ValueError):
+        UploadPartAssembler(3*1024*1024, compute_tree_hash=True)
+
+@pytest.mark.parametrize("ranges, total_size, expected_result", [
+    ([], 100, [(0, 100)]),
+    ([(0, 50), (50, 50)], 100, []),
+    ([(50, 50), (0, 10)], 100, [(10, 40)]),
+    ([(0, 10), (20, 10), (40, 10)], 60, [(10, 10), (30, 10), (50, 10)]),
+    ([(0, 60), (10, 10)], 60, []),
+])
+def test_find_missing_ranges(ranges: list[tuple[int, int]], total_size: int, expected_result: list[tuple[int, int]]) -> None:
+    # The gaps between the confirmed ranges should be found
+    assert find_missing_ranges(ranges, total_size) == expected_result
+
+@pytest.mark.parametrize("chunk_size, block_size", [(1, 7), (100, 7), (7, 7), (1000, 4096)])
+def test_split_into_blocks(chunk_size: int, block_size: int) -> None:
+    # All blocks except the last one should have the block size and together contain the input
+    input_data = randbytes(3000)
+    blocks = list(split_into_blocks((input_data[i:i + chunk_size] for i in range(0, len(input_data), chunk_size)), block_size))
+    assert b"".join(blocks) == input_data
+    assert all(len(block) == block_size for block in blocks[:-1])
+    assert 0 < len(blocks[-1]) <= block_size
+
+
+@pytest.mark.parametrize("use_pool", [False, True])
+def test_rechunk(use_pool: bool) -> None:
+    # Tiny, empty and large chunks should be coalesced into chunks of the chunk size
+    input_data = randbytes(5000)
+    chunks = [b"", input_data[:3], b"", bytearray(input_data[3:10]), input_data[10:4000], input_data[4000:]]
+    pool = BufferPool(512) if use_pool else None
+    output = [bytes(chunk) for chunk in rechunk(iter(chunks), 512, pool, hold=2)]
+    assert b"".join(output) == input_data
+    assert all(len(chunk) == 512 for chunk in output[:-1])
+    assert 0 < len(output[-1]) <= 512
+    assert not list(rechunk(iter([b"", b""]), 512))
+
+def test_rechunk_reuses_buffers_after_hold() -> None:
+    # A buffer should only be reused after hold more chunks were yielded
+    pool = BufferPool(4)
+    chunks = rechunk((bytearray([index]) for index in range(40)), 4, pool, hold=2)
+    held = [next(chunks), next(chunks), next(chunks)]
+    assert [bytes(chunk) for chunk in held] == [bytes([0, 1, 2, 3]), bytes([4, 5, 6, 7]), bytes([8, 9, 10, 11])]
+    assert len({id(chunk.obj) for chunk in held}) == 3 # type: ignore[attr-defined]
+    fourth = next(chunks)
+    assert fourth.obj is held[0].obj # type: ignore[attr-defined]
+
+def test_readinto_full() -> None:
+    # The buffer should be filled completely unless the file ends
+    buffer = bytearray(300)
+    file = io.BytesIO(bytes(range(256)) * 2)
+    assert readinto_full(file, buffer) == 300
+    assert buffer == (bytes(range(256)) * 2)[:300]
+    assert readinto_full(file, buffer) == 212
+    assert readinto_full(file, buffer) == 0
+
+@pytest.mark.parametrize("hold", [0, 2])
+def test_read_into_pool(hold: int) -> None:
+    # The file should be read in chunks of the buffer size, only the last chunk may be smaller
+    input_data = randbytes(5000)
+    output = [bytes(chunk) for chunk in read_into_pool(io.BytesIO(input_data), BufferPool(512), hold)]
+    assert b"".join(output) == input_data
+    assert all(len(chunk) == 512 for chunk in output[:-1])
+    assert not list(read_into_pool(io.BytesIO(b""), BufferPool(512)))
+
+def test_read_into_pool_reuses_buffers_after_hold() -> None:
+    # A buffer should only be reused after hold more chunks were yielded
+    pool = BufferPool(4)
+    chunks = read_into_pool(io.BytesIO(bytes(range(40))), pool, hold=2)
+    held = [next(chunks), next(chunks), next(chunks)]
+    assert [bytes(chunk) for chunk in held] == [bytes([0, 1, 2, 3]), bytes([4, 5, 6, 7]), bytes([8, 9, 10, 11])]
+    assert len({id(chunk.obj) for chunk in held}) == 3 # type: ignore[attr-defined]
+    fourth = next(chunks)
+    assert fourth.obj is held[0].obj # type: ignore[attr-defined]
+    assert bytes(fourth) == bytes([12, 13, 14, 15])
+
+def test_chunk_size_histogram() -> None:
+    # Chunks should be counted in buckets of powers of two
+    histogram = ChunkSizeHistogram()
+    for size in [0, 1, 1000, 1024, 1 << 20]:
+        histogram.add(size)
+    assert histogram.buckets == {0: 1, 1: 1, 10: 1, 11: 1, 21: 1}
+    assert str(histogram).startswith("5 chunks")
@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import time
+import zipfile
+from random import Random
+from typing import Any, Generator
+
+import pytest
+from dependency_injection.service import Service
+from services.cancel_service import CancelService
+from services.chunk_index_service import ChunkIndexService
+from services.filetype.filetype_service_zip import FiletypeServiceZip
+from utils.dedup_utils import (CHUNKS_MEMBER_NAME, RECIPE_MEMBER_NAME, CdcChunker, DedupRecipe, DeduplicatedArchives, get_chunk_key,
+                               get_referenced_uploads, restore_files)
+from utils.report_utils import ReportManager
+from utils.storage_utils import scan_files
+
+dedup_directory = os.path.join(os.path.curdir, "tests", "utils", "testdata_dedup")
+
+@pytest.fixture(autouse=True)
+def run_around_tests() -> Generator[Any, Any, Any]:
+    os.makedirs(dedup_directory, exist_ok=True)
+    yield
+    shutil.rmtree(dedup_directory)
+
+def split_in_pieces(data: bytes, size: int) -> list[bytes]:
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+def test_cdc_chunker_sizes() -> None:
+    # The chunks should add up to the data and respect the minimum and maximum size
+    chunker = CdcChunker.from_average_size(4096)
+    data = Random(1).randbytes(1024 * 1024)
+    chunks = list(chunker.split(split_in_pieces(data, 10000)))
+    assert b"".join(chunks) == data
+    assert all(chunker.min_size <= len(chunk) <= chunker.max_size for chunk in chunks[:-1])
+    assert 2048 < len(data) / len(chunks) < 8192
+
+def test_cdc_chunker_finds_the_chunks_after_an_insertion() -> None:
+    # Inserting data should only change the chunks around it, independent of how the data is read
+    chunker = CdcChunker.from_average_size(4096)
+    data = Random(2).randbytes(512 * 1024)
+    modified = data[:100000] + b"inserted" + data[100000:]
+    chunks = list(chunker.split([data]))
+    modified_chunks = list(chunker.split(split_in_pieces(modified, 777)))
+    assert len(set(chunks) - set(modified_chunks)) <= 2
+
+def test_cdc_chunker_cuts_uniform_data_at_the_maximum() -> None:
+    # Data without boundaries (like zeros in an image) should be cut at the maximum size
+    chunker = CdcChunker(1024, 4096, 16384)
+    assert [len(chunk) for chunk in chunker.split([bytes(40000)])] == [16384, 16384, 7232]
+
+def test_dedup_recipe_merges_extents() -> None:
+    # Consecutive chunks of the same upload should be merged into one extent
+    recipe = DedupRecipe()
+    recipe.add_file("file.bin", os.stat(dedup_directory))
+    recipe.add_chunk(None, 0, 10)
+    recipe.add_chunk(None, 10, 5)
+    recipe.add_chunk(3, 100, 20)
+    recipe.add_chunk(3, 120, 20)
+    recipe.add_chunk(3, 0, 1)
+    assert recipe.files[0]["extents"] == [[None, 0, 15], [3, 100, 40], [3, 0, 1]]
+    assert (recipe.total_size, recipe.new_size) == (56, 15)
+
+def test_chunk_index_and_restore() -> None:
+    # A second upload should only store the changed chunks and both uploads should restore the files
+    chunker = CdcChunker.from_average_size(4096)
+    index = ChunkIndexService("default", dedup_directory)
+    chunk_data: dict[int, bytearray] = {}
+    def upload(upload_id: int, data: bytes) -> dict[str, Any]:
+        path = os.path.join(dedup_directory, "file.bin")
+        with open(path, "wb") as file:
+            file.write(data)
+        recipe = DedupRecipe()
+        recipe.add_file(path, os.stat(path))
+        stored = chunk_data.setdefault(upload_id, bytearray())
+        for chunk in chunker.split([data]):
+            found = index.lookup(get_chunk_key(chunk))
+            if found is None:
+                index.add(get_chunk_key(chunk), len(stored), len(chunk))
+                recipe.add_chunk(None, len(stored), len(chunk))
+                stored += chunk
+            else:
+                recipe.add_chunk(*found)
+        index.commit(upload_id)
+        parsed: dict[str, Any] = json.loads(recipe.as_json())
+        return parsed
+    original = Random(3).randbytes(256 * 1024)
+    modified = original[:50000] + b"changed" + original[50007:]
+    recipes = [upload(1, original), upload(2, modified)]
+    assert len(chunk_data[2]) < len(original) / 4
+    for upload_id, recipe, expected in [(1, recipes[0], original), (2, recipes[1], modified)]:
+        restored = restore_files(recipe, upload_id, lambda upload, offset, size: bytes(chunk_data[upload][offset:offset + size]),
+                                 os.path.join(dedup_directory, f"restore{upload_id}"))
+        with open(restored[0], "rb") as file:
+            assert file.read() == expected
+    index.close()
+
+def test_chunk_index_discards_pending_chunks() -> None:
+    # The chunks of a failed upload should not be found anymore
+    index = ChunkIndexService("default", dedup_directory)
+    index.add(get_chunk_key(b"chunk"), 0, 5)
+    assert index.lookup(get_chunk_key(b"chunk")) == (None, 0, 5)
+    index.discard()
+    assert index.lookup(get_chunk_key(b"chunk")) is None
+    index.close()
+
+def test_deduplicated_packing_is_deterministic() -> None:
+    # Packing the same files again should give the same bytes, which resuming a deduplicated upload relies on
+    source = os.path.join(dedup_directory, "source")
+    os.makedirs(source)
+    with open(os.path.join(source, "data.bin"), "wb") as file:
+        file.write(Random(4).randbytes(100 * 1024))
+    service = Service()
+    service.set_service(CancelService(), "cancel_service")
+    report_manager = ReportManager(service, refresh_interval=0.01)
+    packed = []
+    for run in range(2):
+        if run > 0:
+            # the times in a zip have a resolution of two seconds
+            time.sleep(2)
+        index = ChunkIndexService("default", dedup_directory)
+        packer = FiletypeServiceZip(compression_level=0, chunk_size=64 * 1024)
+        packer.set_deduplication(index, CdcChunker.from_average_size(4096))
+        packed.append(b"".join(packer.pack(scan_files([source], ordered=True), report_manager)))
+        index.discard()
+        index.close()
+    report_manager.stop_reporting()
+    assert packed[0] == packed[1]
+
+def test_restore_files_from_downloaded_archives() -> None:
+    # The files should be rebuilt from the chunk data in the zip files of the upload and of the earlier upload it refers to
+    first = Random(5).randbytes(64 * 1024)
+    second = Random(6).randbytes(16 * 1024)
+    recipe = {"version": 1, "files": [{"path": "/restored/file.bin", "size": 80 * 1024, "mtime_ns": 0,
+                                       "extents": [[1, 32 * 1024, 32 * 1024], [None, 0, 16 * 1024], [1, 0, 32 * 1024]]}]}
+    for upload_id, chunk_data, member_recipe in [(1, first, None), (2, second, recipe)]:
+        with zipfile.ZipFile(os.path.join(dedup_directory, f"{upload_id}.zip"), "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(CHUNKS_MEMBER_NAME, chunk_data)
+            if member_recipe is not None:
+                archive.writestr(RECIPE_MEMBER_NAME, json.dumps(member_recipe))
+    archives = DeduplicatedArchives()
+    archives.add(2, os.path.join(dedup_directory, "2.zip"))
+    read_recipe = archives.read_recipe(2)
+    assert get_referenced_uploads(read_recipe) == {1}
+    archives.add(1, os.path.join(dedup_directory, "1.zip"))
+    restored = restore_files(read_recipe, 2, archives.read_chunk_data, os.path.join(dedup_directory, "restore"))
+    archives.close()
+    with open(restored[0], "rb") as file:
+        assert file.read() == first[32 * 1024:] + second + first[:32 * 1024]
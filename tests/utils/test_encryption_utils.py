@@ -0,0 +1,41 @@
+import pytest
+from utils.encryption_utils import FRAME_HEADER_SIZE, FRAME_TAG_SIZE, ChunkAuthenticationError, FramedAesHeader, mark_last
+
+KEY = bytes(range(32))
+
+def _header() -> FramedAesHeader:
+    return FramedAesHeader(16, 1000, b"s" * 16, b"n" * 8)
+
+def test_header_pack_and_unpack() -> None:
+    # A packed header should be read back with the same values, foreign data should be rejected
+    packed = _header().pack()
+    assert len(packed) == FRAME_HEADER_SIZE
+    header = FramedAesHeader.unpack(packed)
+    assert (header.chunk_size, header.kdf_iterations, header.salt, header.nonce_prefix) == (16, 1000, b"s" * 16, b"n" * 8)
+    with pytest.raises(ValueError):
+        FramedAesHeader.unpack(b"\x00" * FRAME_HEADER_SIZE)
+
+def test_chunk_roundtrip_and_authentication() -> None:
+    # A chunk should only decrypt with its own index and last flag and without modifications
+    header = _header()
+    encrypted = header.encrypt_chunk(KEY, 3, b"0123456789abcdef", False)
+    assert len(encrypted) == 16 + FRAME_TAG_SIZE
+    assert header.decrypt_chunk(KEY, 3, encrypted, False) == b"0123456789abcdef"
+    with pytest.raises(ChunkAuthenticationError):
+        header.decrypt_chunk(KEY, 4, encrypted, False)
+    with pytest.raises(ChunkAuthenticationError):
+        header.decrypt_chunk(KEY, 3, encrypted, True)
+    with pytest.raises(ChunkAuthenticationError):
+        header.decrypt_chunk(KEY, 3, bytes([encrypted[0] ^ 1]) + encrypted[1:], False)
+
+def test_chunk_range() -> None:
+    # The range should cover exactly the encrypted chunks containing the requested bytes
+    header = _header()
+    assert header.get_chunk_range(0, 1) == (0, FRAME_HEADER_SIZE, 32)
+    assert header.get_chunk_range(15, 2) == (0, FRAME_HEADER_SIZE, 64)
+    assert header.get_chunk_range(40, 8) == (2, FRAME_HEADER_SIZE + 64, 32)
+
+def test_mark_last() -> None:
+    # Only the last chunk should be marked, empty data should still yield one last chunk
+    assert list(mark_last([b"a", b"b"])) == [(b"a", False), (b"b", True)]
+    assert list(mark_last([])) == [(b"", True)]
@@ -0,0 +1,70 @@
+import os
+import shutil
+from typing import Any, Generator
+
+import pytest
+from services.file_index_service import FileIndexService, hash_file
+from utils.storage_utils import scan_files
+
+index_directory = os.path.join(os.path.curdir, "tests", "utils", "testdata_file_index")
+files_directory = os.path.join(index_directory, "files")
+
+@pytest.fixture(autouse=True)
+def run_around_tests() -> Generator[Any, Any, Any]:
+    os.makedirs(os.path.join(files_directory, "sub"), exist_ok=True)
+    for name in ["a.txt", "b.txt", "sub/c.txt"]:
+        write_file(name, name)
+    yield
+    shutil.rmtree(index_directory)
+
+def write_file(name: str, content: str) -> None:
+    with open(os.path.join(files_directory, name), "w", encoding="utf8") as file:
+        file.write(content)
+
+def record_upload(index: FileIndexService, upload_id: int) -> None:
+    files = list(scan_files([files_directory], ordered=True))
+    changes = index.find_changes(files, [files_directory])
+    index.update(changes, {path: hash_file(path) for path, _ in changes.changed}, upload_id)
+
+def test_find_changes_without_index() -> None:
+    # Without a previous upload every file is new
+    index = FileIndexService("default", index_directory)
+    changes = index.find_changes(list(scan_files([files_directory])), [files_directory])
+    assert len(changes.changed) == 3 and changes.deleted == []
+    assert index.get_last_upload_id() is None
+    index.close()
+
+def test_find_changes_after_upload() -> None:
+    # Only the modified, new and deleted files should be found after an upload
+    index = FileIndexService("my profile", index_directory)
+    record_upload(index, 1)
+    assert index.get_last_upload_id() == 1
+    assert index.find_changes(list(scan_files([files_directory])), [files_directory]).is_empty()
+    write_file("a.txt", "changed content")
+    write_file("d.txt", "new")
+    os.remove(os.path.join(files_directory, "sub", "c.txt"))
+    changes = index.find_changes(list(scan_files([files_directory], ordered=True)), [files_directory])
+    assert [os.path.basename(path) for path, _ in changes.changed] == ["a.txt", "d.txt"]
+    assert changes.deleted == [os.path.abspath(os.path.join(files_directory, "sub", "c.txt"))]
+    index.close()
+
+def test_find_changes_compares_the_content_of_touched_files() -> None:
+    # A file with a new modification time but the same content should not be uploaded again
+    index = FileIndexService("default", index_directory)
+    record_upload(index, 1)
+    path = os.path.join(files_directory, "b.txt")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    changes = index.find_changes(list(scan_files([files_directory])), [files_directory])
+    assert changes.is_empty() and [touched for touched, _ in changes.touched] == [path]
+    index.update(changes, {}, 1)
+    assert index.find_changes(list(scan_files([files_directory])), [files_directory]).touched == []
+    index.close()
+
+def test_find_changes_only_deletes_below_the_scanned_paths() -> None:
+    # Files of the index outside of the scanned paths should not count as deleted
+    index = FileIndexService("default", index_directory)
+    record_upload(index, 1)
+    sub_directory = os.path.join(files_directory, "sub")
+    assert index.find_changes(list(scan_files([sub_directory])), [sub_directory]).is_empty()
+    index.close()
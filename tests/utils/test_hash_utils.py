@@ -1,5 +1,8 @@
+import hashlib
+import zlib
+from random import randbytes
 import pytest
-from utils.hash_utils import compute_sha256_tree_hash_for_aws
+from utils.hash_utils import TreeHashCombiner, TreeHasher, combine_tree_hashes, compute_sha256_tree_hash_for_aws, crc32_combine
 
 def test_compute_sha256_tree_hash_empty_string():
     # List of an empty string should raise ValueError
@@ -28,3 +31,48 @@ def test_compute_sha256_tree_hash_multiple_chunks():
     chunk_sha256_hashes = [b"hash1", b"hash2", b"hash3"]
     expected_result = "6fe0c420f3d761ae8b925d064685309bc74841d75c9c7b6400dc4224ce7f019d"
     assert compute_sha256_tree_hash_for_aws(chunk_sha256_hashes) == expected_result
+
+@pytest.mark.parametrize("data_size, update_size", [(0, 1), (1, 1), (1024*1024, 1000), (3*1024*1024 + 5, 1024*1024), (5*1024*1024, 3*1024*1024 + 7)])
+def test_tree_hasher(data_size: int, update_size: int) -> None:
+    # Feeding the data in pieces of any size should result in the same hash as hashing the 1 MiB leaves
+    data = randbytes(data_size)
+    leaf_hashes = [hashlib.sha256(data[i:i + 1024*1024]).digest() for i in range(0, len(data), 1024*1024)]
+    expected_result = compute_sha256_tree_hash_for_aws(leaf_hashes) if leaf_hashes else hashlib.sha256(b"").hexdigest()
+    tree_hasher = TreeHasher()
+    for start in range(0, data_size, update_size):
+        tree_hasher.update(memoryview(data)[start:start + update_size])
+    assert tree_hasher.hexdigest() == expected_result
+
+@pytest.mark.parametrize("chunk_sha256_hashes", [[b"hash1"], [b"hash1", b"hash2", b"hash3"], [bytes([i]) * 32 for i in range(1, 100)]])
+def test_tree_hash_combiner(chunk_sha256_hashes: list[bytes]) -> None:
+    # The combiner should give the same result as the list based function
+    combiner = TreeHashCombiner()
+    for chunk_hash in chunk_sha256_hashes:
+        combiner.add(chunk_hash)
+        assert combiner.hexdigest() == compute_sha256_tree_hash_for_aws(chunk_sha256_hashes[:combiner.count])
+    assert len(combiner.stack) <= combiner.count.bit_length()
+
+def test_tree_hash_combiner_empty() -> None:
+    # A combiner without hashes has no digest
+    with pytest.raises(ValueError):
+        TreeHashCombiner().digest()
+
+@pytest.mark.parametrize("part_size, data_size", [(1024*1024, 5*1024*1024 + 1), (2*1024*1024, 7*1024*1024), (4*1024*1024, 9*1024*1024 + 3), (4*1024*1024, 100)])
+def test_combine_tree_hashes(part_size: int, data_size: int) -> None:
+    # The tree hashes of equally sized parts combined should be the tree hash of the whole data
+    data = randbytes(data_size)
+    part_hashes = []
+    for start in range(0, data_size, part_size):
+        tree_hasher = TreeHasher()
+        tree_hasher.update(data[start:start + part_size])
+        part_hashes.append(tree_hasher.hexdigest())
+    tree_hasher = TreeHasher()
+    tree_hasher.update(data)
+    assert combine_tree_hashes(part_hashes) == tree_hasher.hexdigest()
+
+@pytest.mark.parametrize("first_size, second_size", [(0, 0), (1, 0), (0, 1), (100, 1000), (70000, 131072)])
+def test_crc32_combine(first_size: int, second_size: int) -> None:
+    # The combined CRC32 should be the CRC32 of the concatenated data
+    first = randbytes(first_size)
+    second = randbytes(second_size)
+    assert crc32_combine(zlib.crc32(first), zlib.crc32(second), second_size) == zlib.crc32(first + second)
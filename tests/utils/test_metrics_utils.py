@@ -0,0 +1,59 @@
+import os
+import uuid
+from typing import Any, Generator
+
+import pytest
+from dependency_injection.service import Service
+from services.cancel_service import CancelService
+from utils.metrics_utils import MetricsFileWriter, render_metrics, write_file_atomically
+from utils.report_utils import ReportManager, Reporting, StageProgress
+
+metrics_directory = os.path.join(os.path.curdir, "tests", "utils", "testdata_metrics")
+
+@pytest.fixture(autouse=True)
+def run_around_tests() -> Generator[Any, Any, Any]:
+    os.makedirs(metrics_directory, exist_ok=True)
+    yield
+    for file in os.listdir(metrics_directory):
+        os.remove(os.path.join(metrics_directory, file))
+    os.rmdir(metrics_directory)
+
+def test_render_metrics() -> None:
+    # The counters should be rendered per stage with the labels, the result only once the run finished
+    transferer = StageProgress()
+    transferer.add(2048, 2)
+    transferer.add_retry()
+    stages = {"packer": StageProgress(), "transferer": transferer}
+    text = render_metrics(stages, 2.0, {"profile": 'my "profile"'}, success=None)
+    assert 'ecsu_bytes_uploaded_total{profile="my \\"profile\\""} 2048' in text
+    assert 'ecsu_retries_total{profile="my \\"profile\\""} 1' in text
+    assert 'ecsu_stage_throughput_bytes_per_second{profile="my \\"profile\\"",stage="transferer"} 1024.0' in text
+    assert "ecsu_run_success" not in text
+    assert 'ecsu_run_success{profile="my \\"profile\\""} 1' in render_metrics(stages, 2.0, {"profile": 'my "profile"'}, success=True)
+
+def test_write_file_atomically() -> None:
+    # The file should be replaced without leaving temporary files behind
+    path = os.path.join(metrics_directory, "metrics.prom")
+    write_file_atomically(path, "first\n")
+    write_file_atomically(path, "second\n")
+    with open(path, encoding="utf-8") as file:
+        assert file.read() == "second\n"
+    assert os.listdir(metrics_directory) == ["metrics.prom"]
+
+def test_metrics_file_writer() -> None:
+    # The metrics should be read from the counters of the report manager
+    service = Service()
+    service.set_service(CancelService(), "cancel_service")
+    report_manager = ReportManager(service, refresh_interval=0.01)
+    worker_id = uuid.uuid4()
+    report_manager.add_report(Reporting("packer", worker_id, "working"))
+    report_manager.get_progress("packer", worker_id).add(100)
+    path = os.path.join(metrics_directory, "metrics.prom")
+    writer = MetricsFileWriter(path, report_manager, {"profile": "default"}, interval=0.01)
+    writer.start()
+    report_manager.stop_reporting()
+    writer.stop(success=False)
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    assert 'ecsu_bytes_read_total{profile="default"} 100' in text
+    assert 'ecsu_run_success{profile="default"} 0' in text
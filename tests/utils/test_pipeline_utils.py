@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Generator, Iterable
+
+import pytest
+from services.cancel_service import CancelService
+from utils.pipeline_utils import Pipeline, PipelineCancelledError
+
+def _double(data: Iterable[int]) -> Generator[int, None, None]:
+    for item in data:
+        yield item * 2
+
+def test_pipeline_keeps_order() -> None:
+    # Chained stages should yield the same items as the chained generators
+    with Pipeline(CancelService(), queue_size=2) as pipeline:
+        first = pipeline.run_stage("first", iter(range(100)))
+        second = pipeline.run_stage("second", _double(first))
+        assert list(second) == [item * 2 for item in range(100)]
+
+def test_pipeline_overlaps_stages() -> None:
+    # Two slow stages should take about as long as one of them, not as long as both
+    def slow(data: Iterable[int]) -> Generator[int, None, None]:
+        for item in data:
+            time.sleep(0.05)
+            yield item
+    start = time.monotonic()
+    with Pipeline(CancelService()) as pipeline:
+        assert list(pipeline.run_stage("second", slow(pipeline.run_stage("first", slow(iter(range(10))))))) == list(range(10))
+    assert time.monotonic() - start < 0.9
+
+def test_pipeline_raises_error_of_stage() -> None:
+    # The exception of a stage should be raised where the last stage is read and stop the other stages
+    def failing() -> Generator[int, None, None]:
+        yield 1
+        raise OSError("disk failed")
+    with Pipeline(CancelService()) as pipeline:
+        with pytest.raises(OSError, match="disk failed"):
+            list(pipeline.run_stage("second", _double(pipeline.run_stage("first", failing()))))
+    assert all(not thread.is_alive() for thread in pipeline.threads)
+
+def test_pipeline_is_cancelled_by_cancel_service() -> None:
+    # A cancel event should wake up the blocked stages and stop the pipeline
+    cancel_service = CancelService()
+    def endless() -> Generator[int, None, None]:
+        while True:
+            yield 1
+    with Pipeline(cancel_service, queue_size=1) as pipeline:
+        output = pipeline.run_stage("first", endless())
+        next(output)
+        threading.Timer(0.1, cancel_service.cancel, args=("test",)).start()
+        with pytest.raises(PipelineCancelledError):
+            time.sleep(0.3)
+            list(output)
+    assert all(not thread.is_alive() for thread in pipeline.threads)
+
+def test_pipeline_statistics() -> None:
+    # The slow stage should be the bottleneck, the sizes should follow the stages
+    def slow_halve(data: Iterable[bytes]) -> Generator[bytes, None, None]:
+        for item in data:
+            time.sleep(0.02)
+            yield item[:len(item) // 2]
+    with Pipeline(CancelService(), input_size=1000) as pipeline:
+        first = pipeline.run_stage("packer", iter([bytes(100)] * 10))
+        second = pipeline.run_stage("compressor", slow_halve(first))
+        assert sum(len(item) for item in second) == 500
+    summary = pipeline.get_summary("transferer")
+    assert summary["bottleneck"] == "compressor"
+    assert summary["compression_ratio"] == 0.5
+    assert [(stage["name"], stage["bytes_in"], stage["bytes_out"]) for stage in summary["stages"]] == [
+        ("packer", 1000, 1000), ("compressor", 1000, 500), ("transferer", 500, 500)]
+    transferer = summary["stages"][2]
+    assert transferer["upstream_wait_seconds"] > transferer["busy_seconds"]
+
+def test_pipeline_rechunk_through_passthrough_stage() -> None:
+    # Pooled chunks passed on unchanged by a stage should not be reused while a slow reader two queues later still holds them
+    input_data = bytes(range(251)) * 64
+    def passthrough(data: Iterable[bytes]) -> Generator[bytes, None, None]:
+        yield from data
+    output: list[bytes] = []
+    with Pipeline(CancelService(), queue_size=2) as pipeline:
+        rechunked = pipeline.run_stage("compressor", pipeline.rechunk((input_data[start:start + 100] for start in range(0, len(input_data), 100)),
+                                                                       256, stages=2))
+        for chunk in pipeline.run_stage("crypter", passthrough(rechunked)):
+            time.sleep(0.002)
+            output.append(bytes(chunk))
+    assert b"".join(output) == input_data
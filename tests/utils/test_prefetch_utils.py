@@ -0,0 +1,67 @@
+import os
+import shutil
+import time
+from typing import Any, Generator
+
+import pytest
+from utils.prefetch_utils import FilePrefetcher
+from utils.storage_utils import scan_files
+
+prefetch_directory = os.path.join(os.path.curdir, "tests", "utils", "testdata_prefetch")
+
+@pytest.fixture(autouse=True)
+def run_around_tests() -> Generator[Any, Any, Any]:
+    os.makedirs(prefetch_directory, exist_ok=True)
+    for index in range(20):
+        with open(os.path.join(prefetch_directory, f"{index:02}.bin"), "wb") as file:
+            file.write(bytes([index]) * (index * 100))
+    yield
+    shutil.rmtree(prefetch_directory)
+
+def test_prefetch_keeps_the_order_and_the_data() -> None:
+    # Every file should be handed on in order with its complete data, also if it is larger than its share of the memory
+    prefetcher = FilePrefetcher(chunk_size=64, max_files=4, max_memory=4 * 256)
+    files = list(scan_files([prefetch_directory], ordered=True))
+    # the chunks are reused buffers, so they are copied before the next one is requested
+    read = [(path, b"".join(bytes(chunk) for chunk in data)) for (path, _), data in prefetcher.prefetch(files)]
+    assert [path for path, _ in read] == [path for path, _ in files]
+    assert all(data == bytes([index]) * (index * 100) for index, (_, data) in enumerate(read))
+
+def test_prefetch_chunks_can_be_joined_up_to_the_chunk_size() -> None:
+    # The chunks should stay valid while a reader joins them into chunks of the chunk size, like stream_zip does
+    prefetcher = FilePrefetcher(chunk_size=256, max_files=4, max_memory=4 * 100)
+    files = list(scan_files([prefetch_directory], ordered=True))
+    for index, (_, data) in enumerate(prefetcher.prefetch(files)):
+        joined = b""
+        views: list[bytes] = []
+        for chunk in data:
+            views.append(chunk)
+            if sum(len(view) for view in views) >= 256:
+                joined += b"".join(views)
+                views = []
+        joined += b"".join(views)
+        assert joined == bytes([index]) * (index * 100)
+
+def test_prefetch_reads_ahead_in_the_background() -> None:
+    # The next files should be read before they are requested, so they are complete even if they are removed in between
+    prefetcher = FilePrefetcher(chunk_size=1024, max_files=4)
+    files = list(scan_files([prefetch_directory], ordered=True))
+    generator = prefetcher.prefetch(files)
+    assert b"".join(next(generator)[1]) == b""
+    time.sleep(0.5)
+    for path, _ in files[1:4]:
+        os.remove(path)
+    for index in range(1, 4):
+        assert b"".join(next(generator)[1]) == bytes([index]) * (index * 100)
+    generator.close()
+
+def test_prefetch_raises_errors_of_a_file() -> None:
+    # A file that can not be opened should fail when its data is read
+    prefetcher = FilePrefetcher(chunk_size=1024)
+    files = list(scan_files([prefetch_directory], ordered=True))[:2]
+    os.remove(files[1][0])
+    generator = prefetcher.prefetch(files)
+    assert b"".join(next(generator)[1]) == b""
+    with pytest.raises(FileNotFoundError):
+        b"".join(next(generator)[1])
+    generator.close()
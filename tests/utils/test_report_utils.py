@@ -0,0 +1,34 @@
+import uuid
+
+from dependency_injection.service import Service
+from services.cancel_service import CancelService
+from utils.report_utils import ReportManager, Reporting
+
+def _service() -> Service:
+    service = Service()
+    service.set_service(CancelService(), "cancel_service")
+    return service
+
+def test_report_manager_keeps_state_and_progress() -> None:
+    # Reports and progress counters should update the state of the worker in place
+    report_manager = ReportManager(_service(), refresh_interval=0.01)
+    worker_id = uuid.uuid4()
+    report_manager.add_report(Reporting("crypter", worker_id, "waiting"))
+    progress = report_manager.get_progress("crypter", worker_id)
+    progress.add(1024)
+    progress.add(1024)
+    worker = report_manager.workers[str(worker_id)]
+    assert (worker.get_status(), worker.get_message()) == ("working", "2 chunks, 2.0 KiB")
+    report_manager.add_report(Reporting("crypter", worker_id, "finished", "done"))
+    assert (worker.get_status(), worker.get_message()) == ("finished", "done (2 chunks, 2.0 KiB)")
+    assert len(report_manager.workers) == 1
+    report_manager.stop_reporting()
+
+def test_report_manager_stops_once() -> None:
+    # Stopping should end the renderer, stopping again should do nothing
+    report_manager = ReportManager(_service(), refresh_interval=0.01)
+    report_manager.add_report(Reporting("packer", uuid.uuid4(), "working", log_message="packing"))
+    report_manager.stop_reporting()
+    assert not report_manager.renderer_thread.is_alive()
+    assert not report_manager.log_messages
+    report_manager.stop_reporting()
@@ -0,0 +1,52 @@
+import pytest
+from utils.retry_utils import RetryPolicy
+
+class FlakyFunction:
+    def __init__(self, failures: int, exception: Exception) -> None:
+        self.failures = failures
+        self.exception = exception
+        self.calls = 0
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exception
+        return "done"
+
+def test_retry_policy_retries_until_success() -> None:
+    # A function that fails twice should succeed on the third attempt
+    delays: list[float] = []
+    retries: list[int] = []
+    policy = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=3.0, sleep=delays.append)
+    function = FlakyFunction(2, ConnectionError("flaky"))
+    assert policy.call(function, on_retry=lambda attempt, exception, delay: retries.append(attempt)) == "done"
+    assert function.calls == 3
+    assert retries == [1, 2]
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1.0
+    assert 0 <= delays[1] <= 2.0
+
+def test_retry_policy_gives_up_after_max_attempts() -> None:
+    # After the last attempt the exception should be raised
+    policy = RetryPolicy(max_attempts=3, sleep=lambda delay: None)
+    function = FlakyFunction(10, ConnectionError("down"))
+    with pytest.raises(ConnectionError):
+        policy.call(function)
+    assert function.calls == 3
+
+def test_retry_policy_does_not_retry_fatal_errors() -> None:
+    # Exceptions that are not retryable should be raised right away
+    policy = RetryPolicy(max_attempts=5, is_retryable=lambda exception: isinstance(exception, ConnectionError), sleep=lambda delay: None)
+    function = FlakyFunction(1, PermissionError("denied"))
+    with pytest.raises(PermissionError):
+        policy.call(function)
+    assert function.calls == 1
+
+def test_retry_policy_delay_is_capped() -> None:
+    # The backoff should never exceed the maximum delay
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert all(0 <= policy.get_delay(attempt) <= 5.0 for attempt in range(1, 20))
+
+def test_retry_policy_invalid_attempts() -> None:
+    # At least one attempt is needed
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
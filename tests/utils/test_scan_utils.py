@@ -0,0 +1,63 @@
+import os
+import shutil
+from typing import Any, Generator
+
+import pytest
+from utils.storage_utils import FilesFingerprint, get_files_fingerprint, scan_files
+
+scan_directory = os.path.join(os.path.curdir, "tests", "utils", "testdata_scan")
+
+@pytest.fixture(autouse=True)
+def run_around_tests() -> Generator[Any, Any, Any]:
+    for directory in ["b/d", "a/c", "e"]:
+        os.makedirs(os.path.join(scan_directory, directory), exist_ok=True)
+    for file in ["z.txt", "a/2.txt", "a/1.txt", "a/c/3.txt", "b/d/4.txt", "b/5.txt"]:
+        with open(os.path.join(scan_directory, file), "w", encoding="utf8") as f:
+            f.write(file)
+    yield
+    shutil.rmtree(scan_directory)
+
+def relative(files: list[tuple[str, os.stat_result]]) -> list[str]:
+    return [os.path.relpath(path, scan_directory) for path, _ in files]
+
+def test_scan_files_ordered() -> None:
+    # The files of a directory should come sorted before its subdirectories, the given paths in their order
+    single_file = os.path.join(scan_directory, "b", "5.txt")
+    files = list(scan_files([single_file, scan_directory], workers=3, ordered=True))
+    assert relative(files) == ["b/5.txt", "z.txt", "a/1.txt", "a/2.txt", "a/c/3.txt", "b/5.txt", "b/d/4.txt"]
+
+def test_scan_files_unordered() -> None:
+    # Without the order the same files should be found, each with its stat
+    files = list(scan_files([scan_directory, os.path.join(scan_directory, "missing")], workers=2))
+    assert sorted(relative(files)) == ["a/1.txt", "a/2.txt", "a/c/3.txt", "b/5.txt", "b/d/4.txt", "z.txt"]
+    for path, stat in files:
+        assert stat.st_size == len(os.path.relpath(path, scan_directory))
+
+def test_scan_files_does_not_follow_directory_links() -> None:
+    # A link to a directory should not be scanned, so the files are not packed twice and a loop ends
+    os.symlink(os.path.abspath(scan_directory), os.path.join(scan_directory, "e", "loop"))
+    assert len(list(scan_files([scan_directory]))) == 6
+
+def test_scan_files_stops_early() -> None:
+    # The consumer should be able to stop before the scan finished
+    scanner = scan_files([scan_directory], workers=2, ordered=True)
+    assert relative([next(scanner)]) == ["z.txt"]
+    scanner.close()
+
+def test_get_files_fingerprint_uses_the_scanned_stat() -> None:
+    # The fingerprint should change with the size of a file
+    files = list(scan_files([scan_directory], ordered=True))
+    fingerprint = get_files_fingerprint(files, ".zip")
+    assert fingerprint == get_files_fingerprint(list(scan_files([scan_directory], ordered=True)), ".zip")
+    with open(os.path.join(scan_directory, "z.txt"), "a", encoding="utf8") as f:
+        f.write("more")
+    assert fingerprint != get_files_fingerprint(list(scan_files([scan_directory], ordered=True)), ".zip")
+
+def test_files_fingerprint_while_scanning() -> None:
+    # The fingerprint of the files passing by should be the one of all files, once the scan is done
+    fingerprints: list[str] = []
+    fingerprint = FilesFingerprint(".zip")
+    files = list(fingerprint.track(scan_files([scan_directory], ordered=True), fingerprints.append))
+    assert fingerprints == [get_files_fingerprint(files, ".zip")]
+    assert fingerprint.file_count == len(files)
+    assert fingerprint.total_size == sum(stat.st_size for _, stat in files)
@@ -0,0 +1,135 @@
+import threading
+import time
+from random import randbytes
+
+import pytest
+from utils.data_utils import UploadPart, UploadPartAssembler
+from utils.upload_utils import AdaptiveConcurrencyController, PartUploader
+
+def test_part_uploader_uploads_all_parts() -> None:
+    # Every part should be uploaded exactly once and the in flight window should never be exceeded
+    input_data = randbytes(64*1024)
+    uploaded: dict[int, bytes] = {}
+    lock = threading.Lock()
+    in_flight = 0
+    max_seen_in_flight = 0
+    def upload(part: UploadPart) -> None:
+        nonlocal in_flight, max_seen_in_flight
+        with lock:
+            in_flight += 1
+            max_seen_in_flight = max(max_seen_in_flight, in_flight)
+        time.sleep(0.01)
+        with lock:
+            uploaded[part.offset] = part.get_reader().read()
+            in_flight -= 1
+
+    assembler = UploadPartAssembler(1024, buffer_count=4)
+    uploader = PartUploader(upload, workers=3)
+    for part in assembler.parts(iter([input_data])):
+        uploader.submit(part)
+    assert uploader.wait() == {}
+    uploader.shutdown()
+    assert len(uploaded) == 64
+    assert b"".join(uploaded[offset] for offset in sorted(uploaded)) == input_data
+    assert max_seen_in_flight <= 3
+
+def test_part_uploader_reports_failed_parts() -> None:
+    # Exceptions of the upload function should be reported per part
+    def upload(part: UploadPart) -> None:
+        if part.index == 2:
+            raise ValueError("upload failed")
+
+    assembler = UploadPartAssembler(1024, buffer_count=3)
+    uploader = PartUploader(upload, workers=2)
+    for part in assembler.parts(iter([randbytes(8*1024)])):
+        uploader.submit(part)
+    failed_parts = uploader.wait()
+    uploader.shutdown()
+    assert list(failed_parts) == [2]
+    assert isinstance(failed_parts[2], ValueError)
+    assert uploader.has_failed()
+
+def test_part_uploader_invalid_workers() -> None:
+    # At least one worker is needed
+    with pytest.raises(ValueError):
+        PartUploader(lambda part: None, workers=0)
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+    def __call__(self) -> float:
+        return self.now
+
+def run_round(controller: AdaptiveConcurrencyController, clock: FakeClock, throughput_per_worker: float, saturation: int) -> None:
+    # Completes one round of parts, the aggregate throughput stops growing at the saturation
+    parts = controller.get_limit()
+    clock.now += parts / (throughput_per_worker * min(parts, saturation))
+    for _ in range(parts):
+        controller.record(1, 1.0)
+
+def test_adaptive_concurrency_controller_finds_saturation() -> None:
+    # The limit should grow while the throughput rises and settle around the saturation point
+    clock = FakeClock()
+    decisions: list[str] = []
+    controller = AdaptiveConcurrencyController(initial=1, minimum=1, maximum=16, on_decision=decisions.append, clock=clock)
+    for _ in range(30):
+        run_round(controller, clock, 1.0, 6)
+        assert 1 <= controller.get_limit() <= 16
+    assert 5 <= controller.get_limit() <= 7
+    assert decisions
+
+def test_adaptive_concurrency_controller_respects_bounds() -> None:
+    # The limit should never leave the configured bounds
+    clock = FakeClock()
+    controller = AdaptiveConcurrencyController(initial=10, minimum=2, maximum=4, clock=clock)
+    assert controller.get_limit() == 4
+    for _ in range(10):
+        run_round(controller, clock, 1.0, 100)
+    assert controller.get_limit() == 4
+    for _ in range(10):
+        controller.record(1, 1.0, throttled=True)
+    assert controller.get_limit() == 2
+
+def test_adaptive_concurrency_controller_halves_on_throttling() -> None:
+    # A round with throttled uploads should halve the limit once, however many of its uploads were throttled
+    controller = AdaptiveConcurrencyController(initial=8, minimum=1, maximum=8, clock=FakeClock())
+    for _ in range(7):
+        controller.record(1, 1.0, throttled=True)
+        assert controller.get_limit() == 8
+    controller.record(1, 1.0)
+    assert controller.get_limit() == 4
+
+def test_part_uploader_records_throttling_once_per_part() -> None:
+    # Parts throttled on several retries should be recorded once each, so the round halves the limit once
+    controller = AdaptiveConcurrencyController(initial=4, minimum=1, maximum=4, clock=FakeClock())
+    def upload(part: UploadPart) -> None:
+        for _ in range(3):
+            uploader.report_throttling(part)
+
+    assembler = UploadPartAssembler(1024, buffer_count=5)
+    uploader = PartUploader(upload, workers=4, concurrency_controller=controller)
+    for part in assembler.parts(iter([randbytes(4*1024)])):
+        uploader.submit(part)
+    assert uploader.wait() == {}
+    uploader.shutdown()
+    assert controller.get_limit() == 2
+
+def test_part_uploader_shutdown_from_another_thread() -> None:
+    # Parts submitted after a cancel from another thread should be recorded as cancelled instead of raising
+    started = threading.Event()
+    def upload(part: UploadPart) -> None:
+        started.set()
+        time.sleep(0.05)
+
+    assembler = UploadPartAssembler(1024, buffer_count=3)
+    uploader = PartUploader(upload, workers=1)
+    canceller = threading.Thread(target=lambda: started.wait() and uploader.shutdown(cancel_pending=True))
+    canceller.start()
+    for part in assembler.parts(iter([randbytes(8*1024)])):
+        uploader.submit(part)
+    failed_parts = uploader.wait()
+    canceller.join()
+    assert uploader.has_failed()
+    assert 0 not in failed_parts
+    assert sorted(failed_parts) == list(range(1, 8))
+    assert all(str(exception) == "Upload was cancelled" for exception in failed_parts.values())
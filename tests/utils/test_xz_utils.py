@@ -0,0 +1,52 @@
+import lzma
+from random import randbytes
+
+import pytest
+from services.compression.compression_service_lzma import CompressionServiceLzma
+from utils.xz_utils import STREAM_HEADER_SIZE, XzStreamSplitter, find_stream_end, is_stream_footer, is_stream_header
+
+def test_stream_header_and_footer() -> None:
+    # Header and footer of a stream written by lzma should be recognized, corrupted ones not
+    stream = lzma.compress(b"test", format=lzma.FORMAT_XZ)
+    assert is_stream_header(stream[:12])
+    assert is_stream_footer(stream[-12:])
+    assert not is_stream_header(stream[:11] + bytes([stream[11] ^ 1]))
+    assert not is_stream_footer(bytes([stream[-12] ^ 1]) + stream[-11:])
+
+def test_find_stream_end() -> None:
+    # The end of the first stream should be found, also with stream padding in between
+    first = lzma.compress(randbytes(1000))
+    second = lzma.compress(randbytes(1000))
+    assert find_stream_end(first + second) == len(first)
+    assert find_stream_end(first + b"\0" * 8 + second) == len(first) + 8
+    assert find_stream_end(first) == -1
+    assert find_stream_end(first + second[:STREAM_HEADER_SIZE - 1]) == -1
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 100, 100000])
+def test_xz_stream_splitter(chunk_size: int) -> None:
+    # Concatenated streams should be split into the single streams, regardless of the chunk boundaries
+    streams = [lzma.compress(randbytes(size)) for size in [0, 10, 5000, 1]]
+    data = b"".join(streams)
+    splitter = XzStreamSplitter(max_stream_size=1024 * 1024)
+    assert list(splitter.split(iter(data[i:i + chunk_size] for i in range(0, len(data), chunk_size)))) == streams
+    assert not splitter.fallback
+
+def test_xz_stream_splitter_fallback() -> None:
+    # A stream larger than max_stream_size should stop the splitter and leave the data unconsumed
+    small = lzma.compress(b"small")
+    large = lzma.compress(randbytes(10000))
+    chunks = iter([small, large[:5000], large[5000:], small])
+    splitter = XzStreamSplitter(max_stream_size=4000)
+    assert list(splitter.split(chunks)) == [small]
+    assert splitter.fallback
+    assert bytes(splitter.pending) == large[:5000]
+    assert list(chunks) == [large[5000:], small]
+
+def test_decompress_sequential_memoryviews() -> None:
+    # Stream padding at the start of a memoryview chunk, as the pipeline passes them on, should be skipped
+    first = randbytes(1000)
+    second = randbytes(1000)
+    first_stream = lzma.compress(first)
+    data = memoryview(first_stream + b"\0" * 4 + lzma.compress(second))
+    chunks = [data[:len(first_stream)], data[len(first_stream):]]
+    assert b"".join(CompressionServiceLzma().decompress_sequential(chunks)) == first + second
@@ -1,4 +1,5 @@
 import os
+import botocore.exceptions
 
 def store_aws_credentials(access_key: str, secret_key: str, profile_name:str = 'default') -> None:
     home = os.path.expanduser("~")
@@ -26,3 +27,54 @@ def check_aws_credentials(profile_name: str ='default') -> bool:
     with open(credentials_file, 'r', encoding='utf-8') as file:
         credentials_data = file.read()
         return bool(profile_name in credentials_data)
+
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "SlowDown",
+    "LimitExceededException",
+}
+
+def is_throttling_error(exception: BaseException) -> bool:
+    if not isinstance(exception, botocore.exceptions.ClientError):
+        return False
+    error_code = exception.response.get("Error", {}).get("Code", "")
+    status_code = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    return error_code in THROTTLING_ERROR_CODES or status_code in (429, 503)
+
+RETRYABLE_ERROR_CODES = {
+    "RequestTimeout",
+    "RequestTimeoutException",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    "InternalError",
+    "InternalFailure",
+    "InternalServerError",
+    "PriorRequestNotComplete",
+}
+
+def is_retryable_error(exception: BaseException) -> bool:
+    """
+    Decides if a failed AWS request is worth sending again.
+    Network errors, timeouts, throttling and server errors are retryable. Client errors like a missing upload
+    or missing permissions are fatal, except a checksum mismatch, which means the data was corrupted in transit.
+    """
+    if isinstance(exception, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError,
+                              botocore.exceptions.IncompleteReadError, botocore.exceptions.ResponseStreamingError)):
+        return True
+    if not isinstance(exception, botocore.exceptions.ClientError):
+        return False
+    if is_throttling_error(exception):
+        return True
+    error = exception.response.get("Error", {})
+    error_code = error.get("Code", "")
+    if error_code in RETRYABLE_ERROR_CODES:
+        return True
+    if error_code == "InvalidParameterValueException" and "checksum" in error.get("Message", "").lower():
+        return True
+    status_code = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    return isinstance(status_code, int) and status_code >= 500
@@ -0,0 +1,23 @@
+import re
+
+from utils.data_utils import StreamSplitter
+
+# "BZh", the block size and the magic of the first block (pi) or of the end of an empty stream (sqrt(pi))
+STREAM_START = re.compile(rb"BZh[1-9](?:\x31\x41\x59\x26\x53\x59|\x17\x72\x45\x38\x50\x90)")
+STREAM_HEADER_SIZE = 10
+
+def find_stream_end(buffer: bytes | bytearray, start: int = STREAM_HEADER_SIZE) -> int:
+    """
+    Returns the end of the first bzip2 stream in the buffer, which is the position of the header of the next stream,
+    or -1 if the buffer does not contain the start of a next stream.
+    The end of a bzip2 stream is not byte aligned, so only the header of the next stream is recognized.
+    """
+    match = STREAM_START.search(buffer, start)
+    return match.start() if match is not None else -1
+
+class Bzip2StreamSplitter(StreamSplitter):
+    """
+    Splits concatenated bzip2 streams (like the blocks of a parallel compression) into single streams while the data arrives.
+    """
+    def __init__(self, max_stream_size: int) -> None:
+        super().__init__(find_stream_end, STREAM_HEADER_SIZE, max_stream_size)
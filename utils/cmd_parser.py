@@ -1,5 +1,6 @@
 
 import argparse
+import os
 import sys
 
 def argument_parser() -> argparse.Namespace:
@@ -12,6 +13,9 @@ def argument_parser() -> argparse.Namespace:
     parser_download = subparsers.add_parser('download', help='Download help')
     parser_download = download_argument_parser(parser_download)
 
+    parser_stats = subparsers.add_parser('stats', help='Shows the throughput of the stages of past uploads')
+    parser_stats = stats_argument_parser(parser_stats)
+
     subparsers.add_parser('setup', help='Initial Setup')
     subparsers.add_parser('guided', help='Uses Guided Execution')
 
@@ -23,7 +27,7 @@ def upload_argument_parser(parser_upload: argparse.ArgumentParser) -> argparse.A
     parser_upload.add_argument(
         '-c',
         '--compression-method',
-        choices=["none", "lzma"],
+        choices=["none", "lzma", "bzip2", "gzip"],
         default="none",
         help='The compression-method to use.',
     )
@@ -35,6 +39,25 @@ def upload_argument_parser(parser_upload: argparse.ArgumentParser) -> argparse.A
         default=7,
         help='The compression level to use. 1 is lowest, 9 is highest',
     )
+    parser_upload.add_argument(
+        '--compression-workers',
+        default=None,
+        type=int,
+        help='The number of workers compressing in parallel. With more than 1, lzma and bzip2 compress the data in independent blocks, '
+             'so they default to 1. gzip joins its blocks into a single stream and defaults to the number of CPUs',
+    )
+    parser_upload.add_argument(
+        '--compression-block-size',
+        default=32,
+        type=int,
+        help='The size in MB of the blocks that lzma and bzip2 compress in parallel. For bzip2 it is rounded up to a multiple of 900 kB',
+    )
+    parser_upload.add_argument(
+        '--gzip-block-size',
+        default=128,
+        type=int,
+        help='The size in KB of the blocks that gzip compresses in parallel. Must be at least 32',
+    )
     # Encryption
     parser_upload.add_argument(
         '-e',
@@ -76,6 +99,103 @@ def upload_argument_parser(parser_upload: argparse.ArgumentParser) -> argparse.A
         type=int,
         help='The chunk-size to use for the transfer-method',
     )
+    parser_upload.add_argument(
+        '--upload-memory-limit',
+        default=0,
+        type=int,
+        help='Maximum memory in MB used to buffer the parts of the upload. If a part does not fit, it is buffered on disk. 0 means unlimited',
+    )
+    parser_upload.add_argument(
+        '--upload-workers',
+        default=4,
+        type=int,
+        help='The number of parts that are uploaded in parallel at the start. It is adjusted to the measured throughput',
+    )
+    parser_upload.add_argument(
+        '--min-upload-workers',
+        default=1,
+        type=int,
+        help='The minimum number of parts that are uploaded in parallel',
+    )
+    parser_upload.add_argument(
+        '--max-upload-workers',
+        default=8,
+        type=int,
+        help='The maximum number of parts that are uploaded in parallel',
+    )
+    parser_upload.add_argument(
+        '--upload-attempts',
+        default=5,
+        type=int,
+        help='How often the upload of a part is tried before the upload fails',
+    )
+    parser_upload.add_argument(
+        '--encryption-workers',
+        default=4,
+        type=int,
+        help='The number of threads encrypting chunks in parallel',
+    )
+    parser_upload.add_argument(
+        '--pipeline-queue-size',
+        default=4,
+        type=int,
+        help='The number of chunks buffered between packing, compression, encryption and upload, which run in parallel',
+    )
+    parser_upload.add_argument(
+        '--pipeline-chunk-size',
+        default=1024,
+        type=int,
+        help='The size in KB the chunks of the compression are coalesced to before they are passed on',
+    )
+    parser_upload.add_argument(
+        '--skip-compression-threshold',
+        default=90.0,
+        type=float,
+        help='Skip the compression if at least this percentage of the data is compressed already (like images, videos or archives). Above 100 it is never skipped',
+    )
+    parser_upload.add_argument(
+        '--prefetch-files',
+        default=8,
+        type=int,
+        help='Number of files which are opened and read ahead while packing. More files help with many small files on slow or network storage',
+    )
+    parser_upload.add_argument(
+        '--prefetch-memory',
+        default=64,
+        type=int,
+        help='Memory in MB for the files which are read ahead while packing',
+    )
+    parser_upload.add_argument(
+        '--scan-workers',
+        default=8,
+        type=int,
+        help='Number of threads reading the directories to upload. More threads help on network storage with many directories',
+    )
+    parser_upload.add_argument(
+        '--metrics-file',
+        help='Writes metrics of the upload in the Prometheus text format to this file, e.g. for the textfile collector of the node exporter. Updated while the upload runs',
+    )
+    parser_upload.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only uploads the files which are new or changed since the last incremental upload of the profile, and records the deleted ones',
+    )
+    parser_upload.add_argument(
+        '--deduplicate',
+        action='store_true',
+        help='Splits the files into content-defined chunks and only uploads the chunks that were not uploaded with the profile before, together with a recipe to rebuild the files. The download rebuilds them, also downloading the earlier uploads storing their chunks. Requires the zip file type',
+    )
+    parser_upload.add_argument(
+        '--dedup-chunk-size',
+        default=256,
+        type=int,
+        help='Average size of the chunks of the deduplication in KB',
+    )
+    parser_upload.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continues the interrupted upload of the same files with the same options instead of starting a new one',
+    )
     # Dryrun
     parser_upload.add_argument(
         '--dryrun',
@@ -112,4 +232,49 @@ def download_argument_parser(parser_download: argparse.ArgumentParser) -> argpar
         '--password-file', 
         help='The path to the password-file for decryption. Only needed if the file is encrypted',
     )
+    parser_download.add_argument(
+        '--download-workers',
+        default=4,
+        type=int,
+        help='The number of ranges that are downloaded in parallel',
+    )
+    parser_download.add_argument(
+        '--download-range-size',
+        default=32,
+        type=int,
+        help='The size in MB of the ranges that are downloaded. Must be a power of 2',
+    )
+    parser_download.add_argument(
+        '--decompression-workers',
+        default=os.cpu_count() or 1,
+        type=int,
+        help='The number of processes decompressing in parallel. Only archives compressed in independent blocks are decompressed in parallel',
+    )
+    parser_download.add_argument(
+        '--decryption-workers',
+        default=os.cpu_count() or 1,
+        type=int,
+        help='The number of threads decrypting chunks in parallel',
+    )
+    parser_download.add_argument(
+        '--pipeline-queue-size',
+        default=4,
+        type=int,
+        help='The number of chunks buffered between download, decryption, decompression and unpacking, which run in parallel',
+    )
+    parser_download.add_argument(
+        '--pipeline-chunk-size',
+        default=1024,
+        type=int,
+        help='The size in KB the chunks of the compression are coalesced to before they are passed on',
+    )
     return parser_download
+
+def stats_argument_parser(parser_stats: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser_stats.add_argument(
+        '--limit',
+        default=20,
+        type=int,
+        help='The number of most recent uploads to show',
+    )
+    return parser_stats
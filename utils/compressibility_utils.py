@@ -0,0 +1,136 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from utils.data_utils import bytes_to_human_readable_size
+from utils.storage_utils import ScannedFile
+
+# formats that are compressed already, so compressing them again only costs time
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".lz4",
+    ".docx", ".xlsx", ".pptx", ".odt", ".jar", ".apk", ".aes"
+}
+
+MAGIC_NUMBERS: list[tuple[int, bytes, str]] = [
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"GIF8", "gif"),
+    (0, b"PK\x03\x04", "zip"),
+    (0, b"\x1f\x8b", "gzip"),
+    (0, b"BZh", "bzip2"),
+    (0, b"\xfd7zXZ\x00", "xz"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z"),
+    (0, b"\x28\xb5\x2f\xfd", "zstd"),
+    (0, b"Rar!\x1a\x07", "rar"),
+    (0, b"\x1a\x45\xdf\xa3", "matroska"),
+    (0, b"OggS", "ogg"),
+    (0, b"fLaC", "flac"),
+    (0, b"ID3", "mp3"),
+    (4, b"ftyp", "mp4"),
+    (8, b"WEBP", "webp"),
+]
+
+# bytes at the start of a file that are compressed to probe it
+PROBE_SAMPLE_SIZE = 256 * 1024
+# files probed before the upload to decide if the compression is skipped, the packer probes the others itself
+PROBE_SAMPLE_FILES = 256
+
+class CompressibilityProbe:
+    """
+    The result of probing a file: if compressing it is worth it and why.
+    """
+    compressible: bool
+    size: int
+    reason: str
+    def __init__(self, compressible: bool, size: int, reason: str) -> None:
+        self.compressible = compressible
+        self.size = size
+        self.reason = reason
+
+class MemberDecisions:
+    """
+    Counts the files and bytes of each decision about compressing a member, to report them once after packing.
+    """
+    counts: dict[str, tuple[int, int]]
+    def __init__(self) -> None:
+        self.counts = {}
+
+    def add(self, decision: str, size: int) -> None:
+        count, total_size = self.counts.get(decision, (0, 0))
+        self.counts[decision] = (count + 1, total_size + size)
+
+    def get_summary(self) -> str:
+        """
+        :return: The number of files and bytes of each decision, e.g. "3 files deflated (1.5 KiB), 1 file stored (20.0 MiB)"
+        """
+        return ", ".join(f"{count} file{'' if count == 1 else 's'} {decision} ({bytes_to_human_readable_size(total_size)})"
+                         for decision, (count, total_size) in self.counts.items())
+
+def find_magic_number(header: bytes) -> str | None:
+    """
+    Returns the name of the compressed format the header belongs to, or None.
+    """
+    for offset, magic_number, name in MAGIC_NUMBERS:
+        if header[offset:offset + len(magic_number)] == magic_number:
+            return name
+    return None
+
+def probe_sample(path: str, sample: bytes, size: int, threshold: float = 0.9) -> CompressibilityProbe:
+    """
+    Decides if a file is worth compressing by its extension, its magic number
+    and the ratio a fast compressor achieves on a sample of the start of the file.
+
+    :param sample: The start of the file, e.g. the first chunk read by the packer
+    :param size: Size of the file
+    :param threshold: Compressed size relative to the sample above which a file is incompressible
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return CompressibilityProbe(False, size, f"extension {extension}")
+    if len(sample) == 0:
+        return CompressibilityProbe(True, size, "empty")
+    magic_number = find_magic_number(sample)
+    if magic_number is not None:
+        return CompressibilityProbe(False, size, f"{magic_number} data")
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    return CompressibilityProbe(ratio < threshold, size, f"sample ratio {ratio:.2f}")
+
+def probe_compressibility(path: str, sample_size: int = PROBE_SAMPLE_SIZE, threshold: float = 0.9, size: int | None = None) -> CompressibilityProbe:
+    """
+    Probes a file like probe_sample, reading the sample from the file. Files with an incompressible extension are not read.
+
+    :param sample_size: Number of bytes at the start of the file that are compressed
+    :param size: Size of the file if it is known already, e.g. from the scan
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    sample = b""
+    if os.path.splitext(path)[1].lower() not in INCOMPRESSIBLE_EXTENSIONS:
+        with open(path, "rb") as file:
+            sample = file.read(sample_size)
+    return probe_sample(path, sample, size, threshold)
+
+def probe_files(files: Iterable[ScannedFile], workers: int = 1) -> dict[str, CompressibilityProbe]:
+    """
+    Probes all files which can be read, by path, in a pool of threads.
+    """
+    def probe(file: ScannedFile) -> tuple[str, CompressibilityProbe | None]:
+        try:
+            return file[0], probe_compressibility(file[0], size=file[1].st_size)
+        except OSError:
+            return file[0], None
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prober") as executor:
+        return {path: result for path, result in executor.map(probe, files) if result is not None}
+
+def get_incompressible_percentage(probes: dict[str, CompressibilityProbe]) -> float:
+    """
+    Returns the percentage of the bytes of all probed files which are incompressible.
+    """
+    total_size = sum(probe.size for probe in probes.values())
+    if total_size == 0:
+        return 0.0
+    return sum(probe.size for probe in probes.values() if not probe.compressible) / total_size * 100
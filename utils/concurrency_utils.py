@@ -0,0 +1,42 @@
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Generator, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+def ordered_parallel_map(function: Callable[[T], R], items: Iterable[T], workers: int, window: int | None = None, # pylint: disable=too-many-arguments
+                         thread_name_prefix: str = "", executor: Executor | None = None) -> Generator[R, None, None]:
+    """
+    Applies the function to the items in a pool of threads and yields the results in the order of the items.
+    At most window items are processed or wait to be yielded at the same time,
+    so the results that arrive ahead of a slow item are buffered in a bounded reorder window.
+    If the generator is closed early, the pending items are cancelled.
+
+    :param function: Function applied to every item. It is called in one of the worker threads
+    :param items: Items to process. They are consumed lazily, one for every free slot in the window
+    :param workers: Number of threads
+    :param window: Maximum number of items in flight. Defaults to the number of workers
+    :param executor: Executor to use instead of a new pool of threads, e.g. a pool of processes. It is not shut down
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    window = window if window is not None else workers
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    own_executor = executor is None
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+    pending: deque["Future[R]"] = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
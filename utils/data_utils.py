@@ -1,11 +1,11 @@
+import io
+import tempfile
+import threading
+from collections import deque
 from io import BufferedRandom
-from typing import Generator
+from typing import Any, BinaryIO, Callable, Generator, Iterable, Iterator, cast
 
-def get_file_size(temp_file: BufferedRandom) -> int:
-    temp_file.seek(0, 2)
-    size = temp_file.tell()
-    temp_file.seek(0)
-    return size
+from utils.hash_utils import TreeHashCombiner, TreeHasher
 
 def bytes_to_human_readable_size(size: int) -> str:
     sizef = float(size)
@@ -15,93 +15,440 @@ def bytes_to_human_readable_size(size: int) -> str:
         sizef /= 1024.0
     return f"{sizef:.1f} Yi"
 
-class CreateSplittedFilesFromGenerator:
+def find_missing_ranges(ranges: Iterable[tuple[int, int]], total_size: int) -> list[tuple[int, int]]:
     """
-    This Class is used to create parts of a file from a generator.
-    It is similar to a Generator but gives out the chunks in a file of a given size, instead of yielding the chunks.
+    Returns the gaps which are not covered by the given ranges between 0 and total_size.
+
+    :param ranges: Ranges as (start, size)
+    :param total_size: Size of the whole data
+    :return: The missing ranges as (start, size)
     """
-    remaining_bytes_from_last_part: bytes = bytes()
-    generator_exhausted: bool = False
-    total_read_bytes: int = 0
-    total_written_bytes: int = 0
-    has_returned: bool = False
+    missing_ranges: list[tuple[int, int]] = []
+    covered_until = 0
+    for start, size in sorted(ranges):
+        if start > covered_until:
+            missing_ranges.append((covered_until, start - covered_until))
+        covered_until = max(covered_until, start + size)
+    if covered_until < total_size:
+        missing_ranges.append((covered_until, total_size - covered_until))
+    return missing_ranges
 
-    def create_next_upload_size_part(self, data: Generator[bytes,None,None], upload_size_bytes: int, temp_file: BufferedRandom) -> None:
-        """
-        This function reads data from a generator and writes it to a temporary file of a given size.
-        
-        :param data: Generator that yields bytes
-        :param upload_size_bytes: Size of the part to be written to the temporary file
-        :param temp_file: Temporary file to write the data to
-        """
-        current_written_bytes = 0
+def split_into_blocks(data: Iterable[bytes], block_size: int) -> Generator[bytes, None, None]:
+    """
+    Regroups the chunks of data into blocks of block_size bytes. Only the last block may be smaller.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be at least 1")
+    buffer = bytearray()
+    for chunk in data:
+        buffer += chunk
+        if len(buffer) < block_size:
+            continue
+        offset = 0
+        with memoryview(buffer) as view:
+            while len(buffer) - offset >= block_size:
+                yield bytes(view[offset:offset + block_size])
+                offset += block_size
+        del buffer[:offset]
+    if len(buffer) > 0:
+        yield bytes(buffer)
+
+class BufferPool:
+    """
+    Pool of equally sized buffers, so a stage producing chunks does not allocate a new buffer for every chunk.
+    """
+    buffer_size: int
+
+    def __init__(self, buffer_size: int) -> None:
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+        self.buffer_size = buffer_size
+        self.__free_buffers: list[bytearray] = []
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> bytearray:
+        with self.__lock:
+            if self.__free_buffers:
+                return self.__free_buffers.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        with self.__lock:
+            self.__free_buffers.append(buffer)
+
+def rechunk(data: Iterable[bytes], chunk_size: int, buffer_pool: BufferPool | None = None, hold: int = 0) -> Generator[bytes, None, None]:
+    """
+    Coalesces and splits the chunks of data into chunks of chunk_size bytes and drops empty chunks. Only the last chunk may be smaller.
+    Full chunks of a bytes object are passed on as read-only memoryviews without copying, the others are copied into buffers of the pool,
+    which are passed on as read-only memoryviews as well. Like bytes, they can be written, hashed, compressed or encrypted right away.
+    A buffer is only reused after hold more chunks were yielded, so the stages reading the chunks must be done with a chunk
+    (e.g. have copied it) within hold chunks. Without a pool every chunk is a new bytes object.
+
+    :param buffer_pool: Pool providing buffers of chunk_size bytes
+    :param hold: Number of chunks yielded before a buffer goes back to the pool
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if buffer_pool is not None and buffer_pool.buffer_size != chunk_size:
+        raise ValueError("The buffers of the pool must have chunk_size bytes")
+    held: deque[bytearray] = deque()
+    buffer: bytearray | None = None
+    filled = 0
+
+    def recycle(used_buffer: bytearray) -> None:
+        if buffer_pool is None:
+            return
+        held.append(used_buffer)
+        if len(held) > hold:
+            buffer_pool.release(held.popleft())
+
+    def view(used_buffer: bytearray, size: int) -> bytes:
+        if buffer_pool is None:
+            return bytes(used_buffer[:size])
+        return cast(bytes, memoryview(used_buffer)[:size].toreadonly())
 
-        if not temp_file:
-            raise ValueError("temp_ile is not set")
-        if upload_size_bytes <= 0:
-            raise ValueError("upload_size_bytes must be greater than 0")
+    try:
+        for chunk in data:
+            pending = memoryview(chunk).cast("B")
+            while len(pending) > 0:
+                if filled == 0 and len(pending) >= chunk_size and isinstance(chunk, bytes):
+                    # bytes can not change, so full chunks of them are passed on without a copy
+                    yield cast(bytes, pending[:chunk_size])
+                    pending = pending[chunk_size:]
+                    continue
+                if buffer is None:
+                    buffer = buffer_pool.acquire() if buffer_pool is not None else bytearray(chunk_size)
+                size = min(len(pending), chunk_size - filled)
+                buffer[filled:filled + size] = pending[:size]
+                pending = pending[size:]
+                filled += size
+                if filled == chunk_size:
+                    yield view(buffer, chunk_size)
+                    recycle(buffer)
+                    buffer = None
+                    filled = 0
+        if buffer is not None and filled > 0:
+            yield view(buffer, filled)
+    finally:
+        if buffer_pool is not None:
+            for held_buffer in held:
+                buffer_pool.release(held_buffer)
 
-        chunk: bytes = bytes()
+def readinto_full(file: io.RawIOBase | io.BufferedIOBase, buffer: bytearray) -> int:
+    """
+    Reads into the buffer until it is full or the file ends.
+    :return: The number of bytes read, 0 at the end of the file
+    """
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(buffer):
+        size = file.readinto(view[filled:])
+        if not size:
+            break
+        filled += size
+    return filled
+
+def read_into_pool(file: io.RawIOBase | io.BufferedIOBase, buffer_pool: BufferPool, hold: int = 0) -> Generator[bytes, None, None]:
+    """
+    Reads the file with readinto in chunks of the size of the buffers of the pool, without allocating a new buffer for every chunk.
+    The chunks are read-only memoryviews of the buffers. Like with rechunk, a buffer is only reused after hold more chunks
+    were yielded, so the stages reading the chunks must be done with a chunk within hold chunks.
+
+    :param file: File to read, preferably unbuffered (opened with buffering=0), so the data is read right into the buffers
+    :param hold: Number of chunks yielded before a buffer goes back to the pool
+    """
+    held: deque[bytearray] = deque()
+    try:
         while True:
-            if len(self.remaining_bytes_from_last_part) < upload_size_bytes:
-                try:
-                    chunk = next(data)
-                    self.total_read_bytes += len(chunk)
-                    if len(chunk) == 0:
-                        raise StopIteration
-                except StopIteration as exception:
-                    self.generator_exhausted = True
-                    if len(self.remaining_bytes_from_last_part) == 0 and len(chunk) == 0:
-                        if not self.has_returned:
-                            temp_file.seek(0)
-                            self.has_returned = True
-                            return
-                        size = get_file_size(temp_file)
-                        if size == 0:
-                            raise exception
-                        temp_file.seek(0)
-                        self.has_returned = True
-                        return
-            else:
-                temp_file.write(self.remaining_bytes_from_last_part[:upload_size_bytes])
-                current_written_bytes += upload_size_bytes
-                self.total_written_bytes += upload_size_bytes
-                self.remaining_bytes_from_last_part = self.remaining_bytes_from_last_part[upload_size_bytes:]
-                temp_file.seek(0)
-                self.has_returned = True
+            buffer = buffer_pool.acquire()
+            size = readinto_full(file, buffer)
+            if size == 0:
+                buffer_pool.release(buffer)
                 return
+            held.append(buffer)
+            yield cast(bytes, memoryview(buffer)[:size].toreadonly())
+            if len(held) > hold:
+                buffer_pool.release(held.popleft())
+    finally:
+        for held_buffer in held:
+            buffer_pool.release(held_buffer)
+
+class ChunkSizeHistogram:
+    """
+    Counts the chunks passing a stage in buckets of powers of two of their size.
+    """
+    buckets: dict[int, int]
+    count: int
+    total_size: int
+
+    def __init__(self) -> None:
+        self.buckets = {}
+        self.count = 0
+        self.total_size = 0
+
+    def add(self, size: int) -> None:
+        bucket = size.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total_size += size
+
+    def __str__(self) -> str:
+        if self.count == 0:
+            return "no chunks"
+        # a bucket holds the sizes from its power of two up to the next one
+        buckets = ", ".join(f"{bytes_to_human_readable_size(2 ** (bucket - 1)) + '+' if bucket > 0 else '0 B'}: {count}"
+                            for bucket, count in sorted(self.buckets.items()))
+        return f"{self.count} chunks, mean {bytes_to_human_readable_size(self.total_size // self.count)} ({buckets})"
+
+class StreamSplitter:
+    """
+    Splits data made of concatenated, independently compressed streams into the single streams while the data arrives.
+    If no boundary is found within max_stream_size bytes, the data is probably one large stream. The splitter
+    stops and sets fallback; the unsplit data is left in pending and the rest of the chunks are not consumed.
+    """
+    max_stream_size: int
+    pending: bytearray
+    fallback: bool
 
-            if len(self.remaining_bytes_from_last_part) > upload_size_bytes:
-                temp_file.write(self.remaining_bytes_from_last_part[:upload_size_bytes])
-                current_written_bytes += upload_size_bytes
-                self.total_written_bytes += upload_size_bytes
-                self.remaining_bytes_from_last_part = self.remaining_bytes_from_last_part[upload_size_bytes:]
-                temp_file.seek(0)
-                self.has_returned = True
+    def __init__(self, find_stream_end: Callable[[bytearray, int], int], header_size: int, max_stream_size: int) -> None:
+        """
+        :param find_stream_end: Returns the start of the second stream in the buffer, searching from the given position, or -1
+        :param header_size: Number of bytes needed to recognize the start of a stream
+        :param max_stream_size: Maximum number of bytes to buffer while looking for the end of a stream
+        """
+        self.find_stream_end = find_stream_end
+        self.header_size = header_size
+        self.max_stream_size = max_stream_size
+        self.pending = bytearray()
+        self.fallback = False
+
+    def split(self, chunks: Iterator[bytes]) -> Generator[bytes, None, None]:
+        search_from = self.header_size
+        for chunk in chunks:
+            self.pending += chunk
+            while (stream_end := self.find_stream_end(self.pending, search_from)) != -1:
+                yield bytes(self.pending[:stream_end])
+                del self.pending[:stream_end]
+                search_from = self.header_size
+            # a header that is not complete yet has to be checked again with the next chunk
+            search_from = max(self.header_size, len(self.pending) - self.header_size + 1)
+            if len(self.pending) > self.max_stream_size:
+                self.fallback = True
                 return
+        if len(self.pending) > 0:
+            yield bytes(self.pending)
+            self.pending = bytearray()
+
+class MemoryviewReader(io.RawIOBase):
+    """
+    Read-only, seekable file-like object over a memoryview.
+    Used to hand a part buffer to APIs which expect a file (e.g. boto3 bodies) without copying it into a BytesIO first.
+    """
+    def __init__(self, view: memoryview) -> None:
+        self.view = view
+        self.position = 0
+        super().__init__()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int | None = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self.view) - self.position
+        data = bytes(self.view[self.position:self.position + size])
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer: Any) -> int:
+        target = memoryview(buffer).cast("B")
+        size = min(len(target), len(self.view) - self.position)
+        target[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = len(self.view) + offset
+        else:
+            raise ValueError("Invalid whence")
+        if self.position < 0:
+            raise ValueError("Negative seek position")
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+class UploadPart:
+    """
+    One part of an upload created by the UploadPartAssembler.
+    The data either lives in a preallocated buffer of the assembler (exposed as a read-only memoryview)
+    or, if the assembler spills to disk, in a temporary file.
+    The part has to be released after it was consumed, so the assembler can reuse the buffer.
+    If the assembler computes tree hashes, tree_hash holds the SHA256 tree hash of the part.
+    """
+    tree_hash: bytes | None
 
-            # now self.remainingBytesFromLastPart is empty or smaller then uploadSizeBytes
-
-            temp_file.write(self.remaining_bytes_from_last_part)
-            current_written_bytes += len(self.remaining_bytes_from_last_part)
-            self.total_written_bytes += len(self.remaining_bytes_from_last_part)
-            self.remaining_bytes_from_last_part = bytes()
-            max_write_size_allowed = upload_size_bytes - current_written_bytes
-
-            if chunk:
-                if len(chunk) > max_write_size_allowed:
-                    temp_file.write(chunk[:max_write_size_allowed])
-                    self.remaining_bytes_from_last_part = chunk[max_write_size_allowed:]
-                    chunk = bytes()
-                    current_written_bytes += max_write_size_allowed
-                    self.total_written_bytes += max_write_size_allowed
-                    temp_file.seek(0)
-                    self.has_returned = True
-                    return
-                temp_file.write(chunk)
-                current_written_bytes += len(chunk)
-                self.total_written_bytes += len(chunk)
-                chunk = bytes()
-
-            if self.remaining_bytes_from_last_part == b"" and self.generator_exhausted and len(chunk) == 0:
-                raise StopIteration
+    def __init__(self, index: int, offset: int, size: int, view: memoryview | None, spill_file: BufferedRandom | None, # pylint: disable=too-many-arguments
+                 release_callback: Callable[["UploadPart"], None]) -> None:
+        self.index = index
+        self.offset = offset
+        self.size = size
+        self.view = view
+        self.spill_file = spill_file
+        self.release_callback = release_callback
+        self.released = False
+        self.tree_hash = None
+
+    def get_view(self) -> memoryview:
+        if self.view is None:
+            raise ValueError("Part was spilled to disk and has no memory view")
+        return self.view
+
+    def get_reader(self) -> BinaryIO:
+        if self.view is not None:
+            return cast(BinaryIO, MemoryviewReader(self.view))
+        assert self.spill_file is not None
+        self.spill_file.seek(0)
+        return cast(BinaryIO, self.spill_file)
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.release_callback(self)
+
+class UploadPartAssembler:
+    """
+    Assembles parts of a fixed size from a generator of chunks of any size.
+    The chunks are copied exactly once into preallocated part buffers, which are handed out as read-only views.
+    If the memory is capped below the size of one part, the parts are spilled into temporary files instead.
+    The tree hashes of the parts can be computed while the chunks are copied, so the data never has to be read again.
+    They are combined into the running tree hash of the whole archive.
+    """
+    part_size: int
+    buffer_count: int
+    spill_to_disk: bool
+    compute_tree_hash: bool
+    archive_tree_hash: TreeHashCombiner
+    total_read_bytes: int
+
+    def __init__(self, part_size: int, buffer_count: int = 2, max_memory_bytes: int | None = None, compute_tree_hash: bool = False) -> None:
+        """
+        :param part_size: Size of every part except the last one
+        :param buffer_count: Number of part buffers which can be in use at the same time
+        :param max_memory_bytes: Upper limit for the memory used by the part buffers. None means unlimited
+        :param compute_tree_hash: If set, the SHA256 tree hash of every part is computed while it is assembled.
+                                  This requires part_size to be 1 MiB multiplied by a power of two
+        """
+        if part_size <= 0:
+            raise ValueError("part_size must be greater than 0")
+        if buffer_count <= 0:
+            raise ValueError("buffer_count must be greater than 0")
+        self.part_size = part_size
+        self.buffer_count = buffer_count
+        self.spill_to_disk = False
+        self.compute_tree_hash = compute_tree_hash
+        if compute_tree_hash:
+            leaves_per_part, remainder = divmod(part_size, TreeHasher.LEAF_SIZE)
+            if remainder != 0 or (leaves_per_part & (leaves_per_part - 1)) != 0:
+                raise ValueError("part_size must be 1 MiB multiplied by a power of two to compute tree hashes")
+        self.archive_tree_hash = TreeHashCombiner()
+        if max_memory_bytes is not None:
+            self.buffer_count = min(buffer_count, max_memory_bytes // part_size)
+            if self.buffer_count == 0:
+                self.buffer_count = buffer_count
+                self.spill_to_disk = True
+        self.total_read_bytes = 0
+        self.__free_buffers: list[bytearray] = []
+        self.__allocated_buffers = 0
+        self.__buffers_in_use: dict[int, bytearray] = {}
+        self.__condition = threading.Condition()
+
+    def __acquire_buffer(self) -> bytearray:
+        with self.__condition:
+            while not self.__free_buffers and self.__allocated_buffers >= self.buffer_count:
+                self.__condition.wait()
+            if self.__free_buffers:
+                return self.__free_buffers.pop()
+            self.__allocated_buffers += 1
+        return bytearray(self.part_size)
+
+    def __release_part(self, part: UploadPart) -> None:
+        if part.spill_file is not None:
+            part.spill_file.close()
+        with self.__condition:
+            buffer = self.__buffers_in_use.pop(part.index, None)
+            if buffer is not None:
+                self.__free_buffers.append(buffer)
+            self.__condition.notify()
+
+    def parts(self, data: Generator[bytes, None, None]) -> Generator[UploadPart, None, None]:
+        """
+        Yields the parts of the data. Only the last part can be smaller than part_size.
+        A new chunk is only requested from the generator after the previous one was completely copied,
+        so the generator can reuse its buffers.
+        """
+        pending = memoryview(b"")
+        index = 0
+        offset = 0
+        exhausted = False
+        while not exhausted:
+            buffer: bytearray | None = None
+            target: memoryview | None = None
+            spill_file: BufferedRandom | None = None
+            if self.spill_to_disk:
+                spill_file = tempfile.TemporaryFile(mode="b+w")  # pylint: disable=consider-using-with
+            else:
+                buffer = self.__acquire_buffer()
+                target = memoryview(buffer)
+            tree_hasher = TreeHasher() if self.compute_tree_hash else None
+            filled = 0
+            while filled < self.part_size:
+                if len(pending) == 0:
+                    try:
+                        chunk = next(data)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending = memoryview(chunk).cast("B")
+                    self.total_read_bytes += len(pending)
+                    continue
+                size = min(len(pending), self.part_size - filled)
+                if target is not None:
+                    target[filled:filled + size] = pending[:size]
+                else:
+                    assert spill_file is not None
+                    spill_file.write(pending[:size])
+                if tree_hasher is not None:
+                    tree_hasher.update(pending[:size])
+                pending = pending[size:]
+                filled += size
+            if filled == 0:
+                if spill_file is not None:
+                    spill_file.close()
+                if buffer is not None:
+                    with self.__condition:
+                        self.__free_buffers.append(buffer)
+                        self.__condition.notify()
+                return
+            view = target[:filled].toreadonly() if target is not None else None
+            if buffer is not None:
+                with self.__condition:
+                    self.__buffers_in_use[index] = buffer
+            part = UploadPart(index, offset, filled, view, spill_file, self.__release_part)
+            if tree_hasher is not None:
+                part.tree_hash = tree_hasher.digest()
+                self.archive_tree_hash.add(part.tree_hash)
+            yield part
+            index += 1
+            offset += filled
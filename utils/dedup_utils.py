@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import zipfile
+from typing import IO, Any, Callable, Generator, Iterable
+
+RECIPE_VERSION = 1
+CHUNK_KEY_SIZE = 16
+# members of a deduplicated archive: the new chunks one after another, then the recipe
+CHUNKS_MEMBER_NAME = "chunks"
+RECIPE_MEMBER_NAME = "recipe.json"
+
+def _gear_value(byte: int) -> int:
+    return int.from_bytes(hashlib.sha256(bytes([byte])).digest()[:4], "big")
+
+# half of the byte values map to the bit 1, chosen by a fixed hash so the boundaries never change between versions
+_GEAR_ORDER = sorted(range(256), key=_gear_value)
+GEAR_TABLE = bytes(ord("1") if _GEAR_ORDER.index(byte) >= 128 else ord("0") for byte in range(256))
+# the bits a window has to match at a boundary. The patterns of all sizes share their end
+BOUNDARY_BITS = "".join(f"{byte:08b}" for byte in hashlib.sha256(b"ecsu content defined chunking").digest()).encode()
+
+def get_chunk_key(chunk: bytes) -> bytes:
+    """
+    Returns the key of a chunk in the chunk index, the start of its SHA-256.
+    """
+    return hashlib.sha256(chunk).digest()[:CHUNK_KEY_SIZE]
+
+class CdcChunker:
+    """
+    Content-defined chunking in the style of FastCDC: the boundaries depend on the content around them,
+    so data inserted into a file only changes the chunks next to it and the others are found again.
+    Like the gear hash of FastCDC, every byte is mapped to a pseudo-random bit and a boundary is where the bits of the last
+    bytes match a pattern. The bits are mapped with bytes.translate and the pattern is searched with bytes.find,
+    which is orders of magnitude faster than rolling a hash byte by byte in Python.
+    The first min_size bytes of a chunk are skipped, up to the average size a longer pattern is searched and
+    after it a shorter one (normalized chunking), so the sizes stay close to the average. No chunk is larger than max_size.
+    """
+    min_size: int
+    average_size: int
+    max_size: int
+
+    def __init__(self, min_size: int, average_size: int, max_size: int) -> None:
+        if not 0 < min_size < average_size < max_size:
+            raise ValueError("The sizes must be 0 < min_size < average_size < max_size")
+        bits = max(average_size.bit_length() - 1, 3)
+        if bits + 2 > len(BOUNDARY_BITS):
+            raise ValueError("average_size is too large")
+        self.min_size = min_size
+        self.average_size = average_size
+        self.max_size = max_size
+        self.strict_pattern = BOUNDARY_BITS[-(bits + 2):]
+        self.loose_pattern = BOUNDARY_BITS[-(bits - 2):]
+
+    @classmethod
+    def from_average_size(cls, average_size: int) -> "CdcChunker":
+        return cls(average_size // 4, average_size, average_size * 4)
+
+    def find_boundary(self, data: bytes | bytearray, start: int = 0) -> int:
+        """
+        Returns the length of the first chunk of the data after start. The data has to hold max_size bytes after start
+        unless it is the end of the stream.
+        """
+        if len(data) - start <= self.min_size:
+            return len(data) - start
+        bits = data[start:start + self.max_size].translate(GEAR_TABLE)
+        normal_size = min(self.average_size, len(bits))
+        position = bits.find(self.strict_pattern, self.min_size - len(self.strict_pattern), normal_size)
+        if position != -1:
+            return position + len(self.strict_pattern)
+        position = bits.find(self.loose_pattern, normal_size - len(self.loose_pattern) + 1)
+        if position != -1:
+            return position + len(self.loose_pattern)
+        return len(bits)
+
+    def split(self, data: Iterable[bytes]) -> Generator[bytes, None, None]:
+        """
+        Splits the chunks of data at the content-defined boundaries.
+        """
+        buffer = bytearray()
+        start = 0
+        for chunk in data:
+            # the chunks before start were yielded, they are removed once per read instead of after every chunk
+            del buffer[:start]
+            start = 0
+            buffer += chunk
+            while len(buffer) - start >= self.max_size:
+                boundary = self.find_boundary(buffer, start)
+                yield bytes(buffer[start:start + boundary])
+                start += boundary
+        while start < len(buffer):
+            boundary = self.find_boundary(buffer, start)
+            yield bytes(buffer[start:start + boundary])
+            start += boundary
+
+class DedupRecipe:
+    """
+    Describes how to rebuild the files of a deduplicated upload. The content of every file is a list of extents
+    [upload id, offset, size] in the chunk data of an upload, where the upload id None is the upload carrying the recipe.
+    Consecutive chunks stored one after another are merged into one extent, which keeps the recipe small.
+    """
+    files: list[dict[str, Any]]
+    total_size: int
+    new_size: int
+
+    def __init__(self) -> None:
+        self.files = []
+        self.total_size = 0
+        self.new_size = 0
+
+    def add_file(self, path: str, stat: os.stat_result) -> None:
+        self.files.append({"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "extents": []})
+
+    def add_chunk(self, upload_id: int | None, offset: int, size: int) -> None:
+        """
+        Adds the next chunk of the last added file.
+        """
+        extents: list[list[Any]] = self.files[-1]["extents"]
+        self.total_size += size
+        if upload_id is None:
+            self.new_size += size
+        if extents and extents[-1][0] == upload_id and extents[-1][1] + extents[-1][2] == offset:
+            extents[-1][2] += size
+        else:
+            extents.append([upload_id, offset, size])
+
+    def as_json(self) -> bytes:
+        return json.dumps({"version": RECIPE_VERSION, "files": self.files}, separators=(",", ":")).encode()
+
+def restore_files(recipe: dict[str, Any], upload_id: int, read_chunk_data: Callable[[int, int, int], bytes], location: str) -> list[str]:
+    """
+    Rebuilds the files of a deduplicated upload.
+
+    :param recipe: The parsed recipe of the upload
+    :param upload_id: Id of the upload carrying the recipe
+    :param read_chunk_data: Reads size bytes at an offset of the chunk data of an upload, called with the upload id, offset and size
+    :param location: Directory the files are written to, below their full path
+    :return: The paths of the written files
+    """
+    if recipe.get("version") != RECIPE_VERSION:
+        raise ValueError(f"Unsupported version {recipe.get('version')} of the recipe")
+    restored: list[str] = []
+    for file in recipe["files"]:
+        target = os.path.join(location, os.path.relpath(os.path.abspath(file["path"]), os.sep))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as output:
+            for extent_upload_id, offset, size in file["extents"]:
+                output.write(read_chunk_data(upload_id if extent_upload_id is None else extent_upload_id, offset, size))
+        os.utime(target, ns=(file["mtime_ns"], file["mtime_ns"]))
+        restored.append(target)
+    return restored
+
+def get_referenced_uploads(recipe: dict[str, Any]) -> set[int]:
+    """
+    Returns the ids of the earlier uploads storing chunks the recipe refers to.
+    """
+    return {extent[0] for file in recipe["files"] for extent in file["extents"] if extent[0] is not None}
+
+class DeduplicatedArchives:
+    """
+    Reads the recipe and the chunk data of deduplicated uploads from their downloaded zip files, to rebuild the files with restore_files.
+    The chunk data of every upload stays open, as the extents of the files are mostly read in the order they were stored.
+    """
+    def __init__(self) -> None:
+        self.__archives: dict[int, zipfile.ZipFile] = {}
+        self.__chunk_data: dict[int, IO[bytes]] = {}
+
+    def add(self, upload_id: int, path: str) -> None:
+        # the archives stay open until close
+        self.__archives[upload_id] = zipfile.ZipFile(path) # pylint: disable=consider-using-with
+
+    def read_recipe(self, upload_id: int) -> dict[str, Any]:
+        recipe: dict[str, Any] = json.loads(self.__archives[upload_id].read(RECIPE_MEMBER_NAME))
+        return recipe
+
+    def read_chunk_data(self, upload_id: int, offset: int, size: int) -> bytes:
+        if upload_id not in self.__chunk_data:
+            self.__chunk_data[upload_id] = self.__archives[upload_id].open(CHUNKS_MEMBER_NAME)
+        chunk_data = self.__chunk_data[upload_id]
+        chunk_data.seek(offset)
+        data = chunk_data.read(size)
+        if len(data) != size:
+            raise ValueError(f"The chunk data of upload {upload_id} ends before {offset + size}")
+        return data
+
+    def close(self) -> None:
+        for chunk_data in self.__chunk_data.values():
+            chunk_data.close()
+        for archive in self.__archives.values():
+            archive.close()
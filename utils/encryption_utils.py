@@ -0,0 +1,114 @@
+import struct
+from typing import Any, Iterable, Generator
+
+from Crypto.Cipher import AES
+
+FRAME_MAGIC = b"ECSA"
+FRAME_VERSION = 1
+FRAME_HEADER_FORMAT = ">4sBII16s8s"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+FRAME_TAG_SIZE = 16
+SALT_SIZE = 16
+NONCE_PREFIX_SIZE = 8
+MAX_CHUNKS = 2 ** 32
+
+class ChunkAuthenticationError(ValueError):
+    """
+    Raised if a chunk was modified, reordered, or the data was truncated.
+    """
+
+class FramedAesHeader:
+    """
+    Header of the framed AES-GCM format. The data is encrypted in chunks of chunk_size bytes, every chunk
+    is encrypted and authenticated on its own and followed by its tag. Only the last chunk may be smaller.
+    The nonce of a chunk is the nonce prefix followed by the index of the chunk. The header and the index of
+    the chunk, together with a flag marking the last chunk, are authenticated as associated data,
+    so a chunk can not be moved and the data can not be truncated unnoticed.
+    """
+    chunk_size: int
+    kdf_iterations: int
+    salt: bytes
+    nonce_prefix: bytes
+
+    def __init__(self, chunk_size: int, kdf_iterations: int, salt: bytes, nonce_prefix: bytes) -> None:
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        if len(salt) != SALT_SIZE or len(nonce_prefix) != NONCE_PREFIX_SIZE:
+            raise ValueError(f"The salt must have {SALT_SIZE} and the nonce prefix {NONCE_PREFIX_SIZE} bytes")
+        self.chunk_size = chunk_size
+        self.kdf_iterations = kdf_iterations
+        self.salt = salt
+        self.nonce_prefix = nonce_prefix
+
+    def pack(self) -> bytes:
+        return struct.pack(FRAME_HEADER_FORMAT, FRAME_MAGIC, FRAME_VERSION, self.chunk_size, self.kdf_iterations, self.salt, self.nonce_prefix)
+
+    @classmethod
+    def unpack(cls, header: bytes | bytearray | memoryview) -> "FramedAesHeader":
+        if len(header) < FRAME_HEADER_SIZE:
+            raise ValueError("The encrypted data is too short for the header")
+        magic, version, chunk_size, kdf_iterations, salt, nonce_prefix = struct.unpack_from(FRAME_HEADER_FORMAT, header)
+        if magic != FRAME_MAGIC:
+            raise ValueError("The encrypted data is not in the framed AES format")
+        if version != FRAME_VERSION:
+            raise ValueError(f"Unsupported version {version} of the framed AES format")
+        return cls(chunk_size, kdf_iterations, salt, nonce_prefix)
+
+    def get_encrypted_chunk_size(self) -> int:
+        return self.chunk_size + FRAME_TAG_SIZE
+
+    def get_chunk_offset(self, index: int) -> int:
+        """
+        Returns the position of the encrypted chunk in the encrypted data, including the header.
+        """
+        return FRAME_HEADER_SIZE + index * self.get_encrypted_chunk_size()
+
+    def get_chunk_range(self, offset: int, length: int) -> tuple[int, int, int]:
+        """
+        Returns the chunks covering length bytes of the unencrypted data starting at offset,
+        to decrypt only a part of the data.
+
+        :return: Index of the first chunk, position of the first chunk and number of bytes of the encrypted chunks
+        """
+        if offset < 0 or length < 1:
+            raise ValueError("offset must not be negative and length must be at least 1")
+        first_index = offset // self.chunk_size
+        last_index = (offset + length - 1) // self.chunk_size
+        start = self.get_chunk_offset(first_index)
+        return first_index, start, self.get_chunk_offset(last_index + 1) - start
+
+    def __get_cipher(self, key: bytes, index: int, last: bool) -> Any:
+        if not 0 <= index < MAX_CHUNKS:
+            raise ValueError("Too many chunks for the nonce counter")
+        cipher = AES.new(key, AES.MODE_GCM, nonce=self.nonce_prefix + index.to_bytes(4, "big"), mac_len=FRAME_TAG_SIZE)
+        cipher.update(self.pack() + struct.pack(">I?", index, last))
+        return cipher
+
+    def encrypt_chunk(self, key: bytes, index: int, chunk: bytes, last: bool) -> bytes:
+        cipher = self.__get_cipher(key, index, last)
+        encrypted: bytes
+        tag: bytes
+        encrypted, tag = cipher.encrypt_and_digest(chunk)
+        return encrypted + tag
+
+    def decrypt_chunk(self, key: bytes, index: int, encrypted_chunk: bytes, last: bool) -> bytes:
+        if len(encrypted_chunk) < FRAME_TAG_SIZE:
+            raise ChunkAuthenticationError(f"Chunk {index} is truncated")
+        cipher = self.__get_cipher(key, index, last)
+        try:
+            decrypted: bytes = cipher.decrypt_and_verify(encrypted_chunk[:-FRAME_TAG_SIZE], encrypted_chunk[-FRAME_TAG_SIZE:])
+        except ValueError as exception:
+            raise ChunkAuthenticationError(f"Chunk {index} failed the authentication") from exception
+        return decrypted
+
+def mark_last(chunks: Iterable[bytes]) -> Generator[tuple[bytes, bool], None, None]:
+    """
+    Yields every chunk together with a flag telling if it is the last one. Without any chunk an empty last chunk is yielded,
+    so even empty data is authenticated.
+    """
+    previous: bytes | None = None
+    for chunk in chunks:
+        if previous is not None:
+            yield previous, False
+        previous = chunk
+    yield (previous if previous is not None else b""), True
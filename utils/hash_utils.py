@@ -1,6 +1,6 @@
 import binascii
 import hashlib
-from typing import List
+from typing import Iterable, List, Tuple
 
 def compute_sha256_tree_hash_for_aws(chunk_sha256_hashes: List[bytes]) -> str:
     if not isinstance(chunk_sha256_hashes, list) or not all(isinstance(i, bytes) for i in chunk_sha256_hashes) or not all(chunk_sha256_hashes):
@@ -26,3 +26,131 @@ def compute_sha256_tree_hash_for_aws(chunk_sha256_hashes: List[bytes]) -> str:
             new_chunks.append(first)
         chunks = new_chunks
     return binascii.hexlify(chunks[0]).decode('ascii')
+
+class TreeHashCombiner:
+    """
+    Combines the hashes of consecutive subtrees into one SHA256 tree hash as used by AWS Glacier.
+    Every subtree except the last one has to cover the same power of two number of 1 MiB leaves,
+    e.g. the leaves themselves or the tree hashes of the parts of a multipart upload.
+    Only one hash per level of the tree is kept, so the memory usage is O(log n).
+    """
+    stack: List[Tuple[int, bytes]]
+    count: int
+
+    def __init__(self) -> None:
+        # binary counter: every entry is (level, hash) and the levels are strictly decreasing from bottom to top
+        self.stack = []
+        self.count = 0
+
+    def add(self, subtree_hash: bytes) -> None:
+        level = 0
+        while self.stack and self.stack[-1][0] == level:
+            _, left = self.stack.pop()
+            subtree_hash = hashlib.sha256(left + subtree_hash).digest()
+            level += 1
+        self.stack.append((level, subtree_hash))
+        self.count += 1
+
+    def copy(self) -> "TreeHashCombiner":
+        combiner = TreeHashCombiner()
+        combiner.stack = list(self.stack)
+        combiner.count = self.count
+        return combiner
+
+    def digest(self) -> bytes:
+        if not self.stack:
+            raise ValueError("No hashes added")
+        result = self.stack[-1][1]
+        for _, left in reversed(self.stack[:-1]):
+            result = hashlib.sha256(left + result).digest()
+        return result
+
+    def hexdigest(self) -> str:
+        return binascii.hexlify(self.digest()).decode('ascii')
+
+class TreeHasher:
+    """
+    Computes the SHA256 tree hash used by AWS Glacier incrementally from data of any size.
+    The data is split into leaves of 1 MiB, which are folded into the tree as soon as they are complete.
+    """
+    LEAF_SIZE = 1024 * 1024
+
+    def __init__(self) -> None:
+        self.__combiner = TreeHashCombiner()
+        self.__current_leaf = hashlib.sha256()
+        self.__current_leaf_size = 0
+
+    def update(self, data: bytes | bytearray | memoryview) -> None:
+        view = memoryview(data).cast("B")
+        while len(view) > 0:
+            size = min(len(view), self.LEAF_SIZE - self.__current_leaf_size)
+            self.__current_leaf.update(view[:size])
+            self.__current_leaf_size += size
+            view = view[size:]
+            if self.__current_leaf_size == self.LEAF_SIZE:
+                self.__combiner.add(self.__current_leaf.digest())
+                self.__current_leaf = hashlib.sha256()
+                self.__current_leaf_size = 0
+
+    def digest(self) -> bytes:
+        if self.__current_leaf_size == 0:
+            if self.__combiner.count == 0:
+                return hashlib.sha256(b"").digest()
+            return self.__combiner.digest()
+        combiner = self.__combiner.copy()
+        combiner.add(self.__current_leaf.digest())
+        return combiner.digest()
+
+    def hexdigest(self) -> str:
+        return binascii.hexlify(self.digest()).decode('ascii')
+
+def combine_tree_hashes(tree_hashes: Iterable[bytes | str]) -> str:
+    """
+    Combines the tree hashes of the parts of a multipart upload into the tree hash of the whole archive.
+    All parts except the last one need to have the same size, which has to be 1 MiB multiplied by a power of two.
+    """
+    combiner = TreeHashCombiner()
+    for tree_hash in tree_hashes:
+        combiner.add(bytes.fromhex(tree_hash) if isinstance(tree_hash, str) else tree_hash)
+    return combiner.hexdigest()
+
+CRC32_POLYNOMIAL = 0xEDB88320
+
+def _crc32_multiply_modulo(a: int, b: int) -> int:
+    # multiplies two polynomials modulo the reflected CRC32 polynomial, like multmodp of zlib
+    mask = 1 << 31
+    product = 0
+    while True:
+        if a & mask:
+            product ^= b
+            if a & (mask - 1) == 0:
+                return product
+        mask >>= 1
+        b = (b >> 1) ^ CRC32_POLYNOMIAL if b & 1 else b >> 1
+
+def _crc32_powers_of_x() -> list[int]:
+    # x^(2^k) modulo the polynomial for k from 0 to 31
+    powers = []
+    power = 1 << 30
+    for _ in range(32):
+        powers.append(power)
+        power = _crc32_multiply_modulo(power, power)
+    return powers
+
+_CRC32_POWERS_OF_X = _crc32_powers_of_x()
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    Returns the CRC32 of two concatenated pieces of data from the CRC32 of both pieces and the length of the second one,
+    like crc32_combine of zlib. It takes O(log length2) steps, so pieces can be checksummed independently.
+    """
+    # the first CRC is shifted by length2 * 8 bits: multiplied by x^(8 * length2)
+    shift = 1 << 31
+    exponent = length2
+    k = 3
+    while exponent:
+        if exponent & 1:
+            shift = _crc32_multiply_modulo(_CRC32_POWERS_OF_X[k & 31], shift)
+        exponent >>= 1
+        k += 1
+    return _crc32_multiply_modulo(shift, crc1) ^ crc2
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import threading
+import time
+
+from utils.report_utils import ReportManager, StageProgress
+
+METRIC_PREFIX = "ecsu"
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in sorted(labels.items())) + "}"
+
+class _MetricsText:
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+
+    def add(self, name: str, metric_type: str, description: str, samples: list[tuple[dict[str, str], float]]) -> None:
+        self.lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+        self.lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+        for labels, value in samples:
+            self.lines.append(f"{METRIC_PREFIX}_{name}{_format_labels(labels)} {value}")
+
+    def __str__(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+def render_metrics(stages: dict[str, StageProgress], duration_seconds: float, labels: dict[str, str], success: bool | None = None) -> str:
+    """
+    Renders the progress of the stages in the Prometheus text format read by the textfile collector of the node exporter.
+
+    :param stages: Progress by stage, as returned by ReportManager.get_stage_progress
+    :param duration_seconds: Time since the start of the run
+    :param labels: Labels added to every sample, e.g. the profile
+    :param success: Result of the run, or None while it is running
+    """
+    text = _MetricsText()
+    def by_stage(attribute: str) -> list[tuple[dict[str, str], float]]:
+        return [({**labels, "stage": stage}, getattr(progress, attribute)) for stage, progress in sorted(stages.items())]
+    packer = stages.get("packer", StageProgress())
+    transferer = stages.get("transferer", StageProgress())
+    text.add("bytes_read_total", "counter", "Bytes read from the files.", [(labels, packer.size)])
+    text.add("bytes_uploaded_total", "counter", "Bytes transferred to the storage.", [(labels, transferer.size)])
+    text.add("parts_uploaded_total", "counter", "Chunks or parts transferred to the storage.", [(labels, transferer.chunks)])
+    text.add("retries_total", "counter", "Retried transfers of parts.", [(labels, transferer.retries)])
+    text.add("stage_bytes_total", "counter", "Bytes processed by the workers of a stage.", by_stage("size"))
+    text.add("stage_chunks_total", "counter", "Chunks processed by the workers of a stage.", by_stage("chunks"))
+    text.add("stage_throughput_bytes_per_second", "gauge", "Bytes processed by a stage per second of the run.",
+             [({**labels, "stage": stage}, round(progress.size / max(duration_seconds, 1e-9), 1)) for stage, progress in sorted(stages.items())])
+    text.add("run_duration_seconds", "gauge", "Duration of the run so far.", [(labels, round(duration_seconds, 3))])
+    text.add("run_running", "gauge", "1 while the run is in progress.", [(labels, 1 if success is None else 0)])
+    if success is not None:
+        text.add("run_success", "gauge", "1 if the run succeeded, 0 if it failed.", [(labels, 1 if success else 0)])
+    text.add("run_last_update_timestamp_seconds", "gauge", "Time of the last update of this file.", [(labels, round(time.time(), 3))])
+    return str(text)
+
+def write_file_atomically(path: str, content: str) -> None:
+    """
+    Writes the content into a temporary file next to the path and renames it, so readers never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as temporary_file:
+            temporary_file.write(content)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+class MetricsFileWriter:
+    """
+    Writes the metrics of a run into a file while it runs and once more with its result at the end.
+    The metrics are read from the counters of the ReportManager, so the workers do not count anything twice.
+    """
+    path: str
+    interval: float
+    labels: dict[str, str]
+
+    def __init__(self, path: str, report_manager: ReportManager, labels: dict[str, str], interval: float = 15.0) -> None:
+        """
+        :param path: File to write, usually in the directory of the textfile collector
+        :param labels: Labels added to every sample
+        :param interval: Seconds between two updates while the run is in progress
+        """
+        self.path = path
+        self.report_manager = report_manager
+        self.labels = labels
+        self.interval = interval
+        self.__stop_event = threading.Event()
+        self.__thread = threading.Thread(target=self.__update_periodically, name="metrics-writer", daemon=True)
+
+    def start(self) -> None:
+        self.write()
+        self.__thread.start()
+
+    def write(self, success: bool | None = None) -> None:
+        write_file_atomically(self.path, render_metrics(self.report_manager.get_stage_progress(),
+                                                        time.monotonic() - self.report_manager.start_time, self.labels, success))
+
+    def stop(self, success: bool) -> None:
+        self.__stop_event.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+        self.write(success)
+
+    def __update_periodically(self) -> None:
+        while not self.__stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                # a failed update is replaced by the next one
+                pass
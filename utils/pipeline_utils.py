@@ -0,0 +1,282 @@
+import threading
+import time
+import uuid
+from collections import deque
+from types import TracebackType
+from typing import Any, Generic, Iterable, Generator, TypeVar
+
+from services.cancel_service import CancelService
+from utils.data_utils import BufferPool, ChunkSizeHistogram, rechunk
+
+T = TypeVar("T")
+
+class PipelineCancelledError(Exception):
+    """
+    Raised in the stages of a pipeline that was cancelled, or that stopped because another stage failed.
+    """
+
+class StageStatistics:
+    """
+    Where the time of a stage went: processing, waiting for chunks of the stage before it (upstream)
+    or waiting for free space in the queue of the stage after it (downstream).
+    The stage with the most busy time is the bottleneck, the others wait for it.
+    """
+    name: str
+    bytes_in: int
+    bytes_out: int
+    busy_seconds: float
+    upstream_wait_seconds: float
+    downstream_wait_seconds: float
+
+    def __init__(self, name: str, bytes_in: int, bytes_out: int, busy_seconds: float, # pylint: disable=too-many-arguments
+                 upstream_wait_seconds: float, downstream_wait_seconds: float) -> None:
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.busy_seconds = busy_seconds
+        self.upstream_wait_seconds = upstream_wait_seconds
+        self.downstream_wait_seconds = downstream_wait_seconds
+
+    def get_throughput(self) -> float:
+        """
+        Returns the bytes the stage processed per busy second, which is the throughput it would reach without waiting.
+        """
+        return max(self.bytes_in, self.bytes_out) / max(self.busy_seconds, 1e-9)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "upstream_wait_seconds": round(self.upstream_wait_seconds, 3),
+            "downstream_wait_seconds": round(self.downstream_wait_seconds, 3),
+            "throughput": round(self.get_throughput())
+        }
+
+class _Channel(Generic[T]):
+    """
+    Bounded queue between two stages. put blocks while the queue is full and get while it is empty,
+    both wake up when the pipeline is cancelled.
+    """
+    def __init__(self, pipeline: "Pipeline", capacity: int, histogram: ChunkSizeHistogram) -> None:
+        self.pipeline = pipeline
+        self.capacity = capacity
+        self.histogram = histogram
+        self.items: deque[T] = deque()
+        self.finished = False
+        self.size = 0
+        self.put_wait_seconds = 0.0
+        self.get_wait_seconds = 0.0
+
+    def put(self, item: T) -> None:
+        with self.pipeline.condition:
+            if len(self.items) >= self.capacity:
+                wait_start = time.monotonic()
+                while len(self.items) >= self.capacity and not self.pipeline.is_cancelled():
+                    self.pipeline.condition.wait()
+                self.put_wait_seconds += time.monotonic() - wait_start
+            if self.pipeline.is_cancelled():
+                # the error of the pipeline is raised where the chunks are read, the writing stages just stop
+                raise PipelineCancelledError("The pipeline was cancelled")
+            self.items.append(item)
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                self.histogram.add(len(item))
+                self.size += len(item)
+            self.pipeline.condition.notify_all()
+
+    def finish(self) -> None:
+        with self.pipeline.condition:
+            self.finished = True
+            self.pipeline.condition.notify_all()
+
+    def get(self) -> list[T]:
+        """
+        Takes all queued items, waiting for at least one.
+        :return: The items, or an empty list after the last item
+        """
+        with self.pipeline.condition:
+            if not self.items and not self.finished:
+                wait_start = time.monotonic()
+                while not self.items and not self.finished and not self.pipeline.is_cancelled():
+                    self.pipeline.condition.wait()
+                self.get_wait_seconds += time.monotonic() - wait_start
+            self.pipeline.raise_if_cancelled()
+            items = list(self.items)
+            self.items.clear()
+            self.pipeline.condition.notify_all()
+            return items
+
+class Pipeline:
+    """
+    Runs the stages of an upload or download (packing, compression, encryption, transfer) in their own threads.
+    Every stage wrapped with run_stage is iterated in a thread, which hands its chunks to the next stage over a bounded queue,
+    so the stages overlap and the total time approaches the time of the slowest stage. A full queue blocks the stage before it.
+    The first exception of a stage cancels the pipeline and is raised again in the stage reading from it,
+    the other stages stop with a PipelineCancelledError. The pipeline is cancelled as well by the cancel service
+    and when it is left, so no thread outlives it.
+    The sizes of the chunks every stage hands on are counted in a histogram, and the time of every stage is accounted
+    in StageStatistics. For those the stages have to be added in order, each one reading the stage added before it.
+    """
+    queue_size: int
+    condition: threading.Condition
+    threads: list[threading.Thread]
+    histograms: dict[str, ChunkSizeHistogram]
+    input_size: int
+
+    def __init__(self, cancel_service: CancelService, queue_size: int = 4, input_size: int = 0) -> None:
+        """
+        :param cancel_service: Service whose cancel event cancels the pipeline
+        :param queue_size: Number of chunks that are buffered between two stages
+        :param input_size: Number of bytes the first stage reads (e.g. the size of the packed files), for its statistics
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        self.cancel_service = cancel_service
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.threads = []
+        self.histograms = {}
+        self.input_size = input_size
+        self.__stages: list[tuple[str, _Channel[Any], list[float]]] = []
+        self.__start = time.monotonic()
+        self.__end: float | None = None
+        self.__cancelled = False
+        self.__error: BaseException | None = None
+        self.__cancel_uuid: uuid.UUID | None = None
+
+    def __enter__(self) -> "Pipeline":
+        self.__start = time.monotonic()
+        self.__cancel_uuid = self.cancel_service.subscribe_to_cancel_event(self.cancel)
+        return self
+
+    def __exit__(self, exception_type: type[BaseException] | None, exception: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        self.__end = time.monotonic()
+        if self.__cancel_uuid is not None:
+            self.cancel_service.unsubscribe_from_cancel_event(self.__cancel_uuid)
+        self.cancel("pipeline closed")
+        for thread in self.threads:
+            thread.join()
+
+    def is_cancelled(self) -> bool:
+        return self.__cancelled
+
+    def raise_if_cancelled(self) -> None:
+        if not self.__cancelled:
+            return
+        if self.__error is not None:
+            raise self.__error
+        raise PipelineCancelledError("The pipeline was cancelled")
+
+    def cancel(self, reason: str = "", error: BaseException | None = None) -> None:
+        """
+        Stops all stages. They raise the error, or a PipelineCancelledError with the reason.
+        """
+        with self.condition:
+            if self.__cancelled:
+                return
+            self.__cancelled = True
+            self.__error = error if error is not None else PipelineCancelledError(f"The pipeline was cancelled: {reason}")
+            self.condition.notify_all()
+
+    def run_stage(self, name: str, stage: Iterable[T]) -> Generator[T, None, None]:
+        """
+        Starts iterating the stage in its own thread.
+
+        :param name: Name of the thread
+        :param stage: Generator of the stage, usually reading from the generator of the previous stage
+        :return: Generator yielding the chunks of the stage in the thread reading them
+        """
+        self.histograms[name] = ChunkSizeHistogram()
+        channel: _Channel[T] = _Channel(self, self.queue_size, self.histograms[name])
+        times: list[float] = []
+        self.__stages.append((name, channel, times))
+        thread = threading.Thread(target=self.__produce, args=(stage, channel, times), name=f"pipeline-{name}", daemon=True)
+        self.threads.append(thread)
+        thread.start()
+        return self.__consume(channel)
+
+    def get_chunk_hold(self, stages: int = 1) -> int:
+        """
+        Returns the number of chunks a stage has to yield before it may reuse the buffer of a chunk it passed on.
+        Up to queue_size chunks are queued and up to queue_size were taken by the next stage,
+        which has to be done with a chunk when it requests the next one.
+
+        :param stages: Number of stages the chunks pass before one copies them, e.g. 2 if the next stage may pass them on unchanged
+        """
+        return stages * (2 * self.queue_size + 1)
+
+    def rechunk(self, data: Iterable[bytes], chunk_size: int, stages: int = 1) -> Generator[bytes, None, None]:
+        """
+        Coalesces the chunks of a stage into chunks of chunk_size bytes, to be passed to run_stage.
+        The buffers are reused once the chunks can not be queued or read by the next stages anymore.
+
+        :param stages: Number of stages the chunks pass before one copies them, see get_chunk_hold
+        """
+        return rechunk(data, chunk_size, BufferPool(chunk_size), hold=self.get_chunk_hold(stages))
+
+    def __produce(self, stage: Iterable[T], channel: _Channel[T], times: list[float]) -> None:
+        times.append(time.monotonic())
+        try:
+            for item in stage:
+                channel.put(item)
+            channel.finish()
+        except PipelineCancelledError:
+            pass
+        except BaseException as exception: # pylint: disable=broad-exception-caught
+            self.cancel(error=exception)
+        finally:
+            close = getattr(stage, "close", None)
+            if close is not None:
+                close()
+            times.append(time.monotonic())
+
+    def get_statistics(self, sink_name: str) -> list[StageStatistics]:
+        """
+        Returns the statistics of every stage, followed by the stage reading the last one (e.g. the upload) in the thread of the pipeline.
+        Only complete after the pipeline was left.
+
+        :param sink_name: Name of the stage reading the last stage
+        """
+        end = self.__end if self.__end is not None else time.monotonic()
+        statistics: list[StageStatistics] = []
+        bytes_in = self.input_size
+        upstream_wait = 0.0
+        for name, channel, times in self.__stages:
+            duration = (times[1] if len(times) > 1 else end) - times[0] if times else 0.0
+            busy = max(0.0, duration - upstream_wait - channel.put_wait_seconds)
+            statistics.append(StageStatistics(name, bytes_in, channel.size, busy, upstream_wait, channel.put_wait_seconds))
+            bytes_in = channel.size
+            upstream_wait = channel.get_wait_seconds
+        statistics.append(StageStatistics(sink_name, bytes_in, bytes_in, max(0.0, end - self.__start - upstream_wait), upstream_wait, 0.0))
+        return statistics
+
+    def get_summary(self, sink_name: str) -> dict[str, Any]:
+        """
+        Returns a compact summary of the statistics, with the duration, the compression ratio if there is a compressor stage
+        and the bottleneck, the stage with the most busy time.
+        """
+        statistics = self.get_statistics(sink_name)
+        end = self.__end if self.__end is not None else time.monotonic()
+        summary: dict[str, Any] = {
+            "duration_seconds": round(end - self.__start, 3),
+            "bottleneck": max(statistics, key=lambda stage: stage.busy_seconds).name,
+            "stages": [stage.as_dict() for stage in statistics]
+        }
+        for stage in statistics:
+            if stage.name == "compressor" and stage.bytes_in > 0:
+                summary["compression_ratio"] = round(stage.bytes_out / stage.bytes_in, 4)
+        return summary
+
+    def __consume(self, channel: _Channel[T]) -> Generator[T, None, None]:
+        try:
+            while True:
+                items = channel.get()
+                if not items:
+                    return
+                yield from items
+        except GeneratorExit:
+            # the next stage stopped reading early, so the stages before it are not needed anymore
+            self.cancel("a stage stopped reading")
+            raise
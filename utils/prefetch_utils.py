@@ -0,0 +1,150 @@
+import io
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Generator, Iterable, cast
+
+from utils.data_utils import BufferPool, readinto_full
+from utils.storage_utils import ScannedFile
+
+def advise_will_need(file: BinaryIO | io.FileIO, length: int) -> None:
+    """
+    Tells the kernel that the start of the file will be read soon, so it reads it ahead. Only where posix_fadvise is available.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(file.fileno(), 0, length, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        # e.g. not supported by the file system, the file is just read without the advice
+        pass
+
+class _PrefetchedFile:
+    """
+    A file opened in the background with the chunks read ahead, as buffers of the pool and the number of bytes read into them.
+    The file is None if it was read completely. held are the buffers of the chunks which were handed on and may still be read.
+    """
+    file: io.FileIO | None
+    chunks: deque[tuple[bytearray, int]]
+    held: deque[bytearray]
+    def __init__(self, file: io.FileIO | None, chunks: deque[tuple[bytearray, int]], buffer_pool: BufferPool) -> None:
+        self.file = file
+        self.chunks = chunks
+        self.held = deque()
+        self.buffer_pool = buffer_pool
+
+    def close(self) -> None:
+        while self.chunks:
+            self.buffer_pool.release(self.chunks.popleft()[0])
+        while self.held:
+            self.buffer_pool.release(self.held.popleft())
+        if self.file is not None:
+            self.file.close()
+
+class FilePrefetcher:
+    """
+    Opens and reads the next files in a pool of threads while the current file is consumed, which hides the latency
+    of opening and reading many small files (e.g. on spinning disks or network storage).
+    The data is handed on in the original order. Up to max_files files are read ahead, each up to an equal share of max_memory,
+    the rest of a larger file is read when it is consumed.
+    The files are read with readinto into the reused buffers of a pool, the chunks are read-only memoryviews of them.
+    A chunk stays valid until chunk_size more bytes of the file were requested, at the latest until the next file is requested,
+    so the reader has to copy what it keeps longer (e.g. by compressing or hashing it).
+    """
+    chunk_size: int
+    max_files: int
+    max_memory: int
+
+    def __init__(self, chunk_size: int, max_files: int = 8, max_memory: int = 64 * 1024 * 1024) -> None:
+        """
+        :param chunk_size: Size of the chunks the files are read in
+        :param max_files: Number of files which are opened and read ahead, including the current one
+        :param max_memory: Number of bytes of all files which are read ahead
+        """
+        if chunk_size < 1 or max_files < 1 or max_memory < 1:
+            raise ValueError("chunk_size, max_files and max_memory must be at least 1")
+        self.chunk_size = chunk_size
+        self.max_files = max_files
+        self.max_memory = max_memory
+
+    def get_file_budget(self) -> int:
+        return max(1, self.max_memory // self.max_files)
+
+    def __open(self, path: str, size: int, buffer_pool: BufferPool) -> _PrefetchedFile:
+        budget = self.get_file_budget()
+        file = open(path, "rb", buffering=0) # pylint: disable=consider-using-with
+        prefetched = _PrefetchedFile(file, deque(), buffer_pool)
+        try:
+            advise_will_need(file, min(size, budget))
+            while budget > 0:
+                buffer = buffer_pool.acquire()
+                length = readinto_full(file, buffer)
+                if length == 0:
+                    buffer_pool.release(buffer)
+                    file.close()
+                    prefetched.file = None
+                    return prefetched
+                prefetched.chunks.append((buffer, length))
+                budget -= length
+            return prefetched
+        except BaseException:
+            prefetched.close()
+            raise
+
+    def __read(self, future: "Future[_PrefetchedFile]", hold: int) -> Generator[bytes, None, None]:
+        prefetched = future.result()
+        while True:
+            if prefetched.chunks:
+                buffer, length = prefetched.chunks.popleft()
+            elif prefetched.file is not None:
+                buffer = prefetched.buffer_pool.acquire()
+                length = readinto_full(prefetched.file, buffer)
+                if length == 0:
+                    prefetched.buffer_pool.release(buffer)
+                    prefetched.file.close()
+                    prefetched.file = None
+                    return
+            else:
+                return
+            prefetched.held.append(buffer)
+            yield cast(bytes, memoryview(buffer)[:length].toreadonly())
+            if len(prefetched.held) > hold:
+                prefetched.buffer_pool.release(prefetched.held.popleft())
+
+    def prefetch(self, files: Iterable[ScannedFile]) -> Generator[tuple[ScannedFile, Generator[bytes, None, None]], None, None]:
+        """
+        Yields every file with a generator of its data, in the order of the files.
+        The data of a file has to be read before the next file is requested. Errors of opening or reading a file
+        are raised by its generator.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_files, thread_name_prefix="prefetcher")
+        # a file reads at most its budget ahead, so smaller buffers are enough if the budget is smaller than a chunk.
+        # A reader coalescing them into chunks of chunk_size (like stream_zip) still reads the earlier ones while it requests the next
+        buffer_pool = BufferPool(min(self.chunk_size, self.get_file_budget()))
+        hold = -(-self.chunk_size // buffer_pool.buffer_size)
+        queue: deque[tuple[ScannedFile, Future[_PrefetchedFile]]] = deque()
+        current: Future[_PrefetchedFile] | None = None
+        iterator = iter(files)
+        def close(future: "Future[_PrefetchedFile]") -> None:
+            # closes the file of a generator which was not read to its end and releases the buffers of its chunks
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().close()
+        try:
+            while True:
+                while len(queue) < self.max_files:
+                    file = next(iterator, None)
+                    if file is None:
+                        break
+                    queue.append((file, executor.submit(self.__open, file[0], file[1].st_size, buffer_pool)))
+                if current is not None:
+                    close(current)
+                if not queue:
+                    return
+                file, current = queue.popleft()
+                yield file, self.__read(current, hold)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for _, future in queue:
+                close(future)
+            if current is not None:
+                close(current)
@@ -1,8 +1,8 @@
 import datetime
-import multiprocessing as mp
 import threading
 import time
 import uuid
+from collections import deque
 from threading import Event
 from typing import Literal
 
@@ -11,6 +11,7 @@ from rich.table import Table
 from dependency_injection.service import Service
 from services.cancel_service import CancelService
 from utils.console_utils import console
+from utils.data_utils import bytes_to_human_readable_size
 
 
 class Reporting():
@@ -26,71 +27,148 @@ class Reporting():
         self.status_message = status_message
         self.log_message = log_message
 
+class StageProgress():
+    """
+    Counters of the data a worker processed. They are plain attributes of the reporting process,
+    so a worker updates them without a lock, the renderer and the metrics only read them.
+    """
+    chunks: int
+    size: int
+    retries: int
+
+    def __init__(self) -> None:
+        self.chunks = 0
+        self.size = 0
+        self.retries = 0
+
+    def add(self, size: int, chunks: int = 1) -> None:
+        self.chunks += chunks
+        self.size += size
+
+    def add_retry(self) -> None:
+        self.retries += 1
+
+    def __str__(self) -> str:
+        return f"{self.chunks} chunks, {bytes_to_human_readable_size(self.size)}"
+
+class WorkerState():
+    def __init__(self, name: str, worker_type: str) -> None:
+        self.name = name
+        self.worker_type = worker_type
+        self.status = "waiting"
+        self.status_message: str | None = None
+        self.progress = StageProgress()
+
+    def get_status(self) -> str:
+        # workers only report their progress while they are working
+        if self.status == "waiting" and self.progress.chunks > 0:
+            return "working"
+        return self.status
+
+    def get_message(self) -> str:
+        if self.progress.chunks == 0:
+            return self.status_message or ""
+        if self.status_message is None:
+            return str(self.progress)
+        return f"{self.status_message} ({self.progress})"
+
 class ReportManager():
-    reports: "mp.Queue[Reporting | Literal['stop']]" = mp.Queue()
+    """
+    Keeps the state of every worker in memory, the workers (threads of the pipeline) update it directly:
+    a report replaces the state of its worker and the progress counters are incremented in place.
+    A renderer thread samples the states at a fixed refresh rate and prints the table and the log messages,
+    so the cost of a report does not depend on how often the display is updated.
+    """
+    refresh_interval: float
+    start_time: float
+    workers: dict[str, WorkerState]
+    log_messages: "deque[str]"
     stop_event: Event
-    printer_process: mp.Process
+    renderer_thread: threading.Thread
     cancel_service: CancelService
     cancel_uuid: uuid.UUID
     lock: threading.Lock
 
-    def __init__(self, service: Service) -> None:
-        self.printer_process = mp.Process(target=self.__report_printer, args=(self.reports,))
-        self.printer_process.start()
+    def __init__(self, service: Service, refresh_interval: float = 0.25) -> None:
+        """
+        :param refresh_interval: Seconds between two updates of the display
+        """
+        self.refresh_interval = refresh_interval
+        self.start_time = time.monotonic()
+        self.workers = {}
+        self.log_messages = deque()
+        self.lock = threading.Lock()
+        self.stop_event = Event()
+        self.renderer_thread = threading.Thread(target=self.__report_renderer, name="report-renderer", daemon=True)
+        self.renderer_thread.start()
         self.cancel_service: CancelService = service.get_service("cancel_service")
         self.cancel_uuid = self.cancel_service.subscribe_to_cancel_event(self.stop_reporting)
-        self.lock = threading.Lock()
 
     def __del__(self) -> None:
         self.stop_reporting()
 
+    def __get_worker(self, worker_type: str, worker_id: uuid.UUID) -> WorkerState:
+        key = str(worker_id)
+        worker = self.workers.get(key)
+        if worker is None:
+            with self.lock:
+                worker = self.workers.setdefault(key, WorkerState(str(len(self.workers) + 1), worker_type))
+        return worker
+
     def add_report(self, report: Reporting) -> None:
+        worker = self.__get_worker(report.worker_type, report.worker_id)
+        worker.status = report.status
+        worker.status_message = report.status_message
+        if report.log_message:
+            self.log_messages.append(f"{report.worker_id} {report.log_message}")
+
+    def get_progress(self, worker_type: Literal["transferer" , "crypter" , "packer" , "compressor"], worker_id: uuid.UUID) -> StageProgress:
+        """
+        Returns the progress counters of a worker, to count every chunk without sending a report for it.
+        """
+        return self.__get_worker(worker_type, worker_id).progress
+
+    def get_stage_progress(self) -> dict[str, StageProgress]:
+        """
+        Returns the progress of all workers summed up by their type.
+        """
         with self.lock:
-            self.reports.put(report)
+            workers = list(self.workers.values())
+        stages: dict[str, StageProgress] = {}
+        for worker in workers:
+            stage = stages.setdefault(worker.worker_type, StageProgress())
+            stage.add(worker.progress.size, worker.progress.chunks)
+            stage.retries += worker.progress.retries
+        return stages
 
     def stop_reporting(self, reason: str = "") -> None:
+        if self.stop_event.is_set():
+            return
         console.print(f"Stopping reporting: {reason}")
-        with self.lock:
-            self.reports.put("stop")
+        self.stop_event.set()
         self.cancel_service.unsubscribe_from_cancel_event(self.cancel_uuid)
-        self.printer_process.join()
+        if threading.current_thread() is not self.renderer_thread:
+            self.renderer_thread.join()
 
-    def __get_queue_element_if_exists(self, queue: "mp.Queue[Reporting | Literal['stop']]") -> Reporting | Literal['stop'] | None:
-        if queue.qsize() == 0:
-            return None
-        return queue.get()
+    def __print_log_messages(self) -> None:
+        while self.log_messages:
+            console.print(f"[purple][{datetime.datetime.now().strftime('%H:%M:%S ')}][/purple] {self.log_messages.popleft()}")
+
+    def __render_table(self) -> Table:
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Worker", justify="center")
+        table.add_column("Job", justify="center")
+        table.add_column("Status", justify="center")
+        table.add_column("Message", justify="center")
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            table.add_row(worker.name, worker.worker_type, worker.get_status(), worker.get_message(), style="bold green")
+        return table
 
-    def __report_printer(self, queue: "mp.Queue[Reporting | Literal['stop']]") -> None:
-        con_message: dict[str, dict[Literal["name", "type", "status", "log_message", "status_message"], str | None]] = {}
+    def __report_renderer(self) -> None:
         with console.status("") as status:
-            while True:
-                report = self.__get_queue_element_if_exists(queue)
-                if report == "stop":
-                    break
-                if report is None:
-                    try:
-                        time.sleep(1)
-                    except KeyboardInterrupt:
-                        break
-                    continue
-                reporter_status: dict[Literal["name","type", "status", "log_message", "status_message"], str | None] = {}
-                worker_name: str
-                if str(report.worker_id) not in con_message:
-                    worker_name = str(len(con_message) + 1)
-                else:
-                    n = con_message[str(report.worker_id)]["name"]
-                    assert n is not None
-                    worker_name = n
-                reporter_status = {"name": worker_name, "type": report.worker_type, "status": report.status, "status_message": report.status_message, "log_message": report.log_message}
-                con_message[str(report.worker_id)] = reporter_status
-                table = Table(show_header=True, header_style="bold magenta")
-                table.add_column("Worker", justify="center")
-                table.add_column("Job", justify="center")
-                table.add_column("Status", justify="center")
-                table.add_column("Message", justify="center")
-                for key, value in con_message.items():
-                    table.add_row(value["name"], value["type"], value["status"], value["status_message"], style="bold green")
-                    if value["log_message"]:
-                        console.print(f"[purple][{datetime.datetime.now().strftime('%H:%M:%S ')}][/purple] {key} {value['log_message']}")
-                        value["log_message"] = None # Set log message to None after printing so that it doesn't print again
-                status.update(table)
+            while not self.stop_event.wait(self.refresh_interval):
+                self.__print_log_messages()
+                status.update(self.__render_table())
+            self.__print_log_messages()
@@ -0,0 +1,60 @@
+import random
+import time
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+class RetryPolicy:
+    """
+    Retries a function with exponential backoff and full jitter.
+    Only exceptions which are classified as retryable are retried, all others are raised right away.
+    """
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0, # pylint: disable=too-many-arguments
+                 is_retryable: Callable[[BaseException], bool] = lambda exception: True,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        :param max_attempts: Maximum number of calls, including the first one
+        :param base_delay: Upper bound of the delay in seconds before the first retry. It doubles with every retry
+        :param max_delay: Upper bound of the delay in seconds between two attempts
+        :param is_retryable: Decides if an exception should be retried
+        :param sleep: Function used to wait between the attempts
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        if base_delay < 0 or max_delay < 0:
+            raise ValueError("delays must not be negative")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_retryable = is_retryable
+        self.sleep = sleep
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Returns the delay before the given retry (starting with 1), chosen at random between 0 and the exponential backoff.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def call(self, function: Callable[[], T], on_retry: Callable[[int, BaseException, float], None] | None = None) -> T:
+        """
+        Calls the function until it succeeds, raises an exception that is not retryable or the attempts are used up.
+
+        :param function: Function to call
+        :param on_retry: Called with the number of the retry, the exception and the delay before every retry
+        """
+        attempt = 1
+        while True:
+            try:
+                return function()
+            except Exception as exception:
+                if attempt >= self.max_attempts or not self.is_retryable(exception):
+                    raise
+                delay = self.get_delay(attempt)
+                if on_retry is not None:
+                    on_retry(attempt, exception, delay)
+                self.sleep(delay)
+                attempt += 1
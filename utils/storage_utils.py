@@ -1,13 +1,163 @@
+import hashlib
+import itertools
 import os
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Generator, Iterable
+
+# a file found by the scanner together with its stat, so it does not have to be read again
+ScannedFile = tuple[str, os.stat_result]
+
+def _scan_directory(directory: str) -> tuple[list[ScannedFile], list[str]]:
+    """
+    Reads one directory. Returns its files sorted by name and its subdirectories, symbolic links to directories are not followed.
+    Like os.walk, a directory or an entry that can not be read is skipped.
+    """
+    files: list[ScannedFile] = []
+    directories: list[str] = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            directories.append(entry.path)
+                    elif entry.is_file():
+                        files.append((entry.path, entry.stat()))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    files.sort(key=lambda file: file[0])
+    directories.sort()
+    return files, directories
+
+def scan_files(paths: Iterable[str], workers: int = 8, ordered: bool = False) -> Generator[ScannedFile, None, None]:
+    """
+    Scans the paths for files with os.scandir, reading the directories in a pool of threads.
+    The files are yielded with their stat while the scan goes on, so they can be processed before the scan is finished.
+
+    :param paths: Files and directories to scan
+    :param workers: Number of threads reading directories
+    :param ordered: Yield the files in a deterministic order: the paths in the given order, in every directory the files
+        sorted by name before its subdirectories. Directories read ahead of that order are kept until they are reached.
+        Otherwise the files of a directory are yielded as soon as it was read
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scanner")
+    keys = itertools.count()
+    pending: dict[Future[tuple[list[ScannedFile], list[str]]], int] = {}
+    results: dict[int, tuple[list[ScannedFile], list[int]]] = {}
+    def submit(directory: str) -> int:
+        key = next(keys)
+        pending[executor.submit(_scan_directory, directory)] = key
+        return key
+    def collect() -> list[int]:
+        # the subdirectories are submitted before the files are handed on, so the threads keep reading while they are processed
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        collected = []
+        for future in done:
+            key = pending.pop(future)
+            files, directories = future.result()
+            results[key] = (files, [submit(directory) for directory in directories])
+            collected.append(key)
+        return collected
+    try:
+        order: list[int] = []
+        for path in paths:
+            if os.path.isfile(path):
+                try:
+                    key = next(keys)
+                    results[key] = ([(path, os.stat(path))], [])
+                except OSError:
+                    continue
+            elif os.path.isdir(path):
+                key = submit(path)
+            else:
+                continue
+            order.append(key)
+        if not ordered:
+            for key in order:
+                if key in results:
+                    yield from results.pop(key)[0]
+            while pending:
+                for key in collect():
+                    yield from results.pop(key)[0]
+            return
+        # a stack of the directories still to yield, the next one on top
+        order.reverse()
+        while order:
+            key = order.pop()
+            while key not in results:
+                collect()
+            files, directories = results.pop(key)
+            order.extend(reversed(directories))
+            yield from files
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def get_profile_database_path(name: str, profile: str, db_directory: str | None = None) -> str:
+    """
+    Returns the path of a database of a profile, e.g. an index. Every profile has its own database.
+
+    :param name: Name of the database, the start of the file name
+    :param db_directory: Directory of the database. Defaults to ~/.ecsu, where the other databases are
+    """
+    if db_directory is None:
+        db_directory = os.path.join(os.path.expanduser("~"), ".ecsu")
+    os.makedirs(db_directory, exist_ok=True)
+    return os.path.join(db_directory, f"{name}_" + re.sub(r"[^A-Za-z0-9_-]", "_", profile) + ".sqlite")
 
 def get_all_files_from_directories_and_files(paths: list[str]) -> list[str]:
-    files = []
-    for path in paths:
-        if os.path.isfile(path):
-            files.append(path)
-        else:
-            for root, _, all_files in os.walk(path):
-                for file in all_files:
-                    file_path = os.path.join(root, file)
-                    files.append(file_path)
-    return files
+    return [path for path, _ in scan_files(paths, ordered=True)]
+
+class FilesFingerprint:
+    """
+    Fingerprint of files computed while they are handed on, e.g. from the scan to the packer, so they do not have to be collected first.
+    Once all files passed, it is the fingerprint get_files_fingerprint returns for them.
+    """
+    file_count: int
+    total_size: int
+
+    def __init__(self, *options: str) -> None:
+        """
+        :param options: Options the files are processed with, they are part of the fingerprint
+        """
+        self.options = options
+        self.file_count = 0
+        self.total_size = 0
+        self.__hash = hashlib.sha256()
+
+    def add(self, file: str, stat: os.stat_result) -> None:
+        self.__hash.update(f"{file}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        self.file_count += 1
+        self.total_size += stat.st_size
+
+    def track(self, files: Iterable[ScannedFile], on_end: Callable[[str], None] | None = None) -> Generator[ScannedFile, None, None]:
+        """
+        Yields the files and adds them to the fingerprint.
+
+        :param on_end: Called with the fingerprint after the last file, not if the files are not read to the end
+        """
+        for file, stat in files:
+            self.add(file, stat)
+            yield file, stat
+        if on_end is not None:
+            on_end(self.hexdigest())
+
+    def hexdigest(self) -> str:
+        fingerprint = self.__hash.copy()
+        for option in self.options:
+            fingerprint.update(f"{option}\n".encode())
+        return fingerprint.hexdigest()
+
+def get_files_fingerprint(files: Iterable[ScannedFile], *options: str) -> str:
+    """
+    Returns a fingerprint of the files and the options they are processed with.
+    It changes if a file is added, removed, reordered or modified (by size or modification time).
+    """
+    fingerprint = FilesFingerprint(*options)
+    for file, stat in files:
+        fingerprint.add(file, stat)
+    return fingerprint.hexdigest()
@@ -0,0 +1,255 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Literal
+
+from utils.data_utils import UploadPart
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD controller for the number of parallel part uploads.
+    After every round of completed parts the aggregate throughput of the round is compared with the previous round:
+    while it keeps rising the limit grows by one, if the last increase did not pay off it goes back by one and holds
+    for a few rounds before probing again. A round with throttled uploads halves the limit, only once however many
+    of its uploads were throttled, as the uploads in flight are usually throttled together.
+    """
+    minimum: int
+    maximum: int
+    limit: int
+
+    def __init__(self, initial: int, minimum: int, maximum: int, # pylint: disable=too-many-arguments
+                 on_decision: Callable[[str], None] | None = None, tolerance: float = 0.05, cooldown_rounds: int = 3,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        :param initial: Number of parallel uploads to start with
+        :param minimum: Lower bound of parallel uploads
+        :param maximum: Upper bound of parallel uploads
+        :param on_decision: Called with a message every time the limit changes
+        :param tolerance: Relative change of the throughput which is considered flat
+        :param cooldown_rounds: Rounds to hold the limit after it was decreased
+        :param clock: Source of the time used to measure the throughput
+        """
+        if not 1 <= minimum <= maximum:
+            raise ValueError("minimum must be at least 1 and not greater than maximum")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+        self.on_decision = on_decision
+        self.tolerance = tolerance
+        self.cooldown_rounds = cooldown_rounds
+        self.clock = clock
+        self.__lock = threading.Lock()
+        self.__last_throughput: float | None = None
+        self.__last_action: Literal["increase", "decrease", "hold"] = "hold"
+        self.__hold_rounds = 0
+        self.__round_start = clock()
+        self.__round_bytes = 0
+        self.__round_parts = 0
+        self.__round_latency = 0.0
+        self.__round_throttled = False
+
+    def get_limit(self) -> int:
+        return self.limit
+
+    def record(self, number_of_bytes: int, duration_seconds: float, throttled: bool = False) -> None:
+        """
+        Records a completed (or throttled) part upload. The limit is reevaluated once a full round of parts was recorded.
+
+        :param number_of_bytes: Bytes uploaded, 0 if the upload failed
+        :param throttled: The upload was throttled, also if a retry succeeded
+        """
+        with self.__lock:
+            self.__round_parts += 1
+            self.__round_latency += duration_seconds
+            self.__round_bytes += number_of_bytes
+            if throttled:
+                self.__round_throttled = True
+            if self.__round_parts < self.limit:
+                return
+            message = self.__evaluate_round()
+        if message is not None and self.on_decision is not None:
+            self.on_decision(message)
+
+    def __increase(self) -> None:
+        # at the maximum there is nothing to undo if the throughput stays flat
+        self.__last_action = "increase" if self.limit < self.maximum else "hold"
+        self.limit = min(self.maximum, self.limit + 1)
+
+    def __evaluate_round(self) -> str | None:
+        now = self.clock()
+        throughput = self.__round_bytes / max(now - self.__round_start, 1e-9)
+        mean_latency = self.__round_latency / self.__round_parts
+        old_limit = self.limit
+        reason: str
+        if self.__round_throttled:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.__last_action = "decrease"
+            self.__hold_rounds = self.cooldown_rounds
+            reason = "throttled"
+        elif self.__last_throughput is None or throughput > self.__last_throughput * (1 + self.tolerance):
+            self.__increase()
+            reason = "throughput rising"
+        elif self.__last_action == "increase":
+            self.limit = max(self.minimum, self.limit - 1)
+            self.__last_action = "decrease"
+            self.__hold_rounds = self.cooldown_rounds
+            reason = "throughput flat"
+        elif self.__hold_rounds > 0:
+            self.__hold_rounds -= 1
+            self.__last_action = "hold"
+            reason = "holding"
+        else:
+            self.__increase()
+            reason = "probing"
+        self.__last_throughput = throughput
+        self.__round_start = now
+        self.__round_bytes = 0
+        self.__round_parts = 0
+        self.__round_latency = 0.0
+        self.__round_throttled = False
+        if self.limit == old_limit:
+            return None
+        return (f"Upload workers {old_limit} -> {self.limit} ({reason}): "
+                f"{throughput / 1024 / 1024:.1f} MiB/s, {mean_latency:.1f} s per part")
+
+
+class PartUploader:
+    """
+    Uploads the parts of a multipart upload in a pool of threads.
+    The number of parts which are queued or uploading at the same time is limited,
+    so submit blocks (without polling) until one of the uploads finished.
+    With a concurrency controller the limit follows the controller and every finished upload is recorded by it once,
+    as throttled if it failed with a throttling error or a retry of it was throttled (see report_throttling).
+    Every part is released after its upload, so the assembler can reuse the buffer of the part.
+    """
+    workers: int
+    max_in_flight: int
+    futures: dict[int, "Future[Any]"]
+
+    def __init__(self, upload_function: Callable[[UploadPart], Any], workers: int, max_in_flight: int | None = None, # pylint: disable=too-many-arguments
+                 concurrency_controller: AdaptiveConcurrencyController | None = None,
+                 is_throttling_error: Callable[[BaseException], bool] = lambda exception: False) -> None:
+        """
+        :param upload_function: Function that uploads one part. It is called in one of the worker threads
+        :param workers: Number of threads uploading parts. With a concurrency controller this should be its maximum
+        :param max_in_flight: Maximum number of parts that are queued or uploading. Defaults to the number of workers
+        :param concurrency_controller: Controller which decides how many parts are uploaded at the same time
+        :param is_throttling_error: Decides if an exception of the upload function was caused by throttling
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.upload_function = upload_function
+        self.workers = workers
+        self.max_in_flight = max_in_flight if max_in_flight is not None else workers
+        if self.max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.concurrency_controller = concurrency_controller
+        self.is_throttling_error = is_throttling_error
+        self.futures = {}
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="part-uploader")
+        self.__condition = threading.Condition()
+        self.__in_flight = 0
+        self.__failed = threading.Event()
+        self.__cancelled = False
+        self.__throttled_parts: set[int] = set()
+
+    def __get_limit(self) -> int:
+        if self.concurrency_controller is not None:
+            return self.concurrency_controller.get_limit()
+        return self.max_in_flight
+
+    def submit(self, part: UploadPart) -> "Future[Any]":
+        with self.__condition:
+            while self.__in_flight >= self.__get_limit() and not self.__cancelled:
+                self.__condition.wait()
+            if self.__cancelled:
+                # shut down from another thread, the part is recorded as cancelled instead of failing on the executor
+                part.release()
+                future: Future[Any] = Future()
+                future.cancel()
+                future.set_running_or_notify_cancel()
+                self.futures[part.index] = future
+                return future
+            self.__in_flight += 1
+            try:
+                future = self.__executor.submit(self.__upload, part)
+            except BaseException:
+                self.__finish_in_flight()
+                part.release()
+                raise
+        self.futures[part.index] = future
+        future.add_done_callback(lambda done_future: self.__on_done(part, done_future))
+        return future
+
+    def report_throttling(self, part: UploadPart) -> None:
+        """
+        Marks the part as throttled, e.g. by the upload function before it retries. The part is recorded by the concurrency
+        controller once, when its upload finished.
+        """
+        with self.__condition:
+            self.__throttled_parts.add(part.index)
+
+    def __was_throttled(self, part: UploadPart) -> bool:
+        with self.__condition:
+            if part.index not in self.__throttled_parts:
+                return False
+            self.__throttled_parts.remove(part.index)
+            return True
+
+    def __upload(self, part: UploadPart) -> Any:
+        start = time.monotonic()
+        try:
+            result = self.upload_function(part)
+        except Exception as exception:
+            throttled = self.__was_throttled(part) or self.is_throttling_error(exception)
+            if self.concurrency_controller is not None and throttled:
+                self.concurrency_controller.record(0, time.monotonic() - start, throttled=True)
+            raise
+        throttled = self.__was_throttled(part)
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.record(part.size, time.monotonic() - start, throttled=throttled)
+        return result
+
+    def __finish_in_flight(self) -> None:
+        with self.__condition:
+            self.__in_flight -= 1
+            # the limit may have changed, so every waiting submit has to check it again
+            self.__condition.notify_all()
+
+    def __on_done(self, part: UploadPart, future: "Future[Any]") -> None:
+        part.release()
+        self.__finish_in_flight()
+        if future.cancelled() or future.exception() is not None:
+            self.__failed.set()
+
+    def has_failed(self) -> bool:
+        return self.__failed.is_set()
+
+    def wait(self) -> dict[int, BaseException]:
+        """
+        Waits until all submitted parts are uploaded.
+        :return: The exceptions of the parts that failed, by part index
+        """
+        wait(self.futures.values())
+        failed_parts: dict[int, BaseException] = {}
+        for index, future in self.futures.items():
+            if future.cancelled():
+                failed_parts[index] = Exception("Upload was cancelled")
+                continue
+            exception = future.exception()
+            if exception is not None:
+                failed_parts[index] = exception
+        return failed_parts
+
+    def shutdown(self, cancel_pending: bool = False) -> None:
+        """
+        Stops the worker threads. It can be called from another thread while parts are submitted.
+        :param cancel_pending: Cancels the parts that did not start and every part submitted afterwards
+        """
+        if cancel_pending:
+            with self.__condition:
+                self.__cancelled = True
+                self.__failed.set()
+                self.__condition.notify_all()
+        self.__executor.shutdown(wait=not cancel_pending, cancel_futures=cancel_pending)
@@ -0,0 +1,55 @@
+import zlib
+
+from utils.data_utils import StreamSplitter
+
+STREAM_HEADER_MAGIC = b"\xfd7zXZ\x00"
+STREAM_FOOTER_MAGIC = b"YZ"
+STREAM_HEADER_SIZE = 12
+STREAM_FOOTER_SIZE = 12
+
+def is_stream_header(header: bytes | bytearray | memoryview) -> bool:
+    """
+    Checks the magic bytes, the reserved bits of the flags and the CRC32 of the flags of an xz stream header.
+    """
+    header = bytes(header)
+    return (len(header) == STREAM_HEADER_SIZE
+            and header[:6] == STREAM_HEADER_MAGIC
+            and header[6] == 0 and header[7] & 0xF0 == 0
+            and zlib.crc32(header[6:8]) == int.from_bytes(header[8:12], "little"))
+
+def is_stream_footer(footer: bytes | bytearray | memoryview) -> bool:
+    """
+    Checks the magic bytes, the reserved bits of the flags and the CRC32 of the backward size and the flags of an xz stream footer.
+    """
+    footer = bytes(footer)
+    return (len(footer) == STREAM_FOOTER_SIZE
+            and footer[10:12] == STREAM_FOOTER_MAGIC
+            and footer[8] == 0 and footer[9] & 0xF0 == 0
+            and zlib.crc32(footer[4:10]) == int.from_bytes(footer[0:4], "little"))
+
+def find_stream_end(buffer: bytes | bytearray, start: int = STREAM_HEADER_SIZE) -> int:
+    """
+    Returns the end of the first xz stream in the buffer, which is the position of the header of the next stream,
+    or -1 if the buffer does not contain the start of a next stream.
+    A boundary is a valid stream footer, optionally followed by stream padding, followed by a valid stream header.
+
+    :param start: Position to start searching for the next stream header
+    """
+    position = buffer.find(STREAM_HEADER_MAGIC, start)
+    while position != -1 and position + STREAM_HEADER_SIZE <= len(buffer):
+        if is_stream_header(buffer[position:position + STREAM_HEADER_SIZE]):
+            footer_end = position
+            # stream padding consists of multiples of four null bytes
+            while footer_end >= 4 and buffer[footer_end - 4:footer_end] == b"\0\0\0\0":
+                footer_end -= 4
+            if footer_end >= STREAM_HEADER_SIZE + STREAM_FOOTER_SIZE and is_stream_footer(buffer[footer_end - STREAM_FOOTER_SIZE:footer_end]):
+                return position
+        position = buffer.find(STREAM_HEADER_MAGIC, position + 1)
+    return -1
+
+class XzStreamSplitter(StreamSplitter):
+    """
+    Splits concatenated xz streams (like the blocks of a parallel compression) into single streams while the data arrives.
+    """
+    def __init__(self, max_stream_size: int) -> None:
+        super().__init__(find_stream_end, STREAM_HEADER_SIZE, max_stream_size)